@@ -0,0 +1,120 @@
+import asyncio
+from collections import deque
+from fastapi import Depends, Request
+from . import metrics
+from .config import (
+    ADMISSION_ENABLED, ADMISSION_LIMIT, ADMISSION_LIMITS, ADMISSION_QUEUE, ADMISSION_QUEUE_TIMEOUT,
+    ADMISSION_HEAVY_LIMIT, ADMISSION_HEAVY_QUEUE, ADMISSION_HEAVY_ROUTES, ADMISSION_RETRY_AFTER,
+)
+
+# admission control in front of the connection pool. every router has a concurrency limit of its own, so one slow
+# router can't take every connection, and a short queue behind it. a request that finds the queue full, or waits
+# longer than ADMISSION_QUEUE_TIMEOUT, is answered right away with a 503 and Retry-After instead of piling up
+# on the pool until the worker times out.
+# heavy routes (ADMISSION_HEAVY_ROUTES: big reads, bulk writes, exports) share one more, smaller limit across
+# routers, have a shorter queue and are let in only after the cheap requests waiting on the same router,
+# so they are shed first.
+
+class Overloaded(Exception):
+    def __init__(self, limiter: str, retry_after: int = ADMISSION_RETRY_AFTER):
+        super().__init__({"statement": "Server is overloaded, retry later.", "params": limiter})
+        self.retry_after = retry_after
+
+class Limiter:
+    def __init__(self, name: str, limit: int, queue: int, heavy_queue: int):
+        self.name = name
+        self.limit = limit
+        self.queue = queue
+        self.heavy_queue = heavy_queue
+        self.active = 0
+        # cheap waiters are woken before heavy ones
+        self._waiters = {False: deque(), True: deque()}
+        self.admitted = 0
+        self.rejected = 0
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters[False]) + len(self._waiters[True])
+
+    async def acquire(self, heavy: bool = False):
+        if self.active < self.limit and not self.waiting:
+            self.active += 1
+            self.admitted += 1
+            return
+        waiters = self._waiters[heavy]
+        if len(waiters) >= (self.heavy_queue if heavy else self.queue):
+            self.rejected += 1
+            raise Overloaded(self.name)
+        future = asyncio.get_running_loop().create_future()
+        waiters.append(future)
+        try:
+            await asyncio.wait_for(asyncio.shield(future), ADMISSION_QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            if future.done():
+                # the slot was handed over just as the wait ran out, take it after all
+                self.admitted += 1
+                return
+            waiters.remove(future)
+            self.rejected += 1
+            raise Overloaded(self.name)
+        except asyncio.CancelledError:
+            if future.done():
+                self.release()
+            else:
+                waiters.remove(future)
+            raise
+        self.admitted += 1
+
+    def release(self):
+        # a released slot goes straight to the next waiter, so active only drops when nobody is waiting
+        for heavy in (False, True):
+            waiters = self._waiters[heavy]
+            if waiters:
+                waiters.popleft().set_result(None)
+                return
+        self.active -= 1
+
+_heavy = Limiter("heavy", ADMISSION_HEAVY_LIMIT, ADMISSION_HEAVY_QUEUE, ADMISSION_HEAVY_QUEUE)
+_routers: dict[str, Limiter] = {}
+
+def _limiter(router: str) -> Limiter:
+    if router not in _routers:
+        _routers[router] = Limiter(router, ADMISSION_LIMITS.get(router, ADMISSION_LIMIT), ADMISSION_QUEUE, ADMISSION_HEAVY_QUEUE)
+    return _routers[router]
+
+def admit(router: str):
+    # router dependency holding a slot of the router (and of the heavy limit) until the response has been sent
+    limiter = _limiter(router)
+
+    async def admission(request: Request):
+        if not ADMISSION_ENABLED:
+            yield
+            return
+        heavy = f"{request.method} {request.scope['route'].path}" in ADMISSION_HEAVY_ROUTES
+        await limiter.acquire(heavy)
+        try:
+            if heavy:
+                await _heavy.acquire(heavy)
+                try:
+                    yield
+                finally:
+                    _heavy.release()
+            else:
+                yield
+        finally:
+            limiter.release()
+    return Depends(admission)
+
+def render() -> list[str]:
+    limiters = sorted(_routers.values(), key=lambda limiter: limiter.name) + [_heavy]
+    lines = []
+    for name, help, type_, attribute in [
+        ("admission_active_requests", "Requests holding an admission slot.", "gauge", "active"),
+        ("admission_waiting_requests", "Requests queued for an admission slot.", "gauge", "waiting"),
+        ("admission_rejected_total", "Requests answered with 503 by admission control.", "counter", "rejected"),
+    ]:
+        lines += [f"# HELP {name} {help}", f"# TYPE {name} {type_}"]
+        lines += [f'{name}{{limiter="{limiter.name}"}} {getattr(limiter, attribute)}' for limiter in limiters]
+    return lines
+
+metrics.register_collector(render)
@@ -0,0 +1,29 @@
+from math import ceil
+from .config import GRADE_PASS_THRESHOLD
+
+PERCENTILES = (10, 25, 50, 75, 90)
+
+def summarize(histogram: dict[int, int]) -> dict:
+    """Mean, percentiles and pass rate computed exactly from a {grade: count} histogram."""
+    count = sum(histogram.values())
+    if not count:
+        return {"count": 0, "mean": None, "pass_rate": None, "histogram": {}, "percentiles": {}}
+
+    grades = sorted(histogram)
+    percentiles = {}
+    for percentile in PERCENTILES:
+        # nearest-rank: the smallest grade with at least p% of all grades at or below it
+        rank, seen = ceil(percentile / 100 * count), 0
+        for grade in grades:
+            seen += histogram[grade]
+            if seen >= rank:
+                percentiles[f"p{percentile}"] = grade
+                break
+
+    return {
+        "count": count,
+        "mean": sum(grade * histogram[grade] for grade in grades) / count,
+        "pass_rate": sum(histogram[grade] for grade in grades if grade >= GRADE_PASS_THRESHOLD) / count,
+        "histogram": {grade: histogram[grade] for grade in grades},
+        "percentiles": percentiles,
+    }
@@ -0,0 +1,107 @@
+import asyncio
+from bisect import bisect_left
+from datetime import datetime, timezone
+from sqlalchemy import select
+from . import models, schemas
+from .config import AVAILABILITY_REFRESH_SECONDS
+from .db import async_session
+from .serialization import out_columns
+
+# in-memory mirror of auditorium bookings, answers "which rooms are free between X and Y" without touching the database
+# per auditorium we keep the booked [start, end) intervals as parallel lists sorted by start.
+# the timeslots exclusion constraint guarantees they never overlap, so sorting by start also sorts by end,
+# and a room is free iff the last interval starting before Y ends at or before X: one bisect per room.
+# writes made through crud update it in place, the periodic refresh picks up writes made by other workers.
+
+def as_naive(value: datetime) -> datetime:
+    # timestamps are stored without time zone, aware input is taken as UTC
+    if value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+class _Bookings:
+    __slots__ = ("starts", "ends", "ids")
+
+    def __init__(self):
+        self.starts: list[datetime] = []
+        self.ends: list[datetime] = []
+        self.ids: list[int] = []
+
+    def add(self, timeslot_id: int, start: datetime, end: datetime):
+        index = bisect_left(self.starts, start)
+        self.starts.insert(index, start)
+        self.ends.insert(index, end)
+        self.ids.insert(index, timeslot_id)
+
+    def remove(self, timeslot_id: int, start: datetime):
+        index = bisect_left(self.starts, start)
+        while index < len(self.starts) and self.starts[index] == start:
+            if self.ids[index] == timeslot_id:
+                del self.starts[index], self.ends[index], self.ids[index]
+                return
+            index += 1
+
+    def is_free(self, start: datetime, end: datetime) -> bool:
+        index = bisect_left(self.starts, end)
+        return index == 0 or self.ends[index - 1] <= start
+
+class AvailabilityIndex:
+    def __init__(self):
+        self.auditoriums: dict[int, dict] = {}
+        self.bookings: dict[int, _Bookings] = {}
+        self.ready = False
+
+    async def load(self):
+        async with async_session() as session:
+            # kept as AuditoriumOut dicts, the available route sends them out as they are
+            auditorium_query = await session.execute(select(*out_columns(schemas.AuditoriumOut, models.Auditorium)).order_by(models.Auditorium.id))
+            timeslot_query = await session.execute(
+                select(models.Timeslot.id, models.Timeslot.auditorium_id, models.Timeslot.start, models.Timeslot.end)
+                .order_by(models.Timeslot.auditorium_id, models.Timeslot.start)
+            )
+            auditoriums = {row.id: dict(row._mapping) for row in auditorium_query}
+            bookings = {auditorium_id: _Bookings() for auditorium_id in auditoriums}
+            for row in timeslot_query:
+                # rows arrive sorted, appending keeps every list ordered without bisecting
+                room = bookings.setdefault(row.auditorium_id, _Bookings())
+                room.starts.append(row.start)
+                room.ends.append(row.end)
+                room.ids.append(row.id)
+        # swap both maps at once so readers never see a half built index
+        self.auditoriums, self.bookings = auditoriums, bookings
+        self.ready = True
+
+    def add_timeslot(self, timeslot: models.Timeslot):
+        self.bookings.setdefault(timeslot.auditorium_id, _Bookings()).add(timeslot.id, timeslot.start, timeslot.end)
+
+    def remove_timeslot(self, timeslot: models.Timeslot):
+        room = self.bookings.get(timeslot.auditorium_id)
+        if room is not None:
+            room.remove(timeslot.id, timeslot.start)
+
+    def available(self, start: datetime, end: datetime, has_projector: bool | None = None,
+                  has_board: bool | None = None, min_capacity: int | None = None) -> list[dict]:
+        start, end = as_naive(start), as_naive(end)
+        free = []
+        for auditorium_id, auditorium in self.auditoriums.items():
+            if has_projector is not None and auditorium["has_projector"] != has_projector:
+                continue
+            if has_board is not None and auditorium["has_board"] != has_board:
+                continue
+            if min_capacity is not None and (auditorium["max_capacity"] or 0) < min_capacity:
+                continue
+            room = self.bookings.get(auditorium_id)
+            if room is None or room.is_free(start, end):
+                free.append(auditorium)
+        return free
+
+    async def refresh_forever(self):
+        while True:
+            await asyncio.sleep(AVAILABILITY_REFRESH_SECONDS)
+            try:
+                await self.load()
+            except Exception as ex:
+                # keep serving the previous snapshot, the next refresh will try again
+                print(f"Availability index refresh failed: {ex!r}")
+
+availability_index = AvailabilityIndex()
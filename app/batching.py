@@ -0,0 +1,81 @@
+import asyncio
+from typing import Any, Awaitable, Callable
+from fastapi import HTTPException, Query
+from .config import MULTI_GET_MAX_IDS
+
+# dataloader-style coalescing of single-id lookups: every id asked for within `window` seconds is fetched by
+# one query, and callers asking for an id that is already queued or being fetched share its future.
+# a batch runs on its own session, so results are never tied to the session of whoever asked first
+
+class BatchLoader:
+    def __init__(self, batch: Callable[[list[int]], Awaitable[dict[int, Any]]], window: float, max_size: int):
+        self.batch = batch
+        self.window = window
+        self.max_size = max_size
+        self._queued: dict[int, asyncio.Future] = {}
+        self._in_flight: dict[int, asyncio.Future] = {}
+        self._timer: asyncio.TimerHandle | None = None
+        self._tasks: set[asyncio.Task] = set()
+        self.loads = 0
+        self.shared = 0
+        self.batches = 0
+
+    async def load(self, id: int) -> Any:
+        self.loads += 1
+        future = self._queued.get(id) or self._in_flight.get(id)
+        if future is not None:
+            self.shared += 1
+        else:
+            loop = asyncio.get_running_loop()
+            future = self._queued[id] = loop.create_future()
+            if len(self._queued) >= self.max_size:
+                self._dispatch()
+            elif self._timer is None:
+                self._timer = loop.call_later(self.window, self._dispatch)
+        # a cancelled caller must not cancel the future the other callers of this id are waiting on
+        return await asyncio.shield(future)
+
+    def _dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        queued, self._queued = self._queued, {}
+        if not queued:
+            return
+        self._in_flight.update(queued)
+        task = asyncio.get_running_loop().create_task(self._run(queued))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, futures: dict[int, asyncio.Future]):
+        self.batches += 1
+        try:
+            results = await self.batch(list(futures))
+        except Exception as ex:
+            for future in futures.values():
+                if not future.done():
+                    future.set_exception(ex)
+        else:
+            for id, future in futures.items():
+                if not future.done():
+                    future.set_result(results.get(id))
+        finally:
+            for id, future in futures.items():
+                if self._in_flight.get(id) is future:
+                    del self._in_flight[id]
+
+    def forget(self, *ids: int):
+        # after a write to these ids: lookups from now on start a new query instead of sharing one that may have
+        # read the rows before the write. the callers already waiting keep their result
+        for id in ids:
+            self._in_flight.pop(id, None)
+
+    def stats(self) -> dict:
+        return {"loads": self.loads, "shared": self.shared, "batches": self.batches}
+
+def id_list(ids: str = Query(..., regex=r"^\d+(,\d+)*$", description="Comma separated ids", example="1,2,3")) -> list[int]:
+    # dependency for multi-get routes: the ids in the order given, without repeats
+    parsed = list(dict.fromkeys(int(id) for id in ids.split(",")))
+    if len(parsed) > MULTI_GET_MAX_IDS:
+        raise HTTPException(status_code=422, detail={"statement": f"At most {MULTI_GET_MAX_IDS} ids can be requested at once.", "params": len(parsed)})
+    return parsed
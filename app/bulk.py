@@ -0,0 +1,72 @@
+import csv
+import io
+import json
+from typing import Type
+from fastapi import HTTPException, Request
+from pydantic import BaseModel, ValidationError
+from starlette.datastructures import UploadFile
+from .config import BULK_MAX_ROWS
+
+# bulk endpoints accept the same rows in a few shapes:
+# a JSON array, NDJSON (one object per line) or CSV with a header row,
+# either as the raw request body or as a multipart upload in the "file" field
+
+def _detect_format(content_type: str, filename: str | None = None) -> str:
+    content_type = (content_type or "").split(";")[0].strip().lower()
+    if content_type in ("application/x-ndjson", "application/ndjson", "application/jsonl"):
+        return "ndjson"
+    if content_type in ("text/csv", "application/csv"):
+        return "csv"
+    if content_type == "application/json":
+        return "json"
+    if filename:
+        if filename.endswith((".ndjson", ".jsonl")):
+            return "ndjson"
+        if filename.endswith(".csv"):
+            return "csv"
+        if filename.endswith(".json"):
+            return "json"
+    raise HTTPException(status_code=415, detail={"statement": "Unsupported bulk upload format.", "params": content_type})
+
+def _parse(body: bytes, format: str) -> list:
+    text = body.decode("utf-8-sig")
+    if format == "json":
+        rows = json.loads(text)
+        if not isinstance(rows, list):
+            raise ValueError("Expected a JSON array of rows.")
+        return rows
+    if format == "ndjson":
+        # keep blank lines out of the row numbering clients see in errors
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+    # empty CSV cells mean "not set", the same as a missing key in JSON
+    return [{k: v for k, v in row.items() if v != ""} for row in csv.DictReader(io.StringIO(text))]
+
+async def read_rows(request: Request) -> list:
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        form = await request.form()
+        upload = form.get("file")
+        if not isinstance(upload, UploadFile):
+            raise HTTPException(status_code=400, detail={"statement": "Multipart upload must contain a \"file\" field.", "params": None})
+        body = await upload.read()
+        format = _detect_format(upload.content_type, upload.filename)
+    else:
+        body = await request.body()
+        format = _detect_format(content_type)
+
+    try:
+        rows = _parse(body, format)
+    except (ValueError, UnicodeDecodeError, csv.Error) as ex:
+        raise HTTPException(status_code=400, detail={"statement": "Bulk upload could not be parsed.", "params": str(ex)})
+    if len(rows) > BULK_MAX_ROWS:
+        raise HTTPException(status_code=413, detail={"statement": "Too many rows in bulk upload.", "params": BULK_MAX_ROWS})
+    return rows
+
+def validate_rows(rows: list, schema: Type[BaseModel]) -> tuple[list[tuple[int, BaseModel]], list[dict]]:
+    valid, errors = [], []
+    for index, row in enumerate(rows):
+        try:
+            valid.append((index, schema.parse_obj(row)))
+        except ValidationError as ex:
+            errors.append({"row": index, "errors": ex.errors()})
+    return valid, errors
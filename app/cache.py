@@ -0,0 +1,231 @@
+import json
+import time
+from collections import Counter, OrderedDict
+from typing import Any, Awaitable, Callable
+from .config import CACHE_ENABLED, CACHE_MAX_ENTRIES, CACHE_TTL, CACHE_NEGATIVE_TTL, CACHE_REDIS_URL, DB_POOL_TIMEOUT
+
+# read-through cache for hot single-row lookups (students, courses)
+# values are plain dicts of column values, never ORM objects, so they can't leak state between sessions
+# None is a valid cached value and means "this id does not exist" (kept for CACHE_NEGATIVE_TTL only)
+# loaders read from the primary, a replica could still hand back the row as it was before the write that just
+# invalidated it. a load that was running when its key got invalidated may have read the old row, its result
+# is returned to its callers but not cached.
+# without a shared backend every worker has its own LRU and invalidations only reach the worker that made the
+# write, other workers serve their copy for up to CACHE_TTL. with one (CACHE_REDIS_URL) the shared backend is
+# the only layer: an invalidation leaves a tombstone there and loads only store into free keys, so a load that
+# started before the write, in any worker, can't put the old row back.
+
+_MISSING = object()
+# how long an invalidated key stays closed to loads, longer than a load can take (its wait for a connection included)
+TOMBSTONE_TTL = DB_POOL_TIMEOUT + 5.0
+_TOMBSTONE = ""
+
+class LRUCache:
+    """In-process LRU with per-entry expiry, bounded by CACHE_MAX_ENTRIES."""
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            return _MISSING
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            self.expirations += 1
+            return _MISSING
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any, ttl: float | None = None):
+        self._entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def delete(self, key: str):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+class LocalBackend:
+    """Shared-backend stand-in that lives in this process, for tests and single-worker setups."""
+    def __init__(self):
+        self._entries: dict[str, tuple[float, str]] = {}
+
+    async def get(self, key: str) -> str | None:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            self._entries.pop(key, None)
+            return None
+        return entry[1]
+
+    async def get_many(self, keys: list[str]) -> list[str | None]:
+        return [await self.get(key) for key in keys]
+
+    async def set(self, key: str, value: str, ttl: float, only_new: bool = False):
+        if only_new and await self.get(key) is not None:
+            return
+        self._entries[key] = (time.monotonic() + ttl, value)
+
+    async def delete(self, key: str):
+        self._entries.pop(key, None)
+
+class RedisBackend:
+    """Cache shared by every worker, redis is an optional dependency and only imported when configured."""
+    def __init__(self, url: str):
+        try:
+            from redis import asyncio as redis
+        except ImportError:
+            raise RuntimeError("CACHE_REDIS_URL is set but the redis package is not installed.")
+        self._client = redis.from_url(url, decode_responses=True)
+
+    async def get(self, key: str) -> str | None:
+        return await self._client.get(key)
+
+    async def get_many(self, keys: list[str]) -> list[str | None]:
+        return await self._client.mget(keys)
+
+    async def set(self, key: str, value: str, ttl: float, only_new: bool = False):
+        await self._client.set(key, value, px=int(ttl * 1000), nx=only_new)
+
+    async def delete(self, key: str):
+        await self._client.delete(key)
+
+class EntityCache:
+    def __init__(self, local: LRUCache, shared=None, enabled: bool = True, negative_ttl: float = CACHE_NEGATIVE_TTL):
+        self.local = local
+        self.shared = shared
+        self.enabled = enabled
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.misses = 0
+        self.stale_loads = 0
+        # key -> invalidations while a load of it is running, only kept for keys with loads running
+        self._generations: dict[str, int] = {}
+        self._loading: Counter[str] = Counter()
+        self._listeners: dict[str, list[Callable]] = {}
+
+    @staticmethod
+    def _key(namespace: str, id: int) -> str:
+        return f"{namespace}:{id}"
+
+    def on_invalidate(self, namespace: str, listener: Callable):
+        # e.g. a BatchLoader's forget(), so lookups after a write don't join a query that started before it
+        self._listeners.setdefault(namespace, []).append(listener)
+
+    async def _get(self, keys: list[str]) -> list[Any]:
+        if self.shared is None:
+            return [self.local.get(key) for key in keys]
+        raws = await self.shared.get_many(keys)
+        # a tombstone reads as a miss
+        return [_MISSING if raw is None or raw == _TOMBSTONE else json.loads(raw) for raw in raws]
+
+    async def _load(self, keys: list[str], loader: Callable[[], Awaitable[Any]]) -> Any:
+        # runs the loader and reports which of the keys were invalidated while it ran
+        for key in keys:
+            self._loading[key] += 1
+            self._generations.setdefault(key, 0)
+        generations = [self._generations[key] for key in keys]
+        try:
+            loaded = await loader()
+        finally:
+            invalidated = set()
+            for key, generation in zip(keys, generations):
+                if self._generations[key] != generation:
+                    invalidated.add(key)
+                self._loading[key] -= 1
+                if not self._loading[key]:
+                    del self._loading[key], self._generations[key]
+        self.stale_loads += len(invalidated)
+        return loaded, invalidated
+
+    async def _store(self, key: str, value: Any):
+        ttl = self.local.ttl if value is not None else self.negative_ttl
+        if self.shared is None:
+            self.local.set(key, value, ttl)
+        else:
+            await self.shared.set(key, json.dumps(value, default=str), ttl, only_new=True)
+
+    async def fetch(self, namespace: str, id: int, loader: Callable[[], Awaitable[dict | None]], fresh: bool = False) -> dict | None:
+        # fresh skips the cached value and stores what the loader returns in its place
+        if not self.enabled:
+            return await loader()
+        key = self._key(namespace, id)
+        if not fresh:
+            [value] = await self._get([key])
+            if value is not _MISSING:
+                self.hits += 1
+                return value
+
+        self.misses += 1
+        value, invalidated = await self._load([key], loader)
+        if not invalidated:
+            await self._store(key, value)
+        return value
+
+    async def fetch_many(self, namespace: str, ids: list[int], loader: Callable[[list[int]], Awaitable[dict[int, dict]]]) -> dict[int, dict | None]:
+        # fetch() for several ids, the ones not cached are loaded by a single call of the loader
+        if not self.enabled:
+            loaded = await loader(ids)
+            return {id: loaded.get(id) for id in ids}
+        found, missing = {}, []
+        for id, value in zip(ids, await self._get([self._key(namespace, id) for id in ids])):
+            if value is _MISSING:
+                missing.append(id)
+            else:
+                found[id] = value
+
+        self.hits += len(ids) - len(missing)
+        self.misses += len(missing)
+        if missing:
+            keys = [self._key(namespace, id) for id in missing]
+            loaded, invalidated = await self._load(keys, lambda: loader(missing))
+            for id, key in zip(missing, keys):
+                value = found[id] = loaded.get(id)
+                if key not in invalidated:
+                    await self._store(key, value)
+        return found
+
+    async def invalidate(self, namespace: str, *ids: int | None):
+        # call after the write has committed
+        if not self.enabled:
+            return
+        ids = [id for id in ids if id is not None]
+        for id in ids:
+            key = self._key(namespace, id)
+            if key in self._generations:
+                self._generations[key] += 1
+            self.local.delete(key)
+            if self.shared is not None:
+                await self.shared.set(key, _TOMBSTONE, TOMBSTONE_TTL)
+        for listener in self._listeners.get(namespace, []):
+            listener(*ids)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale_loads": self.stale_loads,
+            "shared": self.shared is not None,
+            "evictions": self.local.evictions,
+            "expirations": self.local.expirations,
+            "size": len(self.local),
+            "max_entries": self.local.max_entries,
+        }
+
+entity_cache = EntityCache(
+    LRUCache(CACHE_MAX_ENTRIES, CACHE_TTL),
+    RedisBackend(CACHE_REDIS_URL) if CACHE_REDIS_URL else None,
+    enabled=CACHE_ENABLED,
+)
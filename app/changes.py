@@ -0,0 +1,242 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+import asyncpg
+import orjson
+from fastapi import HTTPException, Request
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+from . import metrics, models, schemas
+from .availability import as_naive
+from .config import CHANGES_POLL_INTERVAL, CHANGES_PUBLISH_DELAY, CHANGES_RETENTION_DAYS, PAGE_SIZE_MAX, RETENTION_BATCH_SIZE, RETENTION_BATCH_PAUSE
+from .db import async_session, engine
+from .serialization import out_columns
+
+# change feed for systems mirroring students, courses and grades. the crud writes append the rows they changed
+# to change_outbox (a transactional outbox) right before they commit, so a change exists exactly when the write
+# does, together with the id of the transaction that made it. writes don't wait on each other for that.
+# seq has to grow in commit order, or a consumer could move past a change that commits later with a smaller
+# number, so outbox rows only get their seq when they are published to the changes table: once every transaction
+# older than theirs has finished (below the snapshot's xmin), in outbox order, and never past an outbox row that
+# committed but is still above the horizon. a write that is still open can't share rows with anything published
+# before it, record() runs after all its writes and holds their row locks until the commit. the feed lags behind
+# the oldest open write transaction of the cluster.
+# one worker publishes at a time and NOTIFYs the batch, every worker listens on one connection of its own and wakes
+# its long-polls and SSE streams, CHANGES_POLL_INTERVAL is only the fallback when notifications don't arrive.
+
+# taken by the publisher, and by the writes of workers from before the outbox, so both agree on the next seq
+OUTBOX_LOCK_ID = 7_310_420_024
+CHANNEL = "changes"
+ENTITIES = {"student": models.Student.__tablename__, "course": models.Course.__tablename__, "grade": models.Grade.__tablename__}
+PUBLISH_BATCH_SIZE = 5000
+
+async def record(session: AsyncSession | AsyncConnection, entity: str, ids, op: str = "upsert"):
+    # call last before the commit: upserts snapshot the rows as they are now, deletes only carry the id
+    if isinstance(session, AsyncSession):
+        # text() doesn't autoflush, the snapshot has to see the session's pending changes
+        await session.flush()
+    ids = sorted(set(ids))
+    if not ids or engine.dialect.name != "postgresql":
+        return
+    params = {"entity": entity, "op": op, "ids": ids}
+    if op == "delete":
+        await session.execute(text(
+            "INSERT INTO change_outbox (entity, entity_id, op) SELECT :entity, id, :op FROM unnest(CAST(:ids AS INTEGER[])) AS id ORDER BY id"
+        ), params)
+    else:
+        await session.execute(text(
+            f"INSERT INTO change_outbox (entity, entity_id, op, data) SELECT :entity, t.id, :op, to_jsonb(t) FROM {ENTITIES[entity]} t "
+            "WHERE t.id = ANY(:ids) ORDER BY t.id"
+        ), params)
+    change_feed.written()
+
+async def publish() -> int:
+    # moves the outbox rows that are final into the feed, a batch per transaction. returns 0 when another
+    # worker is publishing, it takes these rows along
+    published = 0
+    while True:
+        async with engine.begin() as conn:
+            if not (await conn.execute(text("SELECT pg_try_advisory_xact_lock(:id)"), {"id": OUTBOX_LOCK_ID})).scalar():
+                return published
+            seq_query = await conn.execute(text(
+                "WITH horizon AS (SELECT CAST(CAST(pg_snapshot_xmin(pg_current_snapshot()) AS text) AS bigint) AS xmin), "
+                "pending AS (SELECT min(o.id) AS id FROM change_outbox o, horizon WHERE o.txid >= horizon.xmin), "
+                "ready AS ("
+                "DELETE FROM change_outbox WHERE id IN ("
+                "SELECT o.id FROM change_outbox o, horizon, pending WHERE o.txid < horizon.xmin AND (pending.id IS NULL OR o.id < pending.id) "
+                "ORDER BY o.id LIMIT :limit"
+                ") RETURNING id, entity, entity_id, op, data, created_at), "
+                "base AS (SELECT greatest((SELECT max(seq) FROM changes), (SELECT max(compacted_through) FROM change_compaction), 0) AS seq) "
+                "INSERT INTO changes (seq, entity, entity_id, op, data, created_at) "
+                "SELECT base.seq + row_number() OVER (ORDER BY ready.id), ready.entity, ready.entity_id, ready.op, ready.data, ready.created_at "
+                "FROM ready, base RETURNING seq"
+            ), {"limit": PUBLISH_BATCH_SIZE})
+            seqs = seq_query.scalars().all()
+            if seqs:
+                # keeps the column's own sequence ahead, for the writes of workers from before the outbox
+                await conn.execute(text("SELECT setval(pg_get_serial_sequence('changes', 'seq'), :seq)"), {"seq": max(seqs)})
+                await conn.execute(text(f"NOTIFY {CHANNEL}"))
+        published += len(seqs)
+        if len(seqs) < PUBLISH_BATCH_SIZE:
+            return published
+
+async def compact(days: int = CHANGES_RETENTION_DAYS) -> int:
+    # removes changes older than `days` from the head of the feed, a batch per transaction. only ever a prefix,
+    # so compacted_through is exact: every seq up to it is gone, every seq after it is still there
+    if not days:
+        return 0
+    cutoff = as_naive(datetime.now(timezone.utc)) - timedelta(days=days)
+    compacted = 0
+    while True:
+        async with engine.begin() as conn:
+            head_query = await conn.execute(
+                select(models.Change.seq, models.Change.created_at).order_by(models.Change.seq).limit(RETENTION_BATCH_SIZE)
+            )
+            head = head_query.all()
+            expired = 0
+            while expired < len(head) and head[expired].created_at < cutoff:
+                expired += 1
+            if expired:
+                through = head[expired - 1].seq
+                await conn.execute(text("DELETE FROM changes WHERE seq <= :through"), {"through": through})
+                await conn.execute(text(
+                    "INSERT INTO change_compaction (id, compacted_through) VALUES (1, :through) ON CONFLICT (id) DO UPDATE "
+                    "SET compacted_through = greatest(change_compaction.compacted_through, excluded.compacted_through), compacted_at = now()"
+                ), {"through": through})
+        compacted += expired
+        if expired < RETENTION_BATCH_SIZE:
+            return compacted
+        await asyncio.sleep(RETENTION_BATCH_PAUSE)
+
+class ChangeFeed:
+    def __init__(self):
+        self._event = asyncio.Event()
+        self._listener: asyncpg.Connection | None = None
+        self._written = asyncio.Event()
+        self._publisher: asyncio.Task | None = None
+        self.waiting = 0
+        self.notifications = 0
+        self.published = 0
+
+    async def start(self):
+        if engine.dialect.name != "postgresql":
+            return
+        try:
+            self._listener = await asyncpg.connect(engine.url.set(drivername="postgresql").render_as_string(hide_password=False))
+            await self._listener.add_listener(CHANNEL, self._notified)
+        except (OSError, asyncpg.PostgresError) as ex:
+            self._listener = None
+            print(f"Change feed can't listen for notifications, falling back to polling: {ex!r}")
+        self._publisher = asyncio.create_task(self._publish_forever())
+
+    async def stop(self):
+        if self._publisher is not None:
+            self._publisher.cancel()
+            self._publisher = None
+        if self._listener is not None:
+            await self._listener.close()
+            self._listener = None
+
+    def written(self):
+        self._written.set()
+
+    async def _publish_forever(self):
+        # shortly after every write of this worker, and every poll interval for the writes of workers that went
+        # away before publishing them
+        delay = CHANGES_POLL_INTERVAL
+        while True:
+            try:
+                await asyncio.wait_for(self._written.wait(), delay)
+                delay = CHANGES_PUBLISH_DELAY
+            except asyncio.TimeoutError:
+                pass
+            # gives the write that woke us the time to commit, and batches the ones right behind it
+            await asyncio.sleep(CHANGES_PUBLISH_DELAY)
+            self._written.clear()
+            try:
+                published = await publish()
+            except Exception as ex:
+                print(f"Change feed publishing failed: {ex!r}")
+                published = 0
+            self.published += published
+            # nothing final yet, the write is still open: retry, backing off to the poll interval
+            delay = CHANGES_PUBLISH_DELAY if published else min(delay * 2, CHANGES_POLL_INTERVAL)
+
+    def _notified(self, *args):
+        # wakes everyone waiting on the current event, later waiters get a fresh one
+        self.notifications += 1
+        self._event.set()
+        self._event = asyncio.Event()
+
+    async def _wait(self, event: asyncio.Event, timeout: float):
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self.waiting -= 1
+
+    async def check_since(self, since: int):
+        async with async_session() as session:
+            compaction_query = await session.execute(select(models.ChangeCompaction.compacted_through).where(models.ChangeCompaction.id == 1))
+            compacted_through = compaction_query.scalar() or 0
+        if since < compacted_through:
+            raise HTTPException(status_code=410, detail={
+                "statement": "Changes after this point have been compacted, resync and continue from the current feed.",
+                "params": {"since": since, "compacted_through": compacted_through},
+            })
+
+    async def read(self, since: int, limit: int, entities: list[str] | None = None) -> list[dict]:
+        # from the primary, a replica could still be behind the notification that woke us.
+        # a session per read, nobody holds a pooled connection while waiting
+        query = select(*out_columns(schemas.ChangeOut, models.Change)).where(models.Change.seq > since).order_by(models.Change.seq).limit(limit)
+        if entities:
+            query = query.where(models.Change.entity.in_(entities))
+        async with async_session() as session:
+            change_query = await session.execute(query)
+            return [row._asdict() for row in change_query]
+
+    async def poll(self, since: int, limit: int, entities: list[str] | None, wait: float) -> list[dict]:
+        # long-poll: returns as soon as there is anything after `since`, or empty once `wait` seconds have passed
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + wait
+        while True:
+            # taken before the read, so a change committed during the read still wakes us
+            event = self._event
+            changes = await self.read(since, limit, entities)
+            remaining = deadline - loop.time()
+            if changes or remaining <= 0:
+                return changes
+            await self._wait(event, min(remaining, CHANGES_POLL_INTERVAL))
+
+    async def stream(self, request: Request, since: int, entities: list[str] | None):
+        # server-sent events until the client goes away, the event id is the seq to resume from (Last-Event-ID)
+        while not await request.is_disconnected():
+            event = self._event
+            changes = await self.read(since, PAGE_SIZE_MAX, entities)
+            for change in changes:
+                yield b"id: %d\nevent: change\ndata: %s\n\n" % (change["seq"], orjson.dumps(change))
+            if changes:
+                since = changes[-1]["seq"]
+                if len(changes) == PAGE_SIZE_MAX:
+                    continue
+            else:
+                # keeps proxies from closing an idle stream
+                yield b": keep-alive\n\n"
+            await self._wait(event, CHANGES_POLL_INTERVAL)
+
+    def render(self) -> list[str]:
+        return [
+            "# HELP change_feed_waiting Long-polls and SSE streams waiting for changes.",
+            "# TYPE change_feed_waiting gauge",
+            f"change_feed_waiting {self.waiting}",
+            "# HELP change_feed_notifications_total Change notifications received from the database.",
+            "# TYPE change_feed_notifications_total counter",
+            f"change_feed_notifications_total {self.notifications}",
+            "# HELP change_feed_published_total Changes this worker moved from the outbox into the feed.",
+            "# TYPE change_feed_published_total counter",
+            f"change_feed_published_total {self.published}",
+        ]
+
+change_feed = ChangeFeed()
+metrics.register_collector(change_feed.render)
@@ -0,0 +1,36 @@
+from fastapi import Request, Response
+
+# conditional requests on top of the row version columns (see Student.version in models.py).
+# the version alone is the entity tag, tags are only ever compared for the same URL
+
+def etag(version: int) -> str:
+    return f'"{version}"'
+
+def revalidating(request: Request) -> bool:
+    # a conditional GET checks the version against the database and not the cache: another worker's cached copy
+    # can be a version behind, and a 304 or ETag for it would make the client's next If-Match write fail
+    return "if-none-match" in request.headers
+
+def not_modified(request: Request, version: int) -> Response | None:
+    # a 304 for a client that already has this version, returned before anything gets serialized
+    header = request.headers.get("if-none-match")
+    if header is None:
+        return None
+    # If-None-Match uses the weak comparison, W/ prefixes don't matter
+    tags = [tag.strip().removeprefix("W/") for tag in header.split(",")]
+    if "*" in tags or etag(version) in tags:
+        return Response(status_code=304, headers={"ETag": etag(version)})
+    return None
+
+def expected_versions(request: Request) -> set[int] | None:
+    # the versions a write's If-Match accepts, None when there is no precondition
+    header = request.headers.get("if-match")
+    if header is None or header.strip() == "*":
+        return None
+    versions = set()
+    for tag in header.split(","):
+        tag = tag.strip()
+        # If-Match uses the strong comparison, weak and foreign tags match nothing
+        if len(tag) > 2 and tag[0] == tag[-1] == '"' and tag[1:-1].isdigit():
+            versions.add(int(tag[1:-1]))
+    return versions
@@ -1,5 +1,5 @@
 from starlette.config import Config
-from starlette.datastructures import Secret
+from starlette.datastructures import CommaSeparatedStrings, Secret
 
 config = Config(".env")
 
@@ -16,4 +16,128 @@ DATABASE_URL = config(
   "DATABASE_URL",
   cast=str,
   default=f"postgresql+asyncpg://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_SERVER}:{POSTGRES_PORT}/{POSTGRES_DB}"
-)
\ No newline at end of file
+)
+
+# comma separated, GET routes read from these (round robin) and fall back to DATABASE_URL when none is reachable
+DATABASE_REPLICA_URLS = config("DATABASE_REPLICA_URLS", cast=CommaSeparatedStrings, default="")
+# seconds an unreachable replica is skipped before we try it again
+DATABASE_REPLICA_RETRY_AFTER = config("DATABASE_REPLICA_RETRY_AFTER", cast=float, default=30.0)
+
+# pool settings are per engine and per worker process, size them against max_connections / (workers * engines)
+DB_ECHO = config("DB_ECHO", cast=bool, default=False)
+DB_POOL_SIZE = config("DB_POOL_SIZE", cast=int, default=5)
+DB_MAX_OVERFLOW = config("DB_MAX_OVERFLOW", cast=int, default=5)
+# seconds to wait for a pooled connection, a request that runs out of it gets a 503 instead of hanging on
+DB_POOL_TIMEOUT = config("DB_POOL_TIMEOUT", cast=float, default=5.0)
+DB_POOL_RECYCLE = config("DB_POOL_RECYCLE", cast=int, default=1800)
+DB_POOL_PRE_PING = config("DB_POOL_PRE_PING", cast=bool, default=True)
+# asyncpg prepared statements cached per connection, set to 0 behind pgbouncer in transaction mode
+DB_STATEMENT_CACHE_SIZE = config("DB_STATEMENT_CACHE_SIZE", cast=int, default=100)
+# connections per engine every worker opens (and prepares the hot statements on) before it reports ready, 0 to skip
+DB_POOL_WARM = config("DB_POOL_WARM", cast=int, default=DB_POOL_SIZE)
+
+PAGE_SIZE_DEFAULT = config("PAGE_SIZE_DEFAULT", cast=int, default=100)
+PAGE_SIZE_MAX = config("PAGE_SIZE_MAX", cast=int, default=1000)
+# rows fetched per round trip from server-side cursors, also the number of lines per streamed chunk
+STREAM_CHUNK_SIZE = config("STREAM_CHUNK_SIZE", cast=int, default=500)
+
+# upper bound on rows accepted by one bulk request, everything is inserted in one transaction
+BULK_MAX_ROWS = config("BULK_MAX_ROWS", cast=int, default=50000)
+# rows per savepoint of a bulk insert, a row the database rejects costs a row by row retry of its chunk
+BULK_CHUNK_SIZE = config("BULK_CHUNK_SIZE", cast=int, default=1000)
+
+# read-through cache for student and course lookups, see app/cache.py
+CACHE_ENABLED = config("CACHE_ENABLED", cast=bool, default=True)
+CACHE_MAX_ENTRIES = config("CACHE_MAX_ENTRIES", cast=int, default=10000)
+CACHE_TTL = config("CACHE_TTL", cast=float, default=60.0)
+CACHE_NEGATIVE_TTL = config("CACHE_NEGATIVE_TTL", cast=float, default=5.0)
+# optional cache shared between workers, e.g. redis://localhost:6379/0 (requires the redis package)
+CACHE_REDIS_URL = config("CACHE_REDIS_URL", cast=str, default="")
+
+# seconds between full reloads of the auditorium availability index, picks up bookings made by other workers
+AVAILABILITY_REFRESH_SECONDS = config("AVAILABILITY_REFRESH_SECONDS", cast=float, default=60.0)
+# seconds between reloads of the in-memory faculty/department/building/group tree (app/org.py)
+ORG_REFRESH_SECONDS = config("ORG_REFRESH_SECONDS", cast=float, default=300.0)
+
+# lowest grade that counts as a pass in grade analytics
+GRADE_PASS_THRESHOLD = config("GRADE_PASS_THRESHOLD", cast=int, default=3)
+
+# per-route request metrics at /metrics, see app/metrics.py
+METRICS_ENABLED = config("METRICS_ENABLED", cast=bool, default=True)
+# adds a Server-Timing header (db, pool, serialize, app, total) to every response, readable in browser dev tools
+SERVER_TIMING = config("SERVER_TIMING", cast=bool, default=False)
+# a request running more SQL statements than this logs a warning, 0 turns the check off
+QUERY_BUDGET = config("QUERY_BUDGET", cast=int, default=20)
+# comma separated per-route budgets as "METHOD /route=N", e.g. "GET /courses/{course_id}/students=3"
+QUERY_BUDGET_OVERRIDES = {
+  route: int(budget)
+  for route, budget in (entry.rsplit("=", 1) for entry in config("QUERY_BUDGET_OVERRIDES", cast=CommaSeparatedStrings, default=""))
+}
+
+# concurrent single-id student and course lookups that miss the cache are fetched together, see app/batching.py.
+# seconds a lookup waits for others to join its query, and the most ids in one query
+LOOKUP_BATCH_WINDOW = config("LOOKUP_BATCH_WINDOW", cast=float, default=0.002)
+LOOKUP_BATCH_MAX_SIZE = config("LOOKUP_BATCH_MAX_SIZE", cast=int, default=500)
+# most ids accepted by GET /students/?ids= and GET /courses/?ids=
+MULTI_GET_MAX_IDS = config("MULTI_GET_MAX_IDS", cast=int, default=1000)
+
+# group commit for POST /grades/, see app/group_commit.py: submissions are written together, at most
+# GRADE_GROUP_COMMIT_WINDOW seconds after the first one arrived or once GRADE_GROUP_COMMIT_MAX_SIZE are waiting
+GRADE_GROUP_COMMIT = config("GRADE_GROUP_COMMIT", cast=bool, default=False)
+GRADE_GROUP_COMMIT_WINDOW = config("GRADE_GROUP_COMMIT_WINDOW", cast=float, default=0.01)
+GRADE_GROUP_COMMIT_MAX_SIZE = config("GRADE_GROUP_COMMIT_MAX_SIZE", cast=int, default=200)
+# submissions allowed to wait at once, beyond that new ones wait for room in the queue
+GRADE_GROUP_COMMIT_QUEUE_SIZE = config("GRADE_GROUP_COMMIT_QUEUE_SIZE", cast=int, default=5000)
+
+# admission control, see app/admission.py. concurrent requests per router and how many may queue behind them
+ADMISSION_ENABLED = config("ADMISSION_ENABLED", cast=bool, default=True)
+ADMISSION_LIMIT = config("ADMISSION_LIMIT", cast=int, default=32)
+# comma separated per-router limits as "router=N", e.g. "students=64,semesters=4"
+ADMISSION_LIMITS = {
+  router: int(limit)
+  for router, limit in (entry.rsplit("=", 1) for entry in config("ADMISSION_LIMITS", cast=CommaSeparatedStrings, default=""))
+}
+# with group commit, grade submissions wait in the commit queue and not on the pool, let as many in as it holds
+if GRADE_GROUP_COMMIT:
+  ADMISSION_LIMITS.setdefault("grades", GRADE_GROUP_COMMIT_QUEUE_SIZE)
+ADMISSION_QUEUE = config("ADMISSION_QUEUE", cast=int, default=64)
+# seconds a queued request waits for a slot before it gets a 503
+ADMISSION_QUEUE_TIMEOUT = config("ADMISSION_QUEUE_TIMEOUT", cast=float, default=2.0)
+# Retry-After of the 503s, in seconds
+ADMISSION_RETRY_AFTER = config("ADMISSION_RETRY_AFTER", cast=int, default=1)
+# routes shed first, as "METHOD /route"; together they never hold more than ADMISSION_HEAVY_LIMIT slots
+ADMISSION_HEAVY_ROUTES = set(config("ADMISSION_HEAVY_ROUTES", cast=CommaSeparatedStrings, default=",".join([
+  "GET /courses/{course_id}/students",
+  "PUT /courses/{course_id}/grades",
+  "POST /courses/{course_id}/enroll",
+  "POST /courses/{course_id}/unenroll",
+  "POST /students/bulk",
+  "POST /semesters/{semester_id}/schedule",
+  "GET /semesters/{semester_id}/grades/export",
+  "POST /analytics/grades/rebuild",
+  "POST /analytics/counters/reconcile",
+])))
+ADMISSION_HEAVY_LIMIT = config("ADMISSION_HEAVY_LIMIT", cast=int, default=max(1, (DB_POOL_SIZE + DB_MAX_OVERFLOW) // 2))
+ADMISSION_HEAVY_QUEUE = config("ADMISSION_HEAVY_QUEUE", cast=int, default=8)
+
+# retention job, see app/retention.py: rows older than this many days are archived to archived_rows and deleted, 0 keeps them
+TASK_RETENTION_DAYS = config("TASK_RETENTION_DAYS", cast=int, default=365)
+TIMESLOT_RETENTION_DAYS = config("TIMESLOT_RETENTION_DAYS", cast=int, default=365)
+RETENTION_ENABLED = config("RETENTION_ENABLED", cast=bool, default=True)
+# seconds between passes, rows per transaction and seconds of pause between two batches
+RETENTION_INTERVAL = config("RETENTION_INTERVAL", cast=float, default=3600.0)
+RETENTION_BATCH_SIZE = config("RETENTION_BATCH_SIZE", cast=int, default=500)
+RETENTION_BATCH_PAUSE = config("RETENTION_BATCH_PAUSE", cast=float, default=0.2)
+
+# seconds between recounts of the denormalized counters (app/counters.py), and counter rows locked per recount transaction
+COUNTER_RECONCILE_SECONDS = config("COUNTER_RECONCILE_SECONDS", cast=float, default=3600.0)
+COUNTER_RECONCILE_BATCH = config("COUNTER_RECONCILE_BATCH", cast=int, default=1000)
+
+# change feed (app/changes.py): longest long-poll of GET /changes/, seconds between re-reads when no notification
+# arrives (and between SSE heartbeats), and days changes are kept before compaction
+CHANGES_MAX_WAIT = config("CHANGES_MAX_WAIT", cast=float, default=30.0)
+CHANGES_POLL_INTERVAL = config("CHANGES_POLL_INTERVAL", cast=float, default=5.0)
+CHANGES_RETENTION_DAYS = config("CHANGES_RETENTION_DAYS", cast=int, default=7)
+# seconds the publisher waits after a write before moving it into the feed, and its shortest retry while a write
+# hasn't committed yet. the retries back off to CHANGES_POLL_INTERVAL
+CHANGES_PUBLISH_DELAY = config("CHANGES_PUBLISH_DELAY", cast=float, default=0.005)
\ No newline at end of file
@@ -0,0 +1,106 @@
+import asyncio
+from datetime import datetime
+from sqlalchemy import ARRAY, Integer, column, func, literal, select, text, update
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+from . import changes, metrics, models
+from .cache import entity_cache
+from .config import COUNTER_RECONCILE_SECONDS, COUNTER_RECONCILE_BATCH
+from .db import engine
+
+# denormalized counters (Course.student_count and graded_count, Group.student_count, Auditorium.booked_minutes),
+# moved by adjust() in the same transaction as the write in crud.py that changes what they count.
+# reconcile() recounts them from the base tables and repairs whatever drifted, e.g. through writes made
+# outside the API. it locks a chunk of counter rows before recounting it: a write that is still running has
+# either locked its counter row already (the recount waits for it and then sees its rows) or will lock it
+# after the recount (and then adds its delta on top of the repaired value), so the repair never loses one.
+# a course's counters are part of its representation, changing them bumps its version and so its ETag
+
+# model -> counter -> recount of the row aliased as t
+RECOUNTS = {
+    models.Course: {
+        "student_count": "SELECT count(*) FROM course_students cs WHERE cs.course_id = t.id",
+        "graded_count": "SELECT count(*) FROM course_students cs JOIN grades g ON g.student_id = cs.student_id AND g.course_id = cs.course_id WHERE cs.course_id = t.id",
+    },
+    models.Group: {
+        "student_count": "SELECT count(*) FROM students s WHERE s.group_id = t.id",
+    },
+    models.Auditorium: {
+        "booked_minutes": 'SELECT coalesce(sum(floor(extract(epoch FROM ts."end" - ts.start) / 60)), 0) FROM timeslots ts WHERE ts.auditorium_id = t.id',
+    },
+}
+
+_repaired: dict[str, int] = {}
+
+def minutes(start: datetime, end: datetime) -> int:
+    # whole minutes, rounded down like the recount does
+    return int((end - start).total_seconds() // 60)
+
+async def adjust(session: AsyncSession | AsyncConnection, model, **counters: dict[int, int]):
+    # counters are counter name -> {row id: change}, applied with one UPDATE ... FROM unnest() in id order
+    ids = sorted({id for deltas in counters.values() for id, delta in deltas.items() if id is not None and delta})
+    if not ids:
+        return
+    deltas = func.unnest(
+        literal(ids, ARRAY(Integer)),
+        *(literal([deltas.get(id, 0) for id in ids], ARRAY(Integer)) for deltas in counters.values()),
+    ).table_valued(column("id", Integer), *(column(counter, Integer) for counter in counters)).render_derived(name="deltas")
+    table = model.__table__
+    values = {counter: table.c[counter] + deltas.c[counter] for counter in counters}
+    if "version" in table.c:
+        values["version"] = table.c.version + 1
+    await session.execute(update(table).where(table.c.id == deltas.c.id).values(values))
+
+async def _reconcile_model(model, batch: int) -> dict[str, list[int]]:
+    table = model.__tablename__
+    bump = ", version = target.version + 1" if "version" in model.__table__.c else ""
+    repaired = {counter: [] for counter in RECOUNTS[model]}
+    async with engine.connect() as conn:
+        max_id = (await conn.execute(select(func.max(model.id)))).scalar() or 0
+    for start in range(0, max_id + 1, batch):
+        bounds = {"start": start, "end": start + batch}
+        async with engine.begin() as conn:
+            await conn.execute(text(f"SELECT id FROM {table} WHERE id >= :start AND id < :end ORDER BY id FOR UPDATE"), bounds)
+            chunk = set()
+            for counter, recount in RECOUNTS[model].items():
+                repaired_query = await conn.execute(text(
+                    f"UPDATE {table} target SET {counter} = actual.n{bump} "
+                    f"FROM (SELECT t.id, ({recount}) AS n FROM {table} t WHERE t.id >= :start AND t.id < :end) actual "
+                    f"WHERE target.id = actual.id AND target.{counter} <> actual.n RETURNING target.id"
+                ), bounds)
+                ids = repaired_query.scalars().all()
+                repaired[counter] += ids
+                chunk.update(ids)
+            if model is models.Course:
+                await changes.record(conn, "course", chunk)
+    return repaired
+
+async def reconcile(batch: int = COUNTER_RECONCILE_BATCH) -> dict[str, int]:
+    # counter -> number of rows it was wrong in
+    report = {}
+    for model in RECOUNTS:
+        for counter, ids in (await _reconcile_model(model, batch)).items():
+            name = f"{model.__tablename__}.{counter}"
+            report[name] = len(ids)
+            _repaired[name] = _repaired.get(name, 0) + len(ids)
+            if model is models.Course:
+                await entity_cache.invalidate("course", *ids)
+    return report
+
+async def reconcile_forever():
+    if engine.dialect.name != "postgresql":
+        return
+    while True:
+        await asyncio.sleep(COUNTER_RECONCILE_SECONDS)
+        try:
+            report = await reconcile()
+            if any(report.values()):
+                print(f"Counters repaired: {report}")
+        except Exception as ex:
+            print(f"Counter reconciliation failed: {ex!r}")
+
+def render() -> list[str]:
+    lines = ["# HELP counter_repairs_total Rows whose denormalized counter was found wrong and repaired.", "# TYPE counter_repairs_total counter"]
+    lines += [f'counter_repairs_total{{counter="{name}"}} {count}' for name, count in sorted(_repaired.items())]
+    return lines
+
+metrics.register_collector(render)
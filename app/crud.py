@@ -1,10 +1,20 @@
-from datetime import datetime
+import asyncio
+from collections import Counter
+from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
-from sqlalchemy.exc import IntegrityError, NoResultFound
-from sqlalchemy import select
-from sqlalchemy.orm import selectinload
-from sqlalchemy.ext.asyncio import AsyncSession
-from . import models, schemas
+from sqlalchemy.exc import DBAPIError, IntegrityError, NoResultFound
+from sqlalchemy import ARRAY, Integer, Row, any_, bindparam, column, delete, func, insert, literal, or_, select, tuple_, union_all
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncResult, AsyncSession
+from sqlalchemy.orm.exc import StaleDataError
+from . import changes, counters, models, scheduler, schemas
+from .availability import availability_index, as_naive
+from .batching import BatchLoader
+from .cache import entity_cache
+from .db import async_session
+from .org import org_tree
+from .serialization import out_columns
+from .config import BULK_CHUNK_SIZE, STREAM_CHUNK_SIZE, LOOKUP_BATCH_WINDOW, LOOKUP_BATCH_MAX_SIZE
 
 async def add_student(session: AsyncSession, schema: schemas.StudentCreate) -> models.Student:
     group_query = await session.execute(select(models.Group).where(models.Group.id == schema.group_id))
@@ -15,24 +25,170 @@ async def add_student(session: AsyncSession, schema: schemas.StudentCreate) -> m
     student = models.Student(**schema.dict(), group=group)
     session.add(student)
     try:
+        await counters.adjust(session, models.Group, student_count={schema.group_id: 1})
+        await session.flush()
+        await changes.record(session, "student", [student.id])
         await session.commit()
+        await entity_cache.invalidate("student", student.id)
         return student
     except IntegrityError as ex:
         await session.rollback()
         raise IntegrityError("Student add failed.", ex.params, ex.orig)
 
-async def get_student(session: AsyncSession, student_id: int) -> models.Student:
-    student_query = await session.execute(select(models.Student).where(models.Student.id == student_id))
-    student = student_query.scalar()
-    if student is None:
+async def bulk_add_students(session: AsyncSession, rows: list[tuple[int, schemas.StudentCreate]]) -> tuple[list[int], list[dict]]:
+    # rows are (position in the upload, schema) so errors can point back at the client's row
+    group_ids = {schema.group_id for _, schema in rows}
+    group_query = await session.execute(select(models.Group.id).where(models.Group.id.in_(group_ids)))
+    existing_groups = set(group_query.scalars().all())
+
+    errors, values = [], []
+    for index, schema in rows:
+        if schema.group_id not in existing_groups:
+            errors.append({"row": index, "errors": "Group with this id does not exist.", "params": schema.group_id})
+            continue
+        values.append((index, schema.dict()))
+
+    if not values:
+        return [], errors
+
+    inserted = []
+    for start in range(0, len(values), BULK_CHUNK_SIZE):
+        chunk = values[start:start + BULK_CHUNK_SIZE]
+        try:
+            inserted += zip(await _insert_student_chunk(session, [student for _, student in chunk]), chunk)
+        except DBAPIError as ex:
+            if ex.connection_invalidated:
+                raise
+            # the chunk went back to its savepoint, its rows are retried one by one so only the rejected ones are left out
+            for index, student in chunk:
+                try:
+                    inserted += zip(await _insert_student_chunk(session, [student]), [(index, student)])
+                except DBAPIError as ex:
+                    if ex.connection_invalidated:
+                        raise
+                    errors.append({"row": index, "errors": f"Student could not be inserted: {ex.orig}", "params": student["group_id"]})
+
+    student_ids = [student_id for student_id, _ in inserted]
+    await counters.adjust(session, models.Group, student_count=Counter(student["group_id"] for _, (_, student) in inserted))
+    await changes.record(session, "student", student_ids)
+    await session.commit()
+    await entity_cache.invalidate("student", *student_ids)
+    return student_ids, errors
+
+async def _insert_student_chunk(session: AsyncSession, values: list[dict]) -> list[int]:
+    # executemany through insertmanyvalues (multi-row INSERTs of up to a thousand rows) inside a savepoint,
+    # a rejected row only undoes its own chunk and not the rows already inserted by the request
+    async with session.begin_nested():
+        student_query = await session.execute(
+            insert(models.Student).returning(models.Student.id, sort_by_parameter_order=True),
+            values,
+        )
+        return student_query.scalars().all()
+
+async def _load_rows(session: AsyncSession, model, ids: list[int]) -> dict[int, dict]:
+    # one array parameter instead of IN (...): the same prepared statement serves every number of ids
+    row_query = await session.execute(
+        select(model.__table__).where(model.id == any_(bindparam("ids", ids, type_=ARRAY(Integer))))
+    )
+    return {row.id: row._asdict() for row in row_query}
+
+async def _load_rows_batch(model, ids: list[int]) -> dict[int, dict]:
+    # from the primary, what lands in the cache must not be older than the write that last invalidated it
+    async with async_session() as session:
+        return await _load_rows(session, model, ids)
+
+# single-id lookups that miss the cache go through these, concurrent requests end up in one query
+student_loader = BatchLoader(lambda ids: _load_rows_batch(models.Student, ids), LOOKUP_BATCH_WINDOW, LOOKUP_BATCH_MAX_SIZE)
+course_loader = BatchLoader(lambda ids: _load_rows_batch(models.Course, ids), LOOKUP_BATCH_WINDOW, LOOKUP_BATCH_MAX_SIZE)
+entity_cache.on_invalidate("student", student_loader.forget)
+entity_cache.on_invalidate("course", course_loader.forget)
+
+async def get_student(student_id: int, fresh: bool = False) -> dict:
+    # column values from the cache, or from the loader's batched query on the primary (always with fresh).
+    # no session of the caller's is involved, a cache hit doesn't touch the database at all
+    data = await entity_cache.fetch("student", student_id, lambda: student_loader.load(student_id), fresh)
+    if data is None:
         raise NoResultFound({"statement": "Student with this id does not exist.", "params": student_id})
-    return student
+    return data
 
-async def update_student(session: AsyncSession, student_id: int, schema: schemas.StudentUpdate) -> models.Student:
+async def get_students(student_ids: list[int]) -> dict[int, dict | None]:
+    # cached students first, then the rest in a single query
+    return await entity_cache.fetch_many("student", student_ids, lambda ids: _load_rows_batch(models.Student, ids))
+
+async def get_student_transcript(session: AsyncSession, student_id: int) -> dict:
+    # one statement and plain columns: the student, group and department repeat on every course row,
+    # which is far cheaper than the lazy loads the relationships would otherwise trigger per course and grade
+    Student, Group, Department, Course, Semester, Grade = models.Student, models.Group, models.Department, models.Course, models.Semester, models.Grade
+    transcript_query = await session.execute(
+        select(
+            Student.id, Student.group_id, Student.name, Student.phone, Student.address,
+            Group.enrolled_at, Group.department_id, Group.student_count,
+            Department.faculty_id, Department.name.label("department_name"), Department.desc.label("department_desc"), Department.url.label("department_url"),
+            Course.id.label("course_id"), Course.name.label("course_name"), Course.semester_id,
+            Semester.start.label("semester_start"), Semester.end.label("semester_end"),
+            Grade.id.label("grade_id"), Grade.grade,
+        )
+        .join(Group, Group.id == Student.group_id)
+        .join(Department, Department.id == Group.department_id)
+        .outerjoin(models.course_students, models.course_students.c.student_id == Student.id)
+        .outerjoin(Course, Course.id == models.course_students.c.course_id)
+        .outerjoin(Semester, Semester.id == Course.semester_id)
+        .outerjoin(Grade, (Grade.student_id == Student.id) & (Grade.course_id == Course.id))
+        .where(Student.id == student_id)
+        .order_by(Semester.start.nulls_last(), Course.id)
+    )
+    rows = transcript_query.all()
+    if not rows:
+        raise NoResultFound({"statement": "Student with this id does not exist.", "params": student_id})
+
+    first = rows[0]
+    return {
+        "student": {"id": first.id, "group_id": first.group_id, "name": first.name, "phone": first.phone, "address": first.address},
+        "group": {"id": first.group_id, "department_id": first.department_id, "enrolled_at": first.enrolled_at, "student_count": first.student_count},
+        "department": {
+            "id": first.department_id, "faculty_id": first.faculty_id,
+            "name": first.department_name, "desc": first.department_desc, "url": first.department_url,
+        },
+        "courses": [
+            {
+                "course_id": row.course_id, "name": row.course_name, "semester_id": row.semester_id,
+                "semester_start": row.semester_start, "semester_end": row.semester_end,
+                "grade_id": row.grade_id, "grade": row.grade,
+            }
+            for row in rows if row.course_id is not None
+        ],
+    }
+
+async def _search_names(session: AsyncSession, model, schema, query: str, limit: int) -> list[Row]:
+    # every predicate is on models.search_key(name) so the gin trigram index serves prefix and fuzzy matches alike
+    key = models.search_key(model.name)
+    needle = models.normalize(query).strip()
+    if not needle:
+        # nothing left to match on, a pattern of just % would match everyone
+        return []
+    pattern = needle.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    prefix = key.like(f"{pattern}%") | key.like(f"% {pattern}%")
+    search_query = await session.execute(
+        select(*out_columns(schema, model))
+        .where(prefix | key.op("%>")(needle))
+        .order_by(prefix.desc(), func.word_similarity(needle, key).desc(), func.similarity(key, needle).desc(), model.id)
+        .limit(limit)
+    )
+    return search_query.all()
+
+async def search_students(session: AsyncSession, query: str, limit: int) -> list[Row]:
+    return await _search_names(session, models.Student, schemas.StudentOut, query, limit)
+
+async def search_professors(session: AsyncSession, query: str, limit: int) -> list[Row]:
+    return await _search_names(session, models.Professor, schemas.ProfessorOut, query, limit)
+
+async def update_student(session: AsyncSession, student_id: int, schema: schemas.StudentUpdate, expected_versions: set[int] | None = None) -> models.Student:
     student_query = await session.execute(select(models.Student).where(models.Student.id == student_id))
     student = student_query.scalar()
     if student is None:
         raise NoResultFound({"statement": "Student with this id does not exist.", "params": student_id})
+    if expected_versions is not None and student.version not in expected_versions:
+        raise StaleDataError({"statement": "Student has been modified since it was read.", "params": {"id": student_id, "version": student.version}})
     
     if schema.group_id:
         group_query = await session.execute(select(models.Group.id).where(models.Group.id == schema.group_id))
@@ -40,33 +196,121 @@ async def update_student(session: AsyncSession, student_id: int, schema: schemas
         if group is None:
             raise NoResultFound({"statement": "Group with this id does not exist.", "params": schema.group_id})
     
+    moved_grades = []
+    moved_from = None
+    if schema.group_id and schema.group_id != student.group_id:
+        moved_from = student.group_id
+        # the student's grades move to the new group's (and maybe department's) histograms
+        grade_query = await session.execute(
+            select(models.Grade.student_id, models.Grade.course_id, models.Grade.grade).where(models.Grade.student_id == student_id)
+        )
+        moved_grades = grade_query.all()
+        await _apply_grade_deltas(session, [(*grade, -1) for grade in moved_grades])
+
     for field, value in schema:
         setattr(student, field, value) if value else None
 
     session.add(student)
     try:
+        if moved_grades:
+            await session.flush()
+            await _apply_grade_deltas(session, [(*grade, 1) for grade in moved_grades])
+        if moved_from is not None:
+            await counters.adjust(session, models.Group, student_count={moved_from: -1, schema.group_id: 1})
+        # the outbox snapshot flushes the update first
+        await changes.record(session, "student", [student_id])
         await session.commit()
+        await entity_cache.invalidate("student", student_id)
         return student
     except IntegrityError as ex:
         await session.rollback()
         raise IntegrityError("Student update failed.", ex.params, ex.orig)
+    except StaleDataError:
+        # the version check in the UPDATE's WHERE clause: someone else updated the student after we read it
+        await session.rollback()
+        raise StaleDataError({"statement": "Student has been modified concurrently.", "params": {"id": student_id}})
 
 async def delete_student(session: AsyncSession, student_id: int) -> models.Student:
     student_query = await session.execute(select(models.Student).where(models.Student.id == student_id))
     student = student_query.scalar()
     if student is None:
         raise NoResultFound({"statement": "Student with this id does not exist.", "params": student_id})
+    course_query = await session.execute(select(models.course_students.c.course_id).where(models.course_students.c.student_id == student_id))
+    course_ids = course_query.scalars().all()
     try:
         await session.delete(student)
+        # a student with grades can't be deleted, so only the rosters shrink
+        await counters.adjust(session, models.Course, student_count={course_id: -1 for course_id in course_ids})
+        await counters.adjust(session, models.Group, student_count={student.group_id: -1})
+        await changes.record(session, "course", course_ids)
+        await changes.record(session, "student", [student_id], "delete")
         await session.commit()
+        await entity_cache.invalidate("student", student_id)
+        await entity_cache.invalidate("course", *course_ids)
         return student
     except IntegrityError as ex:
         await session.rollback()
         raise IntegrityError("Student delete failed.", ex.params, ex.orig)
     
-async def get_professors(session: AsyncSession) -> list[models.Professor]:
-    professor_query = await session.execute(select(models.Professor))
-    return professor_query.scalars().all()
+async def get_professors(session: AsyncSession, limit: int, after: int | None = None) -> list[Row]:
+    # keyset pagination on the primary key, we fetch one extra row to know if there is a next page
+    query = select(*out_columns(schemas.ProfessorOut, models.Professor)).order_by(models.Professor.id).limit(limit + 1)
+    if after is not None:
+        query = query.where(models.Professor.id > after)
+    professor_query = await session.execute(query)
+    return professor_query.all()
+
+async def stream_professors(session: AsyncSession, after: int | None = None) -> AsyncResult:
+    # plain columns from a server-side cursor, so nothing piles up in the identity map
+    query = select(*out_columns(schemas.ProfessorOut, models.Professor)).order_by(models.Professor.id).execution_options(yield_per=STREAM_CHUNK_SIZE)
+    if after is not None:
+        query = query.where(models.Professor.id > after)
+    return await session.stream(query)
+
+async def _building_professors_query(building_id: int, after: int | None):
+    # the building's department comes from the org tree, what's left is one query on professors.department_id
+    building = await org_tree.find("buildings", building_id)
+    if building is None:
+        raise NoResultFound({"statement": "Building with this id does not exist.", "params": building_id})
+    query = (
+        select(*out_columns(schemas.ProfessorOut, models.Professor))
+        .where(models.Professor.department_id == building["department_id"])
+        .order_by(models.Professor.id)
+    )
+    if after is not None:
+        query = query.where(models.Professor.id > after)
+    return query
+
+async def get_building_professors(session: AsyncSession, building_id: int, limit: int, after: int | None = None) -> list[Row]:
+    query = await _building_professors_query(building_id, after)
+    professor_query = await session.execute(query.limit(limit + 1))
+    return professor_query.all()
+
+async def stream_building_professors(session: AsyncSession, building_id: int, after: int | None = None) -> AsyncResult:
+    query = await _building_professors_query(building_id, after)
+    return await session.stream(query.execution_options(yield_per=STREAM_CHUNK_SIZE))
+
+async def _faculty_students_query(faculty_id: int, after: int | None):
+    # faculty -> departments -> groups is walked in the org tree, the database only sees students.group_id = ANY(...)
+    if await org_tree.find("faculties", faculty_id) is None:
+        raise NoResultFound({"statement": "Faculty with this id does not exist.", "params": faculty_id})
+    query = (
+        select(*out_columns(schemas.StudentOut, models.Student))
+        .where(models.Student.group_id == any_(bindparam("group_ids", org_tree.faculty_groups(faculty_id), type_=ARRAY(Integer))))
+        .order_by(models.Student.id)
+    )
+    if after is not None:
+        query = query.where(models.Student.id > after)
+    return query
+
+async def get_faculty_students(session: AsyncSession, faculty_id: int, limit: int, after: int | None = None) -> list[Row]:
+    query = await _faculty_students_query(faculty_id, after)
+    student_query = await session.execute(query.limit(limit + 1))
+    return student_query.all()
+
+async def stream_faculty_students(session: AsyncSession, faculty_id: int, after: int | None = None) -> AsyncResult:
+    query = await _faculty_students_query(faculty_id, after)
+    return await session.stream(query.execution_options(yield_per=STREAM_CHUNK_SIZE))
 
 async def add_course(session: AsyncSession, schema: schemas.CourseCreate) -> models.Course:
     if schema.semester_id:
@@ -78,74 +322,658 @@ async def add_course(session: AsyncSession, schema: schemas.CourseCreate) -> mod
     course = models.Course(**schema.dict())
     session.add(course)
     try:
+        await session.flush()
+        await changes.record(session, "course", [course.id])
         await session.commit()
+        await entity_cache.invalidate("course", course.id)
         return course
     except IntegrityError as ex:
         await session.rollback()
         raise IntegrityError("Course add failed.", ex.params, ex.orig)
 
-async def get_course(session: AsyncSession, course_id: int) -> models.Course:
-    course_query = await session.execute(select(models.Course).where(models.Course.id == course_id))
-    course = course_query.scalar()
-    if course is None:
+async def get_course(course_id: int, fresh: bool = False) -> dict:
+    data = await entity_cache.fetch("course", course_id, lambda: course_loader.load(course_id), fresh)
+    if data is None:
         raise NoResultFound({"statement": "Course with this id does not exist.", "params": course_id})
-    return course
+    return data
+
+async def get_courses(course_ids: list[int]) -> dict[int, dict | None]:
+    return await entity_cache.fetch_many("course", course_ids, lambda ids: _load_rows_batch(models.Course, ids))
 
-async def get_course_students(session: AsyncSession, course_id: int) -> list[models.Student]:
-    course_query = await session.execute(select(models.Course).options(selectinload(models.Course.students)).where(models.Course.id == course_id))
-    course = course_query.scalar()
-    if course is None:
+async def _course_students_query(session: AsyncSession, course_id: int, after: int | None):
+    course_query = await session.execute(select(models.Course.id).where(models.Course.id == course_id))
+    if course_query.scalar() is None:
         raise NoResultFound({"statement": "Course with this id does not exist.", "params": course_id})
-    return course.students
 
-async def add_course_grade(session: AsyncSession, schema: schemas.CourseGradeCreate) -> models.Grade:
-    params = {"student_id": schema.student_id, "course_id": schema.course_id}
-    student_query = await session.execute(
-        select(models.Student)        
-        .join(models.Student.courses)
-        .where(
-            (models.Student.id == schema.student_id)
-            & (models.Course.id == schema.course_id)
+    query = (
+        select(*out_columns(schemas.StudentOut, models.Student))
+        .join(models.course_students, models.course_students.c.student_id == models.Student.id)
+        .where(models.course_students.c.course_id == course_id)
+        .order_by(models.Student.id)
+    )
+    if after is not None:
+        query = query.where(models.Student.id > after)
+    return query
+
+async def get_course_students(session: AsyncSession, course_id: int, limit: int, after: int | None = None) -> list[Row]:
+    query = await _course_students_query(session, course_id, after)
+    student_query = await session.execute(query.limit(limit + 1))
+    return student_query.all()
+
+async def stream_course_students(session: AsyncSession, course_id: int, after: int | None = None) -> AsyncResult:
+    # the existence check runs before we start streaming, so a missing course is still a 404 and not a broken stream
+    query = await _course_students_query(session, course_id, after)
+    return await session.stream(query.execution_options(yield_per=STREAM_CHUNK_SIZE))
+
+def _selected_students(selection: schemas.EnrollmentSelection):
+    conditions = []
+    if selection.group_ids:
+        conditions.append(models.Student.group_id == any_(literal(selection.group_ids, ARRAY(Integer))))
+    if selection.student_ids:
+        conditions.append(models.Student.id == any_(literal(selection.student_ids, ARRAY(Integer))))
+    if selection.department_id is not None:
+        conditions.append(models.Student.group_id.in_(select(models.Group.id).where(models.Group.department_id == selection.department_id)))
+    return select(models.Student.id).where(or_(*conditions)).cte("selected")
+
+async def _lock_course(session: AsyncSession, course_id: int):
+    # serializes roster changes of one course, the capacity check counts the roster after the insert
+    course_query = await session.execute(select(models.Course.id).where(models.Course.id == course_id).with_for_update())
+    if course_query.scalar() is None:
+        raise NoResultFound({"statement": "Course with this id does not exist.", "params": course_id})
+
+async def _unknown_students(session: AsyncSession, student_ids: list[int]) -> list[int]:
+    if not student_ids:
+        return []
+    student_query = await session.execute(select(models.Student.id).where(models.Student.id == any_(literal(student_ids, ARRAY(Integer)))))
+    existing = set(student_query.scalars().all())
+    return [student_id for student_id in dict.fromkeys(student_ids) if student_id not in existing]
+
+def _graded_among(students, course_id: int):
+    # how many of these students hold a grade for the course
+    return (
+        select(func.count())
+        .select_from(students)
+        .join(models.Grade, (models.Grade.student_id == students.c.student_id) & (models.Grade.course_id == course_id))
+        .scalar_subquery()
+    )
+
+async def _roster_counts(session: AsyncSession, course_id: int) -> tuple[int, int | None]:
+    # the roster size comes from the course's counter, no count(*) over course_students.
+    # a course is limited by the smallest auditorium it is scheduled in, unscheduled courses aren't limited
+    roster_query = await session.execute(select(
+        models.Course.student_count,
+        select(func.min(models.Auditorium.max_capacity))
+        .join(models.Timeslot, models.Timeslot.auditorium_id == models.Auditorium.id)
+        .where(models.Timeslot.course_id == course_id)
+        .scalar_subquery(),
+    ).where(models.Course.id == course_id))
+    return roster_query.one()
+
+async def enroll_students(session: AsyncSession, course_id: int, selection: schemas.EnrollmentSelection) -> dict:
+    await _lock_course(session, course_id)
+    # one INSERT ... SELECT for the whole selection, students already enrolled fall through ON CONFLICT, so repeating it is harmless
+    selected = _selected_students(selection)
+    inserted = (
+        pg_insert(models.course_students)
+        .from_select(["course_id", "student_id"], select(literal(course_id, Integer), selected.c.id))
+        .on_conflict_do_nothing()
+        .returning(models.course_students.c.student_id)
+        .cte("inserted")
+    )
+    count_query = await session.execute(select(
+        select(func.count()).select_from(selected).scalar_subquery(),
+        select(func.count()).select_from(inserted).scalar_subquery(),
+        # students coming back to a course keep the grade they had in it
+        _graded_among(inserted, course_id),
+    ))
+    selected_count, inserted_count, graded_count = count_query.one()
+    await counters.adjust(session, models.Course, student_count={course_id: inserted_count}, graded_count={course_id: graded_count})
+
+    enrolled, capacity = await _roster_counts(session, course_id)
+    if inserted_count and capacity is not None and enrolled > capacity:
+        await session.rollback()
+        raise IntegrityError("Enrollment exceeds the capacity of the course's auditorium.", {"course_id": course_id, "capacity": capacity, "enrolled": enrolled}, None)
+
+    unknown = await _unknown_students(session, selection.student_ids)
+    # the roster is part of the course's row through its counters
+    await changes.record(session, "course", [course_id] if inserted_count else [])
+    await session.commit()
+    await entity_cache.invalidate("course", course_id)
+    return {"inserted": inserted_count, "skipped": selected_count - inserted_count, "unknown_student_ids": unknown, "enrolled": enrolled, "capacity": capacity}
+
+async def unenroll_students(session: AsyncSession, course_id: int, selection: schemas.EnrollmentSelection) -> dict:
+    await _lock_course(session, course_id)
+    selected = _selected_students(selection)
+    deleted = (
+        delete(models.course_students)
+        .where((models.course_students.c.course_id == course_id) & models.course_students.c.student_id.in_(select(selected.c.id)))
+        .returning(models.course_students.c.student_id)
+        .cte("deleted")
+    )
+    count_query = await session.execute(select(
+        select(func.count()).select_from(selected).scalar_subquery(),
+        select(func.count()).select_from(deleted).scalar_subquery(),
+        _graded_among(deleted, course_id),
+    ))
+    selected_count, deleted_count, graded_count = count_query.one()
+    await counters.adjust(session, models.Course, student_count={course_id: -deleted_count}, graded_count={course_id: -graded_count})
+    enrolled, _ = await _roster_counts(session, course_id)
+    unknown = await _unknown_students(session, selection.student_ids)
+    await changes.record(session, "course", [course_id] if deleted_count else [])
+    await session.commit()
+    await entity_cache.invalidate("course", course_id)
+    return {"deleted": deleted_count, "skipped": selected_count - deleted_count, "unknown_student_ids": unknown, "enrolled": enrolled}
+
+async def _apply_grade_deltas(session: AsyncSession, deltas: list[tuple[int, int, int, int]]):
+    # deltas are (student_id, course_id, grade, +1/-1), every one of them is rolled up into all four scopes in one statement
+    deltas = [delta for delta in deltas if delta[1] is not None]
+    if not deltas:
+        return
+    student_ids, course_ids, grades, signs = (list(values) for values in zip(*deltas))
+    deltas_cte = select(
+        func.unnest(
+            literal(student_ids, ARRAY(Integer)),
+            literal(course_ids, ARRAY(Integer)),
+            literal(grades, ARRAY(Integer)),
+            literal(signs, ARRAY(Integer)),
+        ).table_valued(
+            column("student_id", Integer), column("course_id", Integer), column("grade", Integer), column("delta", Integer)
+        ).render_derived(name="deltas")
+    ).cte("deltas")
+    scoped = union_all(
+        select(literal("course").label("scope"), deltas_cte.c.course_id.label("scope_id"), deltas_cte.c.grade, deltas_cte.c.delta),
+        select(literal("semester"), models.Course.semester_id, deltas_cte.c.grade, deltas_cte.c.delta)
+        .join(models.Course, models.Course.id == deltas_cte.c.course_id)
+        .where(models.Course.semester_id.is_not(None)),
+        select(literal("group"), models.Student.group_id, deltas_cte.c.grade, deltas_cte.c.delta)
+        .join(models.Student, models.Student.id == deltas_cte.c.student_id),
+        select(literal("department"), models.Group.department_id, deltas_cte.c.grade, deltas_cte.c.delta)
+        .join(models.Student, models.Student.id == deltas_cte.c.student_id)
+        .join(models.Group, models.Group.id == models.Student.group_id),
+    ).subquery()
+    # the same histogram row can be hit more than once per batch, ON CONFLICT needs them summed first.
+    # in key order, so concurrent batches lock the rows they share in the same order and can't deadlock
+    summed = (
+        select(scoped.c.scope, scoped.c.scope_id, scoped.c.grade, func.sum(scoped.c.delta))
+        .group_by(scoped.c.scope, scoped.c.scope_id, scoped.c.grade)
+        .order_by(scoped.c.scope, scoped.c.scope_id, scoped.c.grade)
+    )
+    upsert = pg_insert(models.GradeHistogram).from_select(["scope", "scope_id", "grade", "count"], summed)
+    await session.execute(
+        upsert.on_conflict_do_update(
+            index_elements=["scope", "scope_id", "grade"],
+            set_={"count": models.GradeHistogram.count + upsert.excluded.count},
         )
     )
-    student = student_query.scalar()
 
-    if student is None:
-        raise NoResultFound({"statement": "Student cannot be found for the specified course.", "params": params})
+async def rebuild_grade_histograms(session: AsyncSession):
+    # full recount, for backfilling the histograms of an existing database or repairing them
+    graded = select(models.Grade.student_id, models.Grade.course_id, models.Grade.grade).where(models.Grade.course_id.is_not(None)).subquery()
+    by_scope = {
+        "course": select(graded.c.course_id, graded.c.grade, func.count()).group_by(graded.c.course_id, graded.c.grade),
+        "semester": select(models.Course.semester_id, graded.c.grade, func.count())
+            .join(models.Course, models.Course.id == graded.c.course_id)
+            .where(models.Course.semester_id.is_not(None))
+            .group_by(models.Course.semester_id, graded.c.grade),
+        "group": select(models.Student.group_id, graded.c.grade, func.count())
+            .join(models.Student, models.Student.id == graded.c.student_id)
+            .group_by(models.Student.group_id, graded.c.grade),
+        "department": select(models.Group.department_id, graded.c.grade, func.count())
+            .join(models.Student, models.Student.id == graded.c.student_id)
+            .join(models.Group, models.Group.id == models.Student.group_id)
+            .group_by(models.Group.department_id, graded.c.grade),
+    }
+    await session.execute(delete(models.GradeHistogram))
+    for scope, query in by_scope.items():
+        columns = query.subquery()
+        await session.execute(
+            insert(models.GradeHistogram).from_select(
+                ["scope", "scope_id", "grade", "count"],
+                select(literal(scope), *columns.c),
+            )
+        )
+    await session.commit()
+
+async def get_grade_histograms(session: AsyncSession, scope: str, scope_id: int | None = None) -> dict[int, dict[int, int]]:
+    query = (
+        select(models.GradeHistogram.scope_id, models.GradeHistogram.grade, models.GradeHistogram.count)
+        .where((models.GradeHistogram.scope == scope) & (models.GradeHistogram.count > 0))
+        .order_by(models.GradeHistogram.scope_id, models.GradeHistogram.grade)
+    )
+    if scope_id is not None:
+        query = query.where(models.GradeHistogram.scope_id == scope_id)
+    histogram_query = await session.execute(query)
+    histograms: dict[int, dict[int, int]] = {}
+    for row in histogram_query:
+        histograms.setdefault(row.scope_id, {})[row.grade] = row.count
+    return histograms
+
+async def get_group_counts(session: AsyncSession, department_id: int | None = None) -> list[Row]:
+    # the counters are plain columns, no count(*) over the students
+    query = select(*out_columns(schemas.GroupOut, models.Group)).order_by(models.Group.id)
+    if department_id is not None:
+        query = query.where(models.Group.department_id == department_id)
+    group_query = await session.execute(query)
+    return group_query.all()
 
-    grade_query = await session.execute(select(models.Grade).where((models.Grade.student_id == schema.student_id) & (models.Grade.course_id == schema.course_id)))
+async def get_auditorium_bookings(session: AsyncSession, building_id: int | None = None) -> list[Row]:
+    query = select(*out_columns(schemas.AuditoriumBooking, models.Auditorium)).order_by(models.Auditorium.id)
+    if building_id is not None:
+        query = query.where(models.Auditorium.building_id == building_id)
+    auditorium_query = await session.execute(query)
+    return auditorium_query.all()
+
+async def _invalidate_graded(*grades: models.Grade):
+    # grades hang off both the student and the course, anything cached for either must not outlive a grade write
+    await entity_cache.invalidate("student", *{grade.student_id for grade in grades})
+    await entity_cache.invalidate("course", *{grade.course_id for grade in grades})
+
+async def add_course_grade(session: AsyncSession, schema: schemas.CourseGradeCreate) -> models.Grade:
+    params = {"student_id": schema.student_id, "course_id": schema.course_id}
+    # enrollment check, duplicate check and insert in one statement:
+    # the SELECT only yields a row if the student is enrolled, and the unique constraint swallows duplicates
+    enrolled = select(
+        models.course_students.c.student_id,
+        models.course_students.c.course_id,
+        literal(schema.grade, Integer),
+    ).where(
+        (models.course_students.c.student_id == schema.student_id)
+        & (models.course_students.c.course_id == schema.course_id)
+    )
+    grade_query = await session.execute(
+        pg_insert(models.Grade)
+        .from_select(["student_id", "course_id", "grade"], enrolled)
+        .on_conflict_do_nothing(index_elements=["student_id", "course_id"])
+        .returning(models.Grade)
+    )
     grade = grade_query.scalar()
-    if grade:
-        raise IntegrityError("Grade already placed for student in this course.", params, grade_query)
 
-    grade = models.Grade(**schema.dict())
-    session.add(grade)
+    if grade is not None:
+        await _apply_grade_deltas(session, [(grade.student_id, grade.course_id, grade.grade, 1)])
+        await counters.adjust(session, models.Course, graded_count={grade.course_id: 1})
+
+    if grade is None:
+        # only the failure path pays for a second query, to tell the client which of the two it was
+        grade_query = await session.execute(select(models.Grade.id).where((models.Grade.student_id == schema.student_id) & (models.Grade.course_id == schema.course_id)))
+        if grade_query.scalar():
+            raise IntegrityError("Grade already placed for student in this course.", params, None)
+        raise NoResultFound({"statement": "Student cannot be found for the specified course.", "params": params})
+
     try:
+        await changes.record(session, "grade", [grade.id])
+        await changes.record(session, "course", [grade.course_id])
         await session.commit()
+        await _invalidate_graded(grade)
         return grade
     except IntegrityError as ex:
         await session.rollback()
         raise IntegrityError("Course grade add failed.", ex.params, ex.orig)
 
-async def update_course_grade(session: AsyncSession, grade_id: int, schema: schemas.CourseGradeUpdate) -> models.Grade:
+async def add_course_grades(session: AsyncSession, entries: list[schemas.CourseGradeCreate]) -> list[models.Grade | Exception]:
+    # add_course_grade for many independent submissions at once (the group commit in app/group_commit.py):
+    # one INSERT and one transaction for all of them, every entry gets back its grade or the error add_course_grade raises
+    first: dict[tuple, int] = {}
+    for index, entry in enumerate(entries):
+        first.setdefault((entry.student_id, entry.course_id), index)
+    # sorted, so concurrent batches of different workers take the unique index locks in the same order
+    pairs = sorted(first, key=lambda pair: (pair[0], pair[1] or 0))
+    submitted = func.unnest(
+        literal([student_id for student_id, _ in pairs], ARRAY(Integer)),
+        literal([course_id for _, course_id in pairs], ARRAY(Integer)),
+        literal([entries[first[pair]].grade for pair in pairs], ARRAY(Integer)),
+    ).table_valued(column("student_id", Integer), column("course_id", Integer), column("grade", Integer)).render_derived(name="submitted")
+    enrolled = select(submitted.c.student_id, submitted.c.course_id, submitted.c.grade).join(
+        models.course_students,
+        (models.course_students.c.student_id == submitted.c.student_id) & (models.course_students.c.course_id == submitted.c.course_id),
+    )
+    try:
+        grade_query = await session.execute(
+            pg_insert(models.Grade)
+            .from_select(["student_id", "course_id", "grade"], enrolled)
+            .on_conflict_do_nothing(index_elements=["student_id", "course_id"])
+            .returning(models.Grade)
+        )
+        grades = {(grade.student_id, grade.course_id): grade for grade in grade_query.scalars().all()}
+        await _apply_grade_deltas(session, [(grade.student_id, grade.course_id, grade.grade, 1) for grade in grades.values()])
+        await counters.adjust(session, models.Course, graded_count=Counter(course_id for _, course_id in grades))
+
+        # as in add_course_grade, only the failures pay for telling duplicates from students that aren't enrolled
+        failed = [pair for pair in pairs if pair not in grades]
+        graded = set()
+        if failed:
+            graded_query = await session.execute(
+                select(models.Grade.student_id, models.Grade.course_id).where(tuple_(models.Grade.student_id, models.Grade.course_id).in_(failed))
+            )
+            graded = {tuple(row) for row in graded_query}
+        await changes.record(session, "grade", [grade.id for grade in grades.values()])
+        await changes.record(session, "course", [course_id for _, course_id in grades])
+        await session.commit()
+    except IntegrityError as ex:
+        await session.rollback()
+        raise IntegrityError("Course grades add failed.", ex.params, ex.orig)
+    await _invalidate_graded(*grades.values())
+
+    results = []
+    for index, entry in enumerate(entries):
+        pair = (entry.student_id, entry.course_id)
+        params = {"student_id": entry.student_id, "course_id": entry.course_id}
+        if pair in grades and first[pair] == index:
+            results.append(grades[pair])
+        elif pair in grades or pair in graded:
+            results.append(IntegrityError("Grade already placed for student in this course.", params, None))
+        else:
+            results.append(NoResultFound({"statement": "Student cannot be found for the specified course.", "params": params}))
+    return results
+
+async def set_course_gradebook(session: AsyncSession, course_id: int, entries: list[schemas.GradebookEntry]) -> tuple[list[models.Grade], list[dict]]:
+    course_query = await session.execute(select(models.Course.id).where(models.Course.id == course_id))
+    if course_query.scalar() is None:
+        raise NoResultFound({"statement": "Course with this id does not exist.", "params": course_id})
+
+    # ON CONFLICT DO UPDATE cannot touch the same row twice in one statement, so repeated students are rejected up front
+    errors, positions = [], {}
+    for index, entry in enumerate(entries):
+        if entry.student_id in positions:
+            errors.append({"row": index, "errors": "Student appears more than once in the gradebook.", "params": entry.student_id})
+            continue
+        positions[entry.student_id] = index
+    if not positions:
+        return [], errors
+
+    # the whole gradebook travels as two arrays, unnest turns them back into rows and the join drops anyone not enrolled
+    gradebook = func.unnest(
+        literal(list(positions), ARRAY(Integer)),
+        literal([entries[index].grade for index in positions.values()], ARRAY(Integer)),
+    ).table_valued(column("student_id", Integer), column("grade", Integer)).render_derived(name="gradebook")
+    enrolled = (
+        select(gradebook.c.student_id, models.course_students.c.course_id, gradebook.c.grade)
+        .join(models.course_students, models.course_students.c.student_id == gradebook.c.student_id)
+        .where(models.course_students.c.course_id == course_id)
+    )
+    upsert = pg_insert(models.Grade).from_select(["student_id", "course_id", "grade"], enrolled)
+    try:
+        # grades being overwritten are locked and read first, the histograms need to forget their old values
+        previous_query = await session.execute(
+            select(models.Grade.student_id, models.Grade.grade)
+            .where((models.Grade.course_id == course_id) & models.Grade.student_id.in_(list(positions)))
+            .with_for_update()
+        )
+        previous = dict(previous_query.all())
+        grade_query = await session.execute(
+            upsert.on_conflict_do_update(
+                index_elements=["student_id", "course_id"],
+                set_={"grade": upsert.excluded.grade, "version": models.Grade.version + 1},
+            )
+            .returning(models.Grade)
+        )
+        grades = grade_query.scalars().all()
+        deltas = [(grade.student_id, course_id, grade.grade, 1) for grade in grades]
+        deltas += [(grade.student_id, course_id, previous[grade.student_id], -1) for grade in grades if grade.student_id in previous]
+        await _apply_grade_deltas(session, deltas)
+        # overwritten grades were counted already
+        added = sum(grade.student_id not in previous for grade in grades)
+        await counters.adjust(session, models.Course, graded_count={course_id: added})
+        await changes.record(session, "grade", [grade.id for grade in grades])
+        await changes.record(session, "course", [course_id] if added else [])
+        await session.commit()
+        await _invalidate_graded(*grades)
+    except IntegrityError as ex:
+        await session.rollback()
+        raise IntegrityError("Course gradebook update failed.", ex.params, ex.orig)
+
+    graded = {grade.student_id for grade in grades}
+    for student_id, index in positions.items():
+        if student_id not in graded:
+            errors.append({"row": index, "errors": "Student cannot be found for the specified course.", "params": student_id})
+    return grades, sorted(errors, key=lambda error: error["row"])
+
+async def update_course_grade(session: AsyncSession, grade_id: int, schema: schemas.CourseGradeUpdate, expected_versions: set[int] | None = None) -> models.Grade:
     grade_query = await session.execute(
-        select(models.Grade).where(models.Grade.id == grade_id)
+        select(models.Grade).where(models.Grade.id == grade_id).with_for_update()
     )
     grade = grade_query.scalar()
 
     if grade is None:
         raise NoResultFound({"statement": "Grade with id cannot be found", "params": grade_id})
+    # the row is locked, so the version can't change between this check and the update
+    if expected_versions is not None and grade.version not in expected_versions:
+        version = grade.version
+        await session.rollback()
+        raise StaleDataError({"statement": "Grade has been modified since it was read.", "params": {"id": grade_id, "version": version}})
 
+    if grade.grade != schema.grade:
+        await _apply_grade_deltas(session, [
+            (grade.student_id, grade.course_id, grade.grade, -1),
+            (grade.student_id, grade.course_id, schema.grade, 1),
+        ])
     grade.grade = schema.grade
 
     session.add(grade)
     try:
+        await changes.record(session, "grade", [grade_id])
         await session.commit()
+        await _invalidate_graded(grade)
         return grade
     except IntegrityError as ex:
         await session.rollback()
         raise IntegrityError("Course grade update failed.", ex.params, ex.orig)
     
+# one row per grade of the semester, with everything a registrar needs to read it without further lookups
+SEMESTER_GRADE_EXPORT_COLUMNS = [
+    models.Grade.id.label("grade_id"),
+    models.Grade.grade,
+    models.Student.id.label("student_id"),
+    models.Student.name.label("student_name"),
+    models.Student.group_id,
+    models.Course.id.label("course_id"),
+    models.Course.name.label("course_name"),
+    models.Semester.id.label("semester_id"),
+    models.Semester.start.label("semester_start"),
+    models.Semester.end.label("semester_end"),
+]
+
+async def stream_semester_grades(session: AsyncSession, semester_id: int) -> AsyncResult:
+    semester_query = await session.execute(select(models.Semester.id).where(models.Semester.id == semester_id))
+    if semester_query.scalar() is None:
+        raise NoResultFound({"statement": "Semester with this id does not exist.", "params": semester_id})
+
+    query = (
+        select(*SEMESTER_GRADE_EXPORT_COLUMNS)
+        .join(models.Course, models.Course.id == models.Grade.course_id)
+        .join(models.Semester, models.Semester.id == models.Course.semester_id)
+        .join(models.Student, models.Student.id == models.Grade.student_id)
+        .where(models.Course.semester_id == semester_id)
+        .order_by(models.Grade.course_id, models.Grade.student_id)
+        .execution_options(yield_per=STREAM_CHUNK_SIZE)
+    )
+    return await session.stream(query)
+
+async def add_timeslot(session: AsyncSession, auditorium_id: int, schema: schemas.TimeslotCreate) -> models.Timeslot:
+    auditorium_query = await session.execute(select(models.Auditorium.id).where(models.Auditorium.id == auditorium_id))
+    if auditorium_query.scalar() is None:
+        raise NoResultFound({"statement": "Auditorium with this id does not exist.", "params": auditorium_id})
+
+    values = schema.dict()
+    values["start"], values["end"] = as_naive(schema.start), as_naive(schema.end)
+    timeslot = models.Timeslot(**values, auditorium_id=auditorium_id)
+    session.add(timeslot)
+    try:
+        # overlapping bookings of the same auditorium are rejected by the exclusion constraint
+        await counters.adjust(session, models.Auditorium, booked_minutes={auditorium_id: counters.minutes(timeslot.start, timeslot.end)})
+        await session.commit()
+        availability_index.add_timeslot(timeslot)
+        return timeslot
+    except IntegrityError as ex:
+        await session.rollback()
+        raise IntegrityError("Timeslot add failed, the auditorium may already be booked for this time.", ex.params, ex.orig)
+
+async def delete_timeslot(session: AsyncSession, auditorium_id: int, timeslot_id: int) -> models.Timeslot:
+    timeslot_query = await session.execute(
+        select(models.Timeslot).where((models.Timeslot.id == timeslot_id) & (models.Timeslot.auditorium_id == auditorium_id))
+    )
+    timeslot = timeslot_query.scalar()
+    if timeslot is None:
+        raise NoResultFound({"statement": "Timeslot with this id does not exist in this auditorium.", "params": timeslot_id})
+    try:
+        await session.delete(timeslot)
+        await counters.adjust(session, models.Auditorium, booked_minutes={auditorium_id: -counters.minutes(timeslot.start, timeslot.end)})
+        await session.commit()
+        availability_index.remove_timeslot(timeslot)
+        return timeslot
+    except IntegrityError as ex:
+        await session.rollback()
+        raise IntegrityError("Timeslot delete failed.", ex.params, ex.orig)
+
+def _timetable_occurrences(schema: schemas.ScheduleRequest, week_start: datetime, weeks: int, period: int):
+    day, slot = divmod(period, schema.slots_per_day)
+    offset = timedelta(hours=schema.day_start.hour, minutes=schema.day_start.minute + slot * (schema.slot_minutes + schema.break_minutes))
+    for week in range(weeks):
+        start = week_start + timedelta(days=week * 7 + day) + offset
+        yield start, start + timedelta(minutes=schema.slot_minutes)
+
+def _overlapping_periods(schema: schemas.ScheduleRequest, first_starts: list[datetime], weeks: int, start: datetime, end: datetime) -> list[int]:
+    # the periods with an occurrence in [start, end), first_starts being each period's occurrence in the first week.
+    # occurrence w of a period overlaps when first + w weeks < end and first + w weeks + slot > start,
+    # so the weeks that do form one range per period, no occurrence has to be generated
+    week, slot = timedelta(days=7), timedelta(minutes=schema.slot_minutes)
+    overlapping = []
+    for period, first in enumerate(first_starts):
+        lowest = max(0, (start - slot - first) // week + 1)
+        highest = min(weeks - 1, -((first - end) // week) - 1)
+        if lowest <= highest:
+            overlapping.append(period)
+    return overlapping
+
+async def schedule_semester(session: AsyncSession, semester_id: int, schema: schemas.ScheduleRequest) -> dict:
+    semester_query = await session.execute(select(models.Semester).where(models.Semester.id == semester_id))
+    semester = semester_query.scalar()
+    if semester is None:
+        raise NoResultFound({"statement": "Semester with this id does not exist.", "params": semester_id})
+
+    week_start = as_naive(schema.week_start or semester.start).replace(hour=0, minute=0, second=0, microsecond=0)
+    weeks = schema.weeks or max(1, (semester.end - week_start).days // 7)
+    periods = schema.days * schema.slots_per_day
+    horizon_end = week_start + timedelta(days=weeks * 7)
+
+    # everything the solver needs comes from seven set-based queries, memberships are never loaded per course
+    semester_courses = select(models.Course.id).where(models.Course.semester_id == semester_id)
+    course_query = await session.execute(semester_courses)
+    course_ids = course_query.scalars().all()
+    members = {course_id: (set(), set()) for course_id in course_ids}
+    student_query = await session.execute(
+        select(models.course_students.c.course_id, models.course_students.c.student_id)
+        .where(models.course_students.c.course_id.in_(semester_courses))
+    )
+    for course_id, student_id in student_query:
+        members[course_id][0].add(student_id)
+    professor_query = await session.execute(
+        select(models.course_professors.c.course_id, models.course_professors.c.professor_id)
+        .where(models.course_professors.c.course_id.in_(semester_courses))
+    )
+    for course_id, professor_id in professor_query:
+        members[course_id][1].add(professor_id)
+    courses = [scheduler.CourseDemand(course_id, frozenset(students), frozenset(professors)) for course_id, (students, professors) in members.items()]
+
+    auditorium_query = select(models.Auditorium.id, models.Auditorium.max_capacity)
+    if schema.require_projector:
+        auditorium_query = auditorium_query.where(models.Auditorium.has_projector)
+    if schema.require_board:
+        auditorium_query = auditorium_query.where(models.Auditorium.has_board)
+    auditorium_query = await session.execute(auditorium_query)
+    rooms = [scheduler.Room(auditorium_id, capacity or 0) for auditorium_id, capacity in auditorium_query]
+
+    # bookings already in the horizon take their room out of every weekly period they overlap, and the students and
+    # professors of their course (e.g. one of an overlapping semester) too
+    replaced = (
+        models.Timeslot.course_id.in_(semester_courses)
+        & models.Timeslot.class_id.is_(None)
+        & models.Timeslot.exam_id.is_(None)
+    )
+    booking_query = select(models.Timeslot.auditorium_id, models.Timeslot.course_id, models.Timeslot.start, models.Timeslot.end).where(
+        (models.Timeslot.start < horizon_end) & (models.Timeslot.end > week_start)
+    )
+    if schema.replace:
+        # replaced is NULL for rows without a course, which NOT would otherwise drop as well
+        booking_query = booking_query.where(models.Timeslot.course_id.is_(None) | ~replaced)
+    booking_query = await session.execute(booking_query)
+    first_starts = [next(_timetable_occurrences(schema, week_start, 1, period))[0] for period in range(periods)]
+    blocked, booked_periods = set(), {}
+    for auditorium_id, course_id, start, end in booking_query:
+        overlapping = _overlapping_periods(schema, first_starts, weeks, start, end)
+        blocked.update((auditorium_id, period) for period in overlapping)
+        if course_id is not None:
+            booked_periods.setdefault(course_id, set()).update(overlapping)
+
+    busy_students, busy_professors = {}, {}
+    booked_courses = bindparam("booked_courses", list(booked_periods), type_=ARRAY(Integer))
+    for table, person, busy in (
+        (models.course_students, models.course_students.c.student_id, busy_students),
+        (models.course_professors, models.course_professors.c.professor_id, busy_professors),
+    ):
+        if not booked_periods:
+            break
+        member_query = await session.execute(select(table.c.course_id, person).where(table.c.course_id == any_(booked_courses)))
+        for course_id, person_id in member_query:
+            for period in booked_periods[course_id]:
+                busy.setdefault(period, set()).add(person_id)
+
+    # the solver is pure python and cpu bound, keep it off the event loop
+    solution = await asyncio.to_thread(
+        scheduler.solve, courses, rooms, schema.days, schema.slots_per_day, schema.sessions_per_week, blocked, schema.time_budget,
+        busy_students=busy_students, busy_professors=busy_professors,
+    )
+
+    values = [
+        {"auditorium_id": placement.room_id, "course_id": placement.course_id, "start": start, "end": end}
+        for placement in solution.placements
+        for start, end in _timetable_occurrences(schema, week_start, weeks, placement.period)
+    ]
+    booked = Counter()
+    for value in values:
+        booked[value["auditorium_id"]] += counters.minutes(value["start"], value["end"])
+    try:
+        if schema.replace:
+            deleted_query = await session.execute(
+                delete(models.Timeslot).where(replaced).returning(models.Timeslot.auditorium_id, models.Timeslot.start, models.Timeslot.end)
+            )
+            for auditorium_id, start, end in deleted_query:
+                booked[auditorium_id] -= counters.minutes(start, end)
+        if values:
+            await session.execute(insert(models.Timeslot), values)
+        await counters.adjust(session, models.Auditorium, booked_minutes=booked)
+        await session.commit()
+    except IntegrityError as ex:
+        await session.rollback()
+        raise IntegrityError("Timetable write failed, an auditorium was booked while the timetable was being solved.", None, ex.orig)
+    # a bulk write is cheaper to pick up with one reload than row by row
+    await availability_index.load()
+
+    return {
+        "scheduled_courses": len(courses) - len(solution.unscheduled),
+        "unscheduled_course_ids": solution.unscheduled,
+        "timeslots": len(values),
+        "weeks": weeks,
+        "solve_seconds": solution.solve_seconds,
+    }
+
+async def prepare_hot_statements(session: AsyncSession):
+    # runs the statements of the busiest read routes once with ids that match nothing, so the session's connection
+    # has them prepared (and sqlalchemy has them compiled) before the first real request needs them
+    hot_reads = [
+        lambda: _load_rows(session, models.Student, [0]),
+        lambda: _load_rows(session, models.Course, [0]),
+        lambda: get_student_transcript(session, 0),
+        lambda: get_course_students(session, 0, 1),
+        lambda: get_professors(session, 1),
+        lambda: get_professors(session, 1, after=0),
+        lambda: get_grade_histograms(session, "course", 0),
+    ]
+    for read in hot_reads:
+        try:
+            await read()
+        except NoResultFound:
+            pass
+
 async def insert_dummy_data(session: AsyncSession):
     data = [
         models.Faculty(code="03.03.09", name="Faculty1"),
@@ -175,4 +1003,12 @@ async def insert_dummy_data(session: AsyncSession):
     session.add_all(data)
     session.add_all(students)
     session.add(course)
-    await session.commit()
\ No newline at end of file
+    await session.flush()
+    await changes.record(session, "student", [student.id for student in students])
+    await changes.record(session, "course", [course.id])
+    await session.commit()
+    # the rows above went in without their counters
+    await counters.reconcile()
+    await org_tree.invalidate()
+    await entity_cache.invalidate("student", *(student.id for student in students))
+    await entity_cache.invalidate("course", course.id)
\ No newline at end of file
@@ -1,8 +1,15 @@
+import itertools
+import time
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
-from .config import DATABASE_URL
-from sqlalchemy import inspect
+from sqlalchemy.exc import DBAPIError
+from .config import (
+    DATABASE_URL, DATABASE_REPLICA_URLS, DATABASE_REPLICA_RETRY_AFTER,
+    DB_ECHO, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_PRE_PING, DB_STATEMENT_CACHE_SIZE,
+)
 from sqlalchemy.ext.declarative import declarative_base
+from .metrics import TimedQueuePool, instrument_engine
 
 def _declarative_constructor(self, **kwargs):
     """Don't raise a TypeError for unknown attribute names."""
@@ -12,24 +19,98 @@ def _declarative_constructor(self, **kwargs):
             continue
         setattr(self, k, kwargs[k])
 
-engine = create_async_engine(DATABASE_URL, echo=True)
+def _create_engine(url: str):
+    connect_args = {}
+    if make_url(url).get_dialect().driver == "asyncpg":
+        # the first is sqlalchemy's per-connection prepared statement cache, the second asyncpg's own
+        connect_args = {"prepared_statement_cache_size": DB_STATEMENT_CACHE_SIZE, "statement_cache_size": DB_STATEMENT_CACHE_SIZE}
+    engine = create_async_engine(
+        url,
+        echo=DB_ECHO,
+        poolclass=TimedQueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+        connect_args=connect_args,
+    )
+    instrument_engine(engine)
+    return engine
+
+engine = _create_engine(DATABASE_URL)
 Base = declarative_base(constructor=_declarative_constructor)
 async_session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
+replica_engines = [_create_engine(url) for url in DATABASE_REPLICA_URLS]
+# replica index -> monotonic time before which it is not tried again
+_replica_down_until: dict[int, float] = {}
+_replica_rotation = itertools.count()
+
+class ReadSession(AsyncSession):
+    """Session for read-only work: a healthy replica if any are configured, the primary otherwise.
+    The database is picked and connected to when the first statement runs, so a request that is answered
+    without one (from the cache, or by a batched lookup) never checks out a connection."""
+    _picked = False
+
+    async def _pick(self):
+        if self._picked:
+            return
+        self._picked = True
+        start = next(_replica_rotation)
+        now = time.monotonic()
+        for offset in range(len(replica_engines)):
+            index = (start + offset) % len(replica_engines)
+            if _replica_down_until.get(index, 0) > now:
+                continue
+            self.bind = replica_engines[index]
+            self.sync_session.bind = replica_engines[index].sync_engine
+            try:
+                # connect before the statement, so an unreachable replica is skipped instead of failing the request
+                await super().connection()
+                return
+            except (OSError, DBAPIError):
+                await self.close()
+                _replica_down_until[index] = now + DATABASE_REPLICA_RETRY_AFTER
+        self.bind = engine
+        self.sync_session.bind = engine.sync_engine
+
+    async def connection(self, *args, **kwargs):
+        await self._pick()
+        return await super().connection(*args, **kwargs)
+
+    async def execute(self, *args, **kwargs):
+        await self._pick()
+        return await super().execute(*args, **kwargs)
+
+    async def scalar(self, *args, **kwargs):
+        await self._pick()
+        return await super().scalar(*args, **kwargs)
+
+    async def scalars(self, *args, **kwargs):
+        await self._pick()
+        return await super().scalars(*args, **kwargs)
+
+    async def get(self, *args, **kwargs):
+        await self._pick()
+        return await super().get(*args, **kwargs)
+
+    async def stream(self, *args, **kwargs):
+        await self._pick()
+        return await super().stream(*args, **kwargs)
+
+    async def stream_scalars(self, *args, **kwargs):
+        await self._pick()
+        return await super().stream_scalars(*args, **kwargs)
+
+read_session = sessionmaker(engine, class_=ReadSession, expire_on_commit=False)
+
 async def get_session() -> AsyncSession:
     async with async_session() as session:
         yield session
 
-async def init_models():
-    def get_table_names(conn):
-        inspector = inspect(conn)
-        return inspector.get_table_names()
-    
-    async with engine.begin() as conn:
-        table_names = await conn.run_sync(get_table_names)
-        print(table_names)
-        if not table_names:
-            print("Creating models...")
-            await conn.run_sync(Base.metadata.create_all)
-            return
-        print("Tables already exist. Skipping model creation.")
\ No newline at end of file
+async def get_read_session() -> AsyncSession:
+    """Session for read-only routes, see ReadSession.
+    Replicas can lag behind the primary, so don't use this for reads that must see the caller's own writes."""
+    async with read_session() as session:
+        yield session
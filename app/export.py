@@ -0,0 +1,116 @@
+import csv
+import io
+import zlib
+from datetime import datetime
+from typing import AsyncIterator
+import orjson
+from fastapi import HTTPException
+from sqlalchemy.ext.asyncio import AsyncResult
+from .config import STREAM_CHUNK_SIZE
+
+# bulk exports streamed from a server-side cursor: rows arrive in partitions of STREAM_CHUNK_SIZE, every partition
+# is encoded and sent before the next one is fetched, so memory stays flat however many rows there are.
+# parquet needs pyarrow, an optional dependency that is only imported when asked for
+
+MEDIA_TYPES = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+def _csv_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+async def _csv_chunks(names: list[str], partitions) -> AsyncIterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(names)
+    async for partition in partitions:
+        writer.writerows([_csv_value(value) for value in row] for row in partition)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        # no rows at all, just the header
+        yield buffer.getvalue().encode()
+
+async def _ndjson_chunks(names: list[str], partitions) -> AsyncIterator[bytes]:
+    async for partition in partitions:
+        yield b"".join(orjson.dumps(dict(zip(names, row))) + b"\n" for row in partition)
+
+class _ChunkSink:
+    # file object for pyarrow that hands out what has been written since the last take().
+    # tell() counts from the start of the file, the parquet footer stores absolute offsets
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self) -> bytes:
+        data, self.chunks = b"".join(self.chunks), []
+        return data
+
+async def _parquet_chunks(columns: list, partitions) -> AsyncIterator[bytes]:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    arrow_types = {int: pa.int64(), str: pa.string(), float: pa.float64(), bool: pa.bool_(), datetime: pa.timestamp("us")}
+    schema = pa.schema([(column.name, arrow_types[column.type.python_type]) for column in columns])
+    names = schema.names
+    sink = _ChunkSink()
+    # one row group per partition
+    with pq.ParquetWriter(sink, schema) as writer:
+        async for partition in partitions:
+            writer.write_table(pa.Table.from_pylist([dict(zip(names, row)) for row in partition], schema=schema))
+            yield sink.take()
+    yield sink.take()
+
+async def _gzipped(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    # 16 + MAX_WBITS makes zlib write a gzip header and trailer
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    async for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def check_format(format: str):
+    # called before the stream starts, once the first chunk is out an error can't become a status code anymore
+    if format == "parquet":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise HTTPException(status_code=501, detail={"statement": "Parquet export requires the pyarrow package.", "params": format})
+
+def gzip_accepted(accept_encoding: str | None) -> bool:
+    return any(
+        coding.split(";")[0].strip() == "gzip" and coding.replace(" ", "").split(";q=")[-1] not in ("0", "0.0", "0.00", "0.000")
+        for coding in (accept_encoding or "").split(",")
+    )
+
+def encode(format: str, columns: list, result: AsyncResult, gzip: bool = False) -> AsyncIterator[bytes]:
+    # columns are the selected column expressions, their names head the csv and their types make the parquet schema
+    partitions = result.partitions(STREAM_CHUNK_SIZE)
+    names = [column.name for column in columns]
+    if format == "csv":
+        chunks = _csv_chunks(names, partitions)
+    elif format == "ndjson":
+        chunks = _ndjson_chunks(names, partitions)
+    else:
+        chunks = _parquet_chunks(columns, partitions)
+    return _gzipped(chunks) if gzip else chunks
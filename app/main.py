@@ -1,16 +1,38 @@
+import asyncio
+from .readiness import FirstRequestTimer, readiness  # first, cold start times are measured from here
 from fastapi import Depends, FastAPI, Request
 from sqlalchemy.ext.asyncio import AsyncSession
-from fastapi.responses import JSONResponse
-from .db import init_models, get_session
-from .crud import insert_dummy_data
-from .routers import courses, grades, professors, students
-from sqlalchemy.exc import IntegrityError, NoResultFound
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, PlainTextResponse
+from .config import ADMISSION_RETRY_AFTER, GRADE_GROUP_COMMIT
+from .admission import Overloaded
+from .db import get_session
+from .changes import change_feed
+from .group_commit import grade_writes
+from .migrations import upgrade as upgrade_schema
+from . import counters, retention
+from .availability import availability_index
+from .org import org_tree
+from .cache import entity_cache
+from . import metrics
+from .crud import insert_dummy_data, student_loader, course_loader
+from .routers import analytics, auditoriums, buildings, changes, courses, faculties, grades, professors, semesters, students
+from sqlalchemy.exc import IntegrityError, NoResultFound, TimeoutError as PoolTimeout
+from sqlalchemy.orm.exc import StaleDataError
 
-app = FastAPI()
+app = FastAPI(default_response_class=metrics.TimedJSONResponse)
+metrics.instrument_app(app)
+app.add_middleware(FirstRequestTimer)
 app.include_router(courses.router)
 app.include_router(grades.router)
 app.include_router(students.router)
 app.include_router(professors.router)
+app.include_router(auditoriums.router)
+app.include_router(semesters.router)
+app.include_router(analytics.router)
+app.include_router(changes.router)
+app.include_router(buildings.router)
+app.include_router(faculties.router)
 
 @app.exception_handler(NoResultFound)
 async def NoResultFoundHandler(request: Request, ex: NoResultFound):
@@ -18,16 +40,71 @@ async def NoResultFoundHandler(request: Request, ex: NoResultFound):
 
 @app.exception_handler(IntegrityError)
 async def IntegrityErrorHandler(request: Request, ex: IntegrityError):
-    return JSONResponse(status_code = 409, content = {"statement": ex.statement, "params": ex.params})
+    return JSONResponse(status_code = 409, content = jsonable_encoder({"statement": ex.statement, "params": ex.params}))
+
+@app.exception_handler(StaleDataError)
+async def StaleDataErrorHandler(request: Request, ex: StaleDataError):
+    return JSONResponse(status_code = 412, content = ex.args)
+
+@app.exception_handler(Overloaded)
+async def OverloadedHandler(request: Request, ex: Overloaded):
+    return JSONResponse(status_code = 503, content = ex.args, headers = {"Retry-After": str(ex.retry_after)})
+
+@app.exception_handler(PoolTimeout)
+async def PoolTimeoutHandler(request: Request, ex: PoolTimeout):
+    # no pooled connection within DB_POOL_TIMEOUT
+    return JSONResponse(status_code = 503, content = {"statement": "Database is overloaded, retry later.", "params": None}, headers = {"Retry-After": str(ADMISSION_RETRY_AFTER)})
 
 @app.on_event("startup")
 async def startup():
-    await init_models()
+    with readiness.phase("migrations"):
+        await upgrade_schema()
+    with readiness.phase("indexes"):
+        await availability_index.load()
+        await org_tree.load()
+    with readiness.phase("warmup"):
+        await readiness.warm_pools()
+    await change_feed.start()
+    app.state.availability_refresh = asyncio.create_task(availability_index.refresh_forever())
+    app.state.org_refresh = asyncio.create_task(org_tree.refresh_forever())
+    app.state.retention = asyncio.create_task(retention.run_forever())
+    app.state.counter_reconcile = asyncio.create_task(counters.reconcile_forever())
+    if GRADE_GROUP_COMMIT:
+        grade_writes.start()
+    readiness.mark_ready()
+
+@app.on_event("shutdown")
+async def shutdown():
+    readiness.mark_draining()
+    app.state.availability_refresh.cancel()
+    app.state.org_refresh.cancel()
+    app.state.retention.cancel()
+    app.state.counter_reconcile.cancel()
+    await grade_writes.stop()
+    await change_feed.stop()
 
 @app.get("/")
 async def hello():
     return {"message": "hi :)"}
 
+@app.get("/ready", include_in_schema=False)
+async def ready():
+    """Readiness probe: 200 once the schema is migrated, the in-memory indexes are loaded and the pools are warm"""
+    if not readiness.ready:
+        return JSONResponse(status_code = 503, content = {"statement": "Worker is not ready.", "params": None}, headers = {"Retry-After": str(ADMISSION_RETRY_AFTER)})
+    return {"ready": True, "startup_seconds": readiness.ready_seconds}
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Hit/miss/eviction counters of the student and course lookup cache, for sizing CACHE_MAX_ENTRIES and CACHE_TTL,
+    and how many of the lookups that missed it were coalesced into shared queries"""
+    return {**entity_cache.stats(), "loaders": {"student": student_loader.stats(), "course": course_loader.stats()}}
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """Per-route latency histograms, query counts and db/pool/serialization time in the prometheus text format"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 @app.post("/")
 async def create_dummy_data(session: AsyncSession = Depends(get_session)):
     """Creates some dummy data in the database to test the requests"""
@@ -0,0 +1,239 @@
+import asyncio
+import functools
+import logging
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Type
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute
+from pydantic import parse_obj_as as _parse_obj_as
+from sqlalchemy import event
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from .config import METRICS_ENABLED, SERVER_TIMING, QUERY_BUDGET, QUERY_BUDGET_OVERRIDES
+
+# per-route request metrics, kept in process and rendered in the prometheus text format at /metrics.
+# every request gets a RequestStats in a context variable, the engine and pool hooks below add to it:
+# db time is the time spent in cursor execution (asyncpg fetches plain results there as well),
+# pool wait is the time spent getting a connection out of the pool, serialization is pydantic validation
+# and JSON encoding of the response. what is left of the request's time is handler code and ORM hydration.
+# with several workers every process has its own numbers, let prometheus scrape and sum them.
+# fastapi validates and encodes a returned value between the endpoint and the response class, with no hook of its
+# own: routers use TimedRoute, which notes when the endpoint returned, and TimedJSONResponse counts from there.
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class RequestStats:
+    __slots__ = ("queries", "db_seconds", "pool_wait_seconds", "serialize_seconds", "returned_at")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.pool_wait_seconds = 0.0
+        self.serialize_seconds = 0.0
+        # when the endpoint returned, None once the response has been rendered
+        self.returned_at: float | None = None
+
+_current: ContextVar[RequestStats | None] = ContextVar("request_stats", default=None)
+
+class _RouteMetrics:
+    __slots__ = ("buckets", "count", "seconds", "statuses", "queries", "db_seconds", "pool_wait_seconds", "serialize_seconds")
+
+    def __init__(self):
+        self.buckets = [0] * len(LATENCY_BUCKETS)  # not cumulative, summed up when rendered
+        self.count = 0
+        self.seconds = 0.0
+        self.statuses: dict[int, int] = {}
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.pool_wait_seconds = 0.0
+        self.serialize_seconds = 0.0
+
+    def observe(self, status: int, seconds: float, stats: RequestStats):
+        index = bisect_left(LATENCY_BUCKETS, seconds)
+        if index < len(self.buckets):
+            self.buckets[index] += 1
+        self.count += 1
+        self.seconds += seconds
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        self.queries += stats.queries
+        self.db_seconds += stats.db_seconds
+        self.pool_wait_seconds += stats.pool_wait_seconds
+        self.serialize_seconds += stats.serialize_seconds
+
+# (method, route template) -> metrics
+_routes: dict[tuple[str, str], _RouteMetrics] = {}
+# metrics kept by other modules: callables returning their lines of the text format, appended by render()
+_collectors: list[Callable[[], list[str]]] = []
+
+def register_collector(collector: Callable[[], list[str]]):
+    _collectors.append(collector)
+
+@contextmanager
+def serialization():
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats = _current.get()
+        if stats is not None:
+            stats.serialize_seconds += time.perf_counter() - started
+
+def parse_obj_as(type_: Type, obj: Any) -> Any:
+    # pydantic's parse_obj_as, counted as serialization time
+    with serialization():
+        return _parse_obj_as(type_, obj)
+
+def _returned():
+    stats = _current.get()
+    if stats is not None:
+        stats.returned_at = time.perf_counter()
+
+def _marking_return(call: Callable) -> Callable:
+    if asyncio.iscoroutinefunction(call):
+        @functools.wraps(call)
+        async def marked(*args, **kwargs):
+            result = await call(*args, **kwargs)
+            _returned()
+            return result
+    else:
+        # sync endpoints run in the threadpool with a copy of the context, the RequestStats in it is the same object
+        @functools.wraps(call)
+        def marked(*args, **kwargs):
+            result = call(*args, **kwargs)
+            _returned()
+            return result
+    return marked
+
+class TimedRoute(APIRoute):
+    """APIRoute whose endpoint notes when it returned, for TimedJSONResponse. Opted into with APIRouter(route_class=TimedRoute)."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if METRICS_ENABLED:
+            # the request handler calls dependant.call, self.endpoint stays the function as written
+            self.dependant.call = _marking_return(self.dependant.call)
+
+class TimedJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        # from the endpoint's return when there is one: response model validation and jsonable_encoder come first
+        stats = _current.get()
+        started = stats.returned_at if stats is not None and stats.returned_at is not None else time.perf_counter()
+        try:
+            return super().render(content)
+        finally:
+            if stats is not None:
+                stats.serialize_seconds += time.perf_counter() - started
+                stats.returned_at = None
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """The default pool of async engines, plus the time spent waiting for a connection (or opening one)."""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            stats = _current.get()
+            if stats is not None:
+                stats.pool_wait_seconds += time.perf_counter() - started
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["query_started"].pop()
+    stats = _current.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_seconds += time.perf_counter() - started
+
+def _handle_error(exception_context):
+    # a failed statement never reaches after_cursor_execute, drop its start time
+    connection = exception_context.connection
+    if connection is not None and connection.info.get("query_started"):
+        connection.info["query_started"].pop()
+
+def instrument_engine(engine):
+    if not METRICS_ENABLED:
+        return
+    sync_engine = engine.sync_engine
+    event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(sync_engine, "handle_error", _handle_error)
+
+def _server_timing(stats: RequestStats, seconds: float) -> str:
+    app_seconds = max(0.0, seconds - stats.db_seconds - stats.pool_wait_seconds - stats.serialize_seconds)
+    return ", ".join([
+        f'db;dur={stats.db_seconds * 1000:.1f};desc="{stats.queries} queries"',
+        f"pool;dur={stats.pool_wait_seconds * 1000:.1f}",
+        f"serialize;dur={stats.serialize_seconds * 1000:.1f}",
+        f"app;dur={app_seconds * 1000:.1f}",
+        f"total;dur={seconds * 1000:.1f}",
+    ])
+
+def instrument_app(app: FastAPI):
+    if not METRICS_ENABLED:
+        return
+    @app.middleware("http")
+    async def record_request(request: Request, call_next):
+        stats = RequestStats()
+        token = _current.set(stats)
+        started = time.perf_counter()
+        try:
+            response = await call_next(request)
+        finally:
+            _current.reset(token)
+        # streamed responses are only measured up to their headers
+        seconds = time.perf_counter() - started
+        route = request.scope.get("route")
+        key = (request.method, route.path if route is not None else "unmatched")
+        _routes.setdefault(key, _RouteMetrics()).observe(response.status_code, seconds, stats)
+
+        budget = QUERY_BUDGET_OVERRIDES.get(" ".join(key), QUERY_BUDGET)
+        if budget and stats.queries > budget:
+            logger.warning("Query budget exceeded: %s %s ran %d queries, the budget of %s is %d.", key[0], request.url.path, stats.queries, " ".join(key), budget)
+        if SERVER_TIMING:
+            response.headers["Server-Timing"] = _server_timing(stats, seconds)
+        return response
+
+def _labels(method: str, route: str, **extra) -> str:
+    labels = {"method": method, "route": route, **extra}
+    return ",".join(f'{name}="{value}"' for name, value in labels.items())
+
+def render() -> str:
+    lines = [
+        "# HELP http_request_duration_seconds Request latency by route, up to the response headers.",
+        "# TYPE http_request_duration_seconds histogram",
+    ]
+    for (method, route), metrics in sorted(_routes.items()):
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS, metrics.buckets):
+            cumulative += count
+            lines.append(f"http_request_duration_seconds_bucket{{{_labels(method, route, le=bound)}}} {cumulative}")
+        lines.append(f"http_request_duration_seconds_bucket{{{_labels(method, route, le='+Inf')}}} {metrics.count}")
+        lines.append(f"http_request_duration_seconds_sum{{{_labels(method, route)}}} {metrics.seconds}")
+        lines.append(f"http_request_duration_seconds_count{{{_labels(method, route)}}} {metrics.count}")
+
+    lines += ["# HELP http_requests_total Requests by route and status code.", "# TYPE http_requests_total counter"]
+    for (method, route), metrics in sorted(_routes.items()):
+        for status, count in sorted(metrics.statuses.items()):
+            lines.append(f"http_requests_total{{{_labels(method, route, status=status)}}} {count}")
+
+    totals = [
+        ("db_queries_total", "SQL statements executed.", "queries"),
+        ("db_query_seconds_total", "Time spent executing SQL statements.", "db_seconds"),
+        ("db_pool_wait_seconds_total", "Time spent waiting for a pooled connection.", "pool_wait_seconds"),
+        ("serialization_seconds_total", "Time spent validating and encoding responses.", "serialize_seconds"),
+    ]
+    for name, help, attribute in totals:
+        lines += [f"# HELP {name} {help}", f"# TYPE {name} counter"]
+        for (method, route), metrics in sorted(_routes.items()):
+            lines.append(f"{name}{{{_labels(method, route)}}} {getattr(metrics, attribute)}")
+    for collector in _collectors:
+        lines += collector()
+    return "\n".join(lines) + "\n"
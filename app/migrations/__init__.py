@@ -0,0 +1,74 @@
+import asyncio
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+from ..db import engine
+from .. import models  # noqa: F401, registers every table on Base.metadata
+from . import r0001_baseline, r0002_foreign_key_indexes, r0003_row_versions, r0004_retention, r0005_counters, r0006_changes, r0007_professor_department_index, r0008_change_outbox
+
+# versioned schema migrations, applied in order at startup and recorded in schema_migrations.
+# every revision module has VERSION, TRANSACTIONAL and `async def upgrade(conn)`.
+# transactional revisions run in one transaction together with their bookkeeping row,
+# the others (CREATE INDEX CONCURRENTLY can't run inside a transaction) run on an autocommit connection
+# and must be safe to re-run, since a crash can leave them applied but unrecorded.
+# r0001 creates the tables of the current models, so later revisions must be no-ops on a fresh database
+# (IF NOT EXISTS and friends) and only do real work on databases created before them.
+
+REVISIONS = [r0001_baseline, r0002_foreign_key_indexes, r0003_row_versions, r0004_retention, r0005_counters, r0006_changes, r0007_professor_department_index, r0008_change_outbox]
+
+# arbitrary, but fixed: every worker must agree on it
+MIGRATION_LOCK_ID = 7_310_420_015
+# waiting workers poll instead of blocking in pg_advisory_lock, a backend stuck in that call holds a snapshot
+# and CREATE INDEX CONCURRENTLY would wait on it forever
+LOCK_POLL_SECONDS = 0.5
+
+async def _applied_versions(conn: AsyncConnection) -> set[int]:
+    await conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        "version INTEGER PRIMARY KEY, name VARCHAR NOT NULL, applied_at TIMESTAMP NOT NULL DEFAULT now())"
+    ))
+    version_query = await conn.execute(text("SELECT version FROM schema_migrations"))
+    return set(version_query.scalars().all())
+
+async def _pending(conn: AsyncConnection) -> bool:
+    # read-only check without the lock: CREATE TABLE IF NOT EXISTS isn't safe to race, so a missing table counts as pending
+    if (await conn.execute(text("SELECT to_regclass('schema_migrations') IS NULL"))).scalar():
+        return True
+    version_query = await conn.execute(text("SELECT version FROM schema_migrations"))
+    applied = set(version_query.scalars().all())
+    return any(revision.VERSION not in applied for revision in REVISIONS)
+
+async def _record(conn: AsyncConnection, revision):
+    await conn.execute(
+        text("INSERT INTO schema_migrations (version, name) VALUES (:version, :name) ON CONFLICT DO NOTHING"),
+        {"version": revision.VERSION, "name": revision.__name__.rsplit(".", 1)[-1]},
+    )
+
+async def upgrade():
+    if engine.dialect.name != "postgresql":
+        raise RuntimeError(f"The schema needs PostgreSQL (pg_trgm, JSONB, exclusion constraints), DATABASE_URL points at {engine.dialect.name}.")
+
+    async with engine.connect() as lock_conn:
+        lock_conn = await lock_conn.execution_options(isolation_level="AUTOCOMMIT")
+        # the usual case, a restart or the other workers of a deploy that has migrated already:
+        # nothing pending, so don't queue up behind the lock just to find that out
+        if not await _pending(lock_conn):
+            print("Database schema is up to date.")
+            return
+        while not (await lock_conn.execute(text("SELECT pg_try_advisory_lock(:id)"), {"id": MIGRATION_LOCK_ID})).scalar():
+            await asyncio.sleep(LOCK_POLL_SECONDS)
+        try:
+            applied = await _applied_versions(lock_conn)
+            pending = [revision for revision in REVISIONS if revision.VERSION not in applied]
+            if not pending:
+                print("Database schema is up to date.")
+            for revision in pending:
+                print(f"Applying migration {revision.__name__}...")
+                if revision.TRANSACTIONAL:
+                    async with engine.begin() as conn:
+                        await revision.upgrade(conn)
+                        await _record(conn, revision)
+                else:
+                    await revision.upgrade(lock_conn)
+                    await _record(lock_conn, revision)
+        finally:
+            await lock_conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": MIGRATION_LOCK_ID})
@@ -0,0 +1,23 @@
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+from ..db import Base
+
+# tables of the current models, created only where missing (checkfirst), which covers both a fresh database
+# and one left behind by the old create-if-empty startup
+VERSION = 1
+TRANSACTIONAL = True
+
+async def upgrade(conn: AsyncConnection):
+    await conn.run_sync(Base.metadata.create_all)
+    # create_all doesn't touch existing tables, so older databases get the double-booking constraint here
+    # this fails if they already contain overlapping bookings, those have to be resolved by hand first
+    await conn.execute(text("""
+        DO $$
+        BEGIN
+            IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'timeslots_auditorium_no_overlap') THEN
+                ALTER TABLE timeslots ADD CONSTRAINT timeslots_auditorium_no_overlap
+                    EXCLUDE USING gist (int4range(auditorium_id, auditorium_id, '[]') WITH =, tsrange(start, "end") WITH &&);
+            END IF;
+        END
+        $$
+    """))
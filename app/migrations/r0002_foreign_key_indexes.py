@@ -0,0 +1,50 @@
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+# indexes for the hot foreign keys and for the unique/trigram indexes older databases never got.
+# built CONCURRENTLY so a large table keeps taking writes, which means no transaction around them
+VERSION = 2
+TRANSACTIONAL = False
+
+INDEXES = [
+    ("ix_students_group_id", "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_students_group_id ON students (group_id)"),
+    ("ix_course_students_student_id", "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_course_students_student_id ON course_students (student_id)"),
+    ("ix_timeslots_auditorium_id", "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_timeslots_auditorium_id ON timeslots (auditorium_id)"),
+    ("ix_timeslots_course_id", "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_timeslots_course_id ON timeslots (course_id)"),
+    ("ix_grades_course_id", "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_grades_course_id ON grades (course_id)"),
+    # composite (student_id, course_id): serves lookups by student as well, and ON CONFLICT for grade upserts.
+    # fresh databases already have it under this name as the unique constraint's index
+    ("grades_student_id_course_id_key", "CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS grades_student_id_course_id_key ON grades (student_id, course_id)"),
+    ("students_name_trgm", "CREATE INDEX CONCURRENTLY IF NOT EXISTS students_name_trgm ON students USING gin (translate(lower(name), 'ё', 'е') gin_trgm_ops)"),
+    ("professors_name_trgm", "CREATE INDEX CONCURRENTLY IF NOT EXISTS professors_name_trgm ON professors USING gin (translate(lower(name), 'ё', 'е') gin_trgm_ops)"),
+]
+
+async def create_indexes(conn: AsyncConnection, indexes: list[tuple[str, str]]):
+    for name, statement in indexes:
+        # an interrupted concurrent build leaves an INVALID index behind, IF NOT EXISTS would then skip it forever
+        invalid_query = await conn.execute(
+            text("SELECT 1 FROM pg_index JOIN pg_class ON pg_class.oid = pg_index.indexrelid WHERE pg_class.relname = :name AND NOT pg_index.indisvalid"),
+            {"name": name},
+        )
+        if invalid_query.scalar():
+            await conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+        await conn.execute(text(statement))
+
+async def _check_duplicate_grades(conn: AsyncConnection):
+    # the unique index can't be built over a student graded twice in one course, and which grade is the right one
+    # is not ours to decide: stop with the pairs to clean up instead of failing halfway through the build
+    duplicate_query = await conn.execute(text(
+        "SELECT student_id, course_id, array_agg(id ORDER BY id) AS grade_ids FROM grades "
+        "GROUP BY student_id, course_id HAVING count(*) > 1 ORDER BY student_id, course_id"
+    ))
+    duplicates = duplicate_query.all()
+    if duplicates:
+        examples = ", ".join(f"student {row.student_id} in course {row.course_id}: grades {row.grade_ids}" for row in duplicates[:10])
+        raise RuntimeError(
+            f"grades has {len(duplicates)} (student_id, course_id) pairs with more than one grade, so the unique index "
+            f"grades_student_id_course_id_key can't be built. Delete all but one grade of each pair and restart. {examples}"
+        )
+
+async def upgrade(conn: AsyncConnection):
+    await _check_duplicate_grades(conn)
+    await create_indexes(conn, INDEXES)
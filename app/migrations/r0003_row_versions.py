@@ -0,0 +1,11 @@
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+# row version columns for optimistic concurrency and ETags.
+# adding a column with a constant default only touches the catalog, existing rows are not rewritten
+VERSION = 3
+TRANSACTIONAL = True
+
+async def upgrade(conn: AsyncConnection):
+    for table in ("students", "courses", "grades"):
+        await conn.execute(text(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 1"))
@@ -0,0 +1,29 @@
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+from .r0002_foreign_key_indexes import create_indexes
+
+# archive and progress tables of the retention job, the indexes it walks expired rows by and the ones it unlinks grades by.
+# no transaction because of the concurrent index builds, everything here is IF NOT EXISTS
+VERSION = 4
+TRANSACTIONAL = False
+
+TABLES = [
+    "CREATE TABLE IF NOT EXISTS archived_rows ("
+    "table_name VARCHAR NOT NULL, row_id INTEGER NOT NULL, data JSONB NOT NULL, archived_at TIMESTAMP NOT NULL DEFAULT now(), "
+    "PRIMARY KEY (table_name, row_id))",
+    "CREATE TABLE IF NOT EXISTS retention_progress ("
+    "policy VARCHAR PRIMARY KEY, after_time TIMESTAMP, after_id INTEGER, archived INTEGER NOT NULL DEFAULT 0, updated_at TIMESTAMP NOT NULL DEFAULT now())",
+]
+
+INDEXES = [
+    ("ix_tasks_created_at", "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_tasks_created_at ON tasks (created_at)"),
+    ("ix_timeslots_end", 'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_timeslots_end ON timeslots ("end")'),
+    # the foreign keys deleted tasks and exams are unlinked from
+    ("ix_grades_task_id", "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_grades_task_id ON grades (task_id)"),
+    ("ix_grades_exam_id", "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_grades_exam_id ON grades (exam_id)"),
+]
+
+async def upgrade(conn: AsyncConnection):
+    for statement in TABLES:
+        await conn.execute(text(statement))
+    await create_indexes(conn, INDEXES)
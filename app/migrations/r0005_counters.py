@@ -0,0 +1,29 @@
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+# denormalized counters of app/counters.py, filled in once from the base tables.
+# in the same transaction as the new columns, so no write can slip in between the backfill and the first adjust()
+VERSION = 5
+TRANSACTIONAL = True
+
+# table -> counter -> recount of the row aliased as t, as the counters were defined when this revision was written.
+# frozen here: later changes to counters.RECOUNTS must not change what this revision did
+RECOUNTS = {
+    "courses": {
+        "student_count": "SELECT count(*) FROM course_students cs WHERE cs.course_id = t.id",
+        "graded_count": "SELECT count(*) FROM course_students cs JOIN grades g ON g.student_id = cs.student_id AND g.course_id = cs.course_id WHERE cs.course_id = t.id",
+    },
+    "groups": {
+        "student_count": "SELECT count(*) FROM students s WHERE s.group_id = t.id",
+    },
+    "auditoriums": {
+        "booked_minutes": 'SELECT coalesce(sum(floor(extract(epoch FROM ts."end" - ts.start) / 60)), 0) FROM timeslots ts WHERE ts.auditorium_id = t.id',
+    },
+}
+
+async def upgrade(conn: AsyncConnection):
+    for table, recounts in RECOUNTS.items():
+        for counter in recounts:
+            await conn.execute(text(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {counter} INTEGER NOT NULL DEFAULT 0"))
+        assignments = ", ".join(f"{counter} = ({recount})" for counter, recount in recounts.items())
+        await conn.execute(text(f"UPDATE {table} t SET {assignments}"))
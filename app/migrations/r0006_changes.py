@@ -0,0 +1,19 @@
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+# outbox of the change feed (app/changes.py) and its compaction watermark. the feed starts empty,
+# consumers of a database that had data before it take one full copy and follow the feed from there
+VERSION = 6
+TRANSACTIONAL = True
+
+TABLES = [
+    "CREATE TABLE IF NOT EXISTS changes ("
+    "seq BIGSERIAL PRIMARY KEY, entity VARCHAR NOT NULL, entity_id INTEGER NOT NULL, op VARCHAR NOT NULL, data JSONB, "
+    "created_at TIMESTAMP NOT NULL DEFAULT now())",
+    "CREATE TABLE IF NOT EXISTS change_compaction ("
+    "id INTEGER PRIMARY KEY, compacted_through BIGINT NOT NULL DEFAULT 0, compacted_at TIMESTAMP NOT NULL DEFAULT now())",
+]
+
+async def upgrade(conn: AsyncConnection):
+    for statement in TABLES:
+        await conn.execute(text(statement))
@@ -0,0 +1,13 @@
+from sqlalchemy.ext.asyncio import AsyncConnection
+from .r0002_foreign_key_indexes import create_indexes
+
+# professors by department, what GET /buildings/{id}/professors is left with once the org tree has mapped the building
+VERSION = 7
+TRANSACTIONAL = False
+
+INDEXES = [
+    ("ix_professors_department_id", "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_professors_department_id ON professors (department_id)"),
+]
+
+async def upgrade(conn: AsyncConnection):
+    await create_indexes(conn, INDEXES)
@@ -0,0 +1,17 @@
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+# writes go to change_outbox and are published to changes once every older transaction has finished
+# (app/changes.py), instead of every write taking the feed's lock until its commit
+VERSION = 8
+TRANSACTIONAL = True
+
+TABLES = [
+    "CREATE TABLE IF NOT EXISTS change_outbox ("
+    "id BIGSERIAL PRIMARY KEY, txid BIGINT NOT NULL DEFAULT CAST(CAST(pg_current_xact_id() AS text) AS bigint), "
+    "entity VARCHAR NOT NULL, entity_id INTEGER NOT NULL, op VARCHAR NOT NULL, data JSONB, created_at TIMESTAMP NOT NULL DEFAULT now())",
+]
+
+async def upgrade(conn: AsyncConnection):
+    for statement in TABLES:
+        await conn.execute(text(statement))
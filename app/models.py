@@ -1,29 +1,55 @@
-from sqlalchemy import Column, ForeignKey, Integer, String, DateTime, Boolean, Table, UniqueConstraint
+import unicodedata
+from sqlalchemy import BigInteger, Column, ForeignKey, Integer, String, DateTime, Boolean, Table, UniqueConstraint, Index, DDL, event, func, literal_column, text
+from sqlalchemy.dialects.postgresql import ExcludeConstraint, JSONB
 from sqlalchemy.orm import relationship
 from .db import Base
 
+event.listen(Base.metadata, "before_create", DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql"))
+
+def search_key(column):
+    # lower-cased with ё folded into е, name search queries must use exactly this expression for the trigram indexes to apply
+    # the literals are inlined on purpose, a bound parameter would not match the index expression
+    return func.translate(func.lower(column), literal_column("'ё'"), literal_column("'е'"))
+
+def normalize(value: str) -> str:
+    # search_key for a query string on the python side
+    return unicodedata.normalize("NFC", value).lower().replace("ё", "е")
+
+def _name_search_index(name: str, column) -> Index:
+    return Index(
+        name, search_key(column).label("name_search"),
+        postgresql_using="gin", postgresql_ops={"name_search": "gin_trgm_ops"},
+    ).ddl_if(dialect="postgresql")
+
 class Student(Base):
     __tablename__ = "students"
 
     id = Column(Integer, primary_key=True)
-    group_id = Column(Integer, ForeignKey("groups.id"), nullable=False)
+    group_id = Column(Integer, ForeignKey("groups.id"), nullable=False, index=True)
     name = Column(String, nullable=False)
     phone = Column(String)
     address = Column(String)
     group = relationship("Group", back_populates="students")
     grades = relationship("Grade", back_populates="student")
     courses = relationship("Course", secondary="course_students", back_populates="students")
+    # row version (students, courses and grades have one): the ORM bumps it and checks it in the UPDATE's WHERE clause,
+    # so a flush over a row someone else changed in the meantime raises StaleDataError instead of overwriting it.
+    # it is also the row's ETag. core statements updating these tables must bump it themselves, inserts get the server default
+    version = Column(Integer, nullable=False, server_default="1")
+    __table_args__ = (_name_search_index("students_name_trgm", name),)
+    __mapper_args__ = {"version_id_col": version}
 
 class Professor(Base):
     __tablename__ = "professors"
 
     id = Column(Integer, primary_key=True)
-    department_id = Column(Integer, ForeignKey("departments.id"), nullable=False)
+    department_id = Column(Integer, ForeignKey("departments.id"), nullable=False, index=True)
     name = Column(String, nullable=False)
     phone = Column(String)
     address = Column(String)
     courses = relationship("Course", secondary="course_professors", back_populates="professors")
     department = relationship("Department", back_populates="professors")
+    __table_args__ = (_name_search_index("professors_name_trgm", name),)
 
 class Group(Base):
     __tablename__ = "groups"
@@ -31,6 +57,8 @@ class Group(Base):
     id = Column(Integer, primary_key=True)
     department_id = Column(Integer, ForeignKey("departments.id"), nullable=False)
     enrolled_at = Column(DateTime, nullable=False)
+    # counter maintained by the writes in crud.py and repaired by app/counters.py
+    student_count = Column(Integer, nullable=False, default=0, server_default="0")
     department = relationship("Department", back_populates="groups")
     students = relationship("Student", back_populates="group")
 
@@ -91,10 +119,17 @@ class Course(Base):
     tasks = relationship("Task", back_populates="course")
     grades = relationship("Grade", back_populates="course")
     semester = relationship("Semester", back_populates="courses")
+    # counters maintained by the writes in crud.py and repaired by app/counters.py, part of CourseOut.
+    # graded_count counts enrolled students holding a grade for the course
+    student_count = Column(Integer, nullable=False, default=0, server_default="0")
+    graded_count = Column(Integer, nullable=False, default=0, server_default="0")
+    version = Column(Integer, nullable=False, server_default="1")
+    __mapper_args__ = {"version_id_col": version}
 
 course_students = Table("course_students", Base.metadata,
     Column("course_id", ForeignKey("courses.id"), primary_key=True),
-    Column("student_id", ForeignKey("students.id"), primary_key=True)
+    # the primary key only serves lookups by course, rosters of a student need their own index
+    Column("student_id", ForeignKey("students.id"), primary_key=True, index=True)
 )
 
 course_professors = Table("course_professors", Base.metadata,
@@ -112,18 +147,29 @@ class Timeslot(Base):
     __tablename__ = "timeslots"
 
     id = Column(Integer, primary_key=True)
-    auditorium_id = Column(Integer, ForeignKey("auditoriums.id"), nullable=False)
-    course_id = Column(Integer, ForeignKey("courses.id"))
+    auditorium_id = Column(Integer, ForeignKey("auditoriums.id"), nullable=False, index=True)
+    course_id = Column(Integer, ForeignKey("courses.id"), index=True)
     class_id = Column(Integer, ForeignKey("classes.id"))
     exam_id = Column(Integer, ForeignKey("exams.id"))
     start = Column(DateTime, nullable=False)
-    end = Column(DateTime, nullable=False)
+    end = Column(DateTime, nullable=False, index=True)
     auditorium = relationship("Auditorium", back_populates="timeslots")
     course = relationship("Course", back_populates="timeslots")
     classes = relationship("Class", back_populates="timeslot", cascade="all, delete-orphan", single_parent=True)
     exams = relationship("Exam", back_populates="timeslot", cascade="all, delete-orphan", single_parent=True)
     # add unique constraints to ensure we can only have the class/exam take one timeslot
-    __table_args__ = (UniqueConstraint('class_id'), UniqueConstraint('exam_id'))
+    # the exclusion constraint is what actually prevents double-booking an auditorium, [start, end) ranges of the same room can't overlap
+    # int4range(id, id, '[]') WITH = is the built-in way to get equality into a gist index without the btree_gist extension
+    __table_args__ = (
+        UniqueConstraint('class_id'),
+        UniqueConstraint('exam_id'),
+        ExcludeConstraint(
+            (func.int4range(auditorium_id, auditorium_id, literal_column("'[]'")), "="),
+            (func.tsrange(start, end), "&&"),
+            name="timeslots_auditorium_no_overlap",
+            using="gist",
+        ),
+    )
     
 
 class Class(Base):
@@ -148,7 +194,8 @@ class Task(Base):
     course_id = Column(Integer, ForeignKey("courses.id"), nullable=False)
     name = Column(String, nullable=False)
     desc = Column(String)
-    created_at = Column(DateTime, nullable=False)
+    # indexed for the retention job, expired tasks are a prefix of this index
+    created_at = Column(DateTime, nullable=False, index=True)
     deadline = Column(DateTime)
     course = relationship("Course", back_populates="tasks")
     grades = relationship("Grade", back_populates="task")
@@ -163,6 +210,8 @@ class Auditorium(Base):
     max_capacity = Column(Integer)
     has_projector = Column(Boolean, nullable=False)
     has_board = Column(Boolean, nullable=False)
+    # whole minutes of all its timeslots, maintained like the counters of Course and Group
+    booked_minutes = Column(Integer, nullable=False, default=0, server_default="0")
     building = relationship("Building", back_populates="auditoriums")
     timeslots = relationship("Timeslot", back_populates="auditorium")
 
@@ -183,10 +232,77 @@ class Grade(Base):
     id = Column(Integer, primary_key=True)
     student_id = Column(Integer, ForeignKey("students.id"), nullable=False)
     grade = Column(Integer, nullable=False)
-    task_id = Column(Integer, ForeignKey("tasks.id"), nullable=True)
-    exam_id = Column(Integer, ForeignKey("exams.id"), nullable=True)
-    course_id = Column(Integer, ForeignKey("courses.id"), nullable=True)
+    # indexed so deleting a task or exam doesn't scan every grade
+    task_id = Column(Integer, ForeignKey("tasks.id"), nullable=True, index=True)
+    exam_id = Column(Integer, ForeignKey("exams.id"), nullable=True, index=True)
+    course_id = Column(Integer, ForeignKey("courses.id"), nullable=True, index=True)
     student = relationship("Student", back_populates="grades")
     task = relationship("Task", back_populates="grades")
     exam = relationship("Exam", back_populates="grades")
-    course = relationship("Course", back_populates="grades")
\ No newline at end of file
+    course = relationship("Course", back_populates="grades")
+    version = Column(Integer, nullable=False, server_default="1")
+    # one course grade per student, this also lets grade writes upsert with ON CONFLICT instead of checking first
+    # its (student_id, course_id) index doubles as the index for lookups by student
+    __table_args__ = (UniqueConstraint("student_id", "course_id"),)
+    __mapper_args__ = {"version_id_col": version}
+
+# grade counts per (scope, id, grade value), e.g. ("department", 3, 5) -> how many fives were given in department 3
+# maintained in the same transaction as every course grade write, so analytics read a handful of rows instead of scanning grades
+class GradeHistogram(Base):
+    __tablename__ = "grade_histograms"
+
+    scope = Column(String, primary_key=True)
+    scope_id = Column(Integer, primary_key=True)
+    grade = Column(Integer, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+# rows removed by the retention job (app/retention.py), kept as JSON with whatever pointed at them
+class ArchivedRow(Base):
+    __tablename__ = "archived_rows"
+
+    table_name = Column(String, primary_key=True)
+    row_id = Column(Integer, primary_key=True)
+    data = Column(JSONB, nullable=False)
+    archived_at = Column(DateTime, nullable=False, server_default=func.now())
+
+# where each retention policy stopped, a restarted worker carries on from here
+class RetentionProgress(Base):
+    __tablename__ = "retention_progress"
+
+    policy = Column(String, primary_key=True)
+    after_time = Column(DateTime)
+    after_id = Column(Integer)
+    archived = Column(Integer, nullable=False, server_default="0")
+    updated_at = Column(DateTime, nullable=False, server_default=func.now())
+
+# transactional outbox of student, course and grade writes (app/changes.py), read by GET /changes/
+class Change(Base):
+    __tablename__ = "changes"
+
+    seq = Column(BigInteger, primary_key=True)
+    entity = Column(String, nullable=False)
+    entity_id = Column(Integer, nullable=False)
+    op = Column(String, nullable=False)
+    # the row as it was committed, NULL for deletes
+    data = Column(JSONB)
+    created_at = Column(DateTime, nullable=False, server_default=func.now())
+
+# writes waiting to be published to the changes table in commit order, with the transaction that made them
+class ChangeOutbox(Base):
+    __tablename__ = "change_outbox"
+
+    id = Column(BigInteger, primary_key=True)
+    txid = Column(BigInteger, nullable=False, server_default=text("CAST(CAST(pg_current_xact_id() AS text) AS bigint)"))
+    entity = Column(String, nullable=False)
+    entity_id = Column(Integer, nullable=False)
+    op = Column(String, nullable=False)
+    data = Column(JSONB)
+    created_at = Column(DateTime, nullable=False, server_default=func.now())
+
+# every change up to compacted_through has been compacted away, consumers behind it have to resync
+class ChangeCompaction(Base):
+    __tablename__ = "change_compaction"
+
+    id = Column(Integer, primary_key=True)
+    compacted_through = Column(BigInteger, nullable=False, server_default="0")
+    compacted_at = Column(DateTime, nullable=False, server_default=func.now())
\ No newline at end of file
@@ -0,0 +1,89 @@
+import asyncio
+import time
+from sqlalchemy import select
+from . import models
+from .config import ORG_REFRESH_SECONDS
+from .db import async_session
+
+# in-memory copy of the organisational tree: faculties, departments, buildings, groups and curricula.
+# a few hundred rows that hardly ever change, so the joins up and down the tree (building -> department,
+# faculty -> departments -> groups) are dictionary lookups and the remaining query goes straight to the indexed
+# foreign key of the leaf table. every worker loads it at startup, writes made through the API reload it
+# (invalidate), writes made elsewhere show up with the periodic refresh, or earlier when a lookup misses.
+
+# a lookup for an id the tree doesn't know reloads it at most this often, unknown ids don't turn into a reload each
+MISS_RELOAD_SECONDS = 5.0
+
+class OrgTree:
+    def __init__(self):
+        self.faculties: dict[int, dict] = {}
+        self.departments: dict[int, dict] = {}
+        self.buildings: dict[int, dict] = {}
+        self.groups: dict[int, dict] = {}
+        self.curricula: dict[int, dict] = {}
+        self.departments_by_faculty: dict[int, list[int]] = {}
+        self.groups_by_department: dict[int, list[int]] = {}
+        self.buildings_by_department: dict[int, list[int]] = {}
+        self.curricula_by_department: dict[int, list[int]] = {}
+        self.loaded_at = 0.0
+        self._loading: asyncio.Task | None = None
+
+    async def load(self):
+        async with async_session() as session:
+            tables = {}
+            for name, model in (
+                ("faculties", models.Faculty), ("departments", models.Department), ("buildings", models.Building),
+                ("groups", models.Group), ("curricula", models.Curriculum),
+            ):
+                # counters (groups.student_count) change all the time, they are not part of the tree
+                columns = [column for column in model.__table__.c if column.name != "student_count"]
+                row_query = await session.execute(select(*columns).order_by(model.id))
+                tables[name] = {row.id: dict(row._mapping) for row in row_query}
+
+        children = {"departments_by_faculty": {}, "groups_by_department": {}, "buildings_by_department": {}, "curricula_by_department": {}}
+        for index, table, parent in (
+            ("departments_by_faculty", "departments", "faculty_id"),
+            ("groups_by_department", "groups", "department_id"),
+            ("buildings_by_department", "buildings", "department_id"),
+            ("curricula_by_department", "curricula", "department_id"),
+        ):
+            for id, row in tables[table].items():
+                if row[parent] is not None:
+                    children[index].setdefault(row[parent], []).append(id)
+
+        # swapped in one go, readers never see a half built tree
+        for name, rows in {**tables, **children}.items():
+            setattr(self, name, rows)
+        self.loaded_at = time.monotonic()
+
+    async def invalidate(self):
+        # after a write to one of the tree's tables, concurrent invalidations share one reload
+        if self._loading is None or self._loading.done():
+            self._loading = asyncio.create_task(self.load())
+        await asyncio.shield(self._loading)
+
+    async def find(self, table: str, id: int) -> dict | None:
+        # the row of e.g. find("buildings", 3), None if it doesn't exist
+        rows = getattr(self, table)
+        if id not in rows and time.monotonic() - self.loaded_at >= MISS_RELOAD_SECONDS:
+            await self.invalidate()
+            rows = getattr(self, table)
+        return rows.get(id)
+
+    def faculty_groups(self, faculty_id: int) -> list[int]:
+        return [
+            group_id
+            for department_id in self.departments_by_faculty.get(faculty_id, [])
+            for group_id in self.groups_by_department.get(department_id, [])
+        ]
+
+    async def refresh_forever(self):
+        while True:
+            await asyncio.sleep(ORG_REFRESH_SECONDS)
+            try:
+                await self.invalidate()
+            except Exception as ex:
+                # keep serving the previous tree, the next refresh will try again
+                print(f"Org tree refresh failed: {ex!r}")
+
+org_tree = OrgTree()
@@ -0,0 +1,53 @@
+import base64
+import binascii
+from typing import AsyncIterator, Literal
+import orjson
+from fastapi import HTTPException, Query
+from fastapi.responses import StreamingResponse
+from .config import PAGE_SIZE_DEFAULT, PAGE_SIZE_MAX, STREAM_CHUNK_SIZE
+
+# cursors are opaque to clients on purpose: today they only carry the last seen id,
+# but keeping them encoded lets us change the sort key later without breaking anyone
+
+def encode_cursor(last_id: int) -> str:
+    return base64.urlsafe_b64encode(str(last_id).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> int:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        return int(base64.urlsafe_b64decode(padded.encode()).decode())
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=400, detail={"statement": "Invalid pagination cursor.", "params": cursor})
+
+class PageParams:
+    """Common query parameters for keyset-paginated list endpoints."""
+    def __init__(
+        self,
+        limit: int = Query(PAGE_SIZE_DEFAULT, ge=1, le=PAGE_SIZE_MAX),
+        after: str | None = Query(None, description="Opaque cursor returned as next_cursor by the previous page"),
+        format: Literal["json", "ndjson"] = Query("json", description="ndjson streams every row after the cursor"),
+    ):
+        self.limit = limit
+        self.after = decode_cursor(after) if after else None
+        self.format = format
+
+def paginate(rows: list, limit: int) -> tuple[list, str | None]:
+    # crud fetches limit + 1 rows, the extra one only tells us whether there is a next page
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, encode_cursor(rows[-1].id)
+    return rows, None
+
+async def _ndjson_lines(rows: AsyncIterator) -> AsyncIterator[bytes]:
+    # rows carry exactly the columns of the output schema (see serialization.out_columns)
+    buffer = []
+    async for row in rows:
+        buffer.append(orjson.dumps(row._asdict()))
+        if len(buffer) >= STREAM_CHUNK_SIZE:
+            yield b"\n".join(buffer) + b"\n"
+            buffer = []
+    if buffer:
+        yield b"\n".join(buffer) + b"\n"
+
+def ndjson_response(rows: AsyncIterator) -> StreamingResponse:
+    return StreamingResponse(_ndjson_lines(rows), media_type="application/x-ndjson")
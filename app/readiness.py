@@ -0,0 +1,119 @@
+import asyncio
+import time
+from contextlib import contextmanager
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import crud, metrics
+from .config import DB_POOL_WARM
+from .db import engine, replica_engines
+
+# cold start of a worker. startup runs the migrations (one worker at a time, see app/migrations), loads the in-memory
+# indexes and warms the connection pools: DB_POOL_WARM connections per engine are opened up front and the hot
+# statements prepared on each, so the first requests after a deploy don't pay for connecting and preparing.
+# GET /ready answers 200 only after all of that, and 503 again once the worker starts shutting down.
+# times are measured from the import of this module, the first thing app.main imports
+
+# probes don't count as the first request
+PROBE_PATHS = {"/ready", "/metrics"}
+
+async def _prepare(conn):
+    async with AsyncSession(bind=conn) as session:
+        await crud.prepare_hot_statements(session)
+
+async def _warm(engine) -> int:
+    # checked out all at once, so the pool has to open every one of them
+    count = min(DB_POOL_WARM, engine.pool.size())
+    opened = await asyncio.gather(*(engine.connect().start() for _ in range(count)), return_exceptions=True)
+    connections = [conn for conn in opened if not isinstance(conn, BaseException)]
+    try:
+        await asyncio.gather(*(_prepare(conn) for conn in connections))
+    finally:
+        for conn in connections:
+            await conn.close()
+    failed = [conn for conn in opened if isinstance(conn, BaseException)]
+    if failed:
+        raise failed[0]
+    return len(connections)
+
+class Readiness:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.ready = False
+        self.phases: dict[str, float] = {}
+        self.ready_seconds: float | None = None
+        self.first_request_seconds: float | None = None
+        self.warmed_connections = 0
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = time.perf_counter() - started
+
+    async def warm_pools(self):
+        if DB_POOL_WARM <= 0:
+            return
+        for pool_engine in [engine, *replica_engines]:
+            try:
+                self.warmed_connections += await _warm(pool_engine)
+            except Exception as ex:
+                # only the head start is lost, the pool still opens connections on demand
+                print(f"Connection pool warm-up failed: {ex!r}")
+
+    def mark_ready(self):
+        self.ready = True
+        self.ready_seconds = time.perf_counter() - self.started
+        phases = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in self.phases.items())
+        print(f"Worker ready in {self.ready_seconds:.2f}s ({phases}), {self.warmed_connections} connections warmed.")
+
+    def mark_draining(self):
+        self.ready = False
+
+    def render(self) -> list[str]:
+        lines = [
+            "# HELP worker_ready Whether the worker answers GET /ready with 200.",
+            "# TYPE worker_ready gauge",
+            f"worker_ready {int(self.ready)}",
+            "# HELP worker_startup_phase_seconds Time spent in each startup phase.",
+            "# TYPE worker_startup_phase_seconds gauge",
+        ]
+        lines += [f'worker_startup_phase_seconds{{phase="{name}"}} {seconds}' for name, seconds in self.phases.items()]
+        lines += [
+            "# HELP worker_warmed_connections Pooled connections opened and prepared during startup.",
+            "# TYPE worker_warmed_connections gauge",
+            f"worker_warmed_connections {self.warmed_connections}",
+        ]
+        if self.ready_seconds is not None:
+            lines += [
+                "# HELP worker_ready_seconds Time from worker start until it was ready.",
+                "# TYPE worker_ready_seconds gauge",
+                f"worker_ready_seconds {self.ready_seconds}",
+            ]
+        if self.first_request_seconds is not None:
+            lines += [
+                "# HELP worker_first_request_seconds Time from worker start until its first successful response.",
+                "# TYPE worker_first_request_seconds gauge",
+                f"worker_first_request_seconds {self.first_request_seconds}",
+            ]
+        return lines
+
+readiness = Readiness()
+metrics.register_collector(readiness.render)
+
+class FirstRequestTimer:
+    """ASGI middleware noting when the worker sent its first successful response, out of the way once it has."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if readiness.first_request_seconds is not None or scope["type"] != "http" or scope["path"] in PROBE_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        async def timed_send(message):
+            if message["type"] == "http.response.start" and message["status"] < 500 and readiness.first_request_seconds is None:
+                readiness.first_request_seconds = time.perf_counter() - readiness.started
+            await send(message)
+        await self.app(scope, receive, timed_send)
@@ -0,0 +1,138 @@
+import asyncio
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+from . import changes, counters, metrics, models
+from .availability import as_naive
+from .config import RETENTION_ENABLED, RETENTION_INTERVAL, RETENTION_BATCH_SIZE, RETENTION_BATCH_PAUSE, TASK_RETENTION_DAYS, TIMESLOT_RETENTION_DAYS
+from .db import engine
+
+# retention job, started with the app: rows past their policy's age are copied to archived_rows as JSON and
+# deleted, a small batch per transaction, walking the expiry column's index in (expiry, id) order.
+# one short transaction per batch keeps locks brief, the pause between batches leaves room for live traffic.
+# every batch moves the policy's row in retention_progress in the same transaction, so a restart carries on
+# where the last batch committed. the progress row is locked by the batch, which also keeps the workers of
+# a multi-worker deployment from working on the same policy at once.
+# rows locked by a running request are skipped and picked up by a later pass.
+
+LOCK_TIMEOUT = "5s"
+
+async def _purge_tasks(conn: AsyncConnection, ids: list[int]):
+    await conn.execute(text(
+        "INSERT INTO archived_rows (table_name, row_id, data) "
+        "SELECT 'tasks', t.id, to_jsonb(t) || jsonb_build_object('grade_ids', ARRAY(SELECT g.id FROM grades g WHERE g.task_id = t.id ORDER BY g.id)) "
+        "FROM tasks t WHERE t.id = ANY(:ids) ON CONFLICT DO NOTHING"
+    ), {"ids": ids})
+    # the grades stay, they only lose the link to the task (the archive keeps it)
+    unlinked_query = await conn.execute(text("UPDATE grades SET task_id = NULL, version = version + 1 WHERE task_id = ANY(:ids) RETURNING id"), {"ids": ids})
+    await conn.execute(text("DELETE FROM tasks WHERE id = ANY(:ids)"), {"ids": ids})
+    await changes.record(conn, "grade", unlinked_query.scalars().all())
+
+async def _purge_timeslots(conn: AsyncConnection, ids: list[int]):
+    # a class or exam only exists for its timeslot, it is archived inside the timeslot's row and goes with it
+    await conn.execute(text(
+        "INSERT INTO archived_rows (table_name, row_id, data) "
+        "SELECT 'timeslots', t.id, to_jsonb(t) || jsonb_build_object("
+        "'class', to_jsonb(c), 'exam', to_jsonb(e), 'exam_grade_ids', ARRAY(SELECT g.id FROM grades g WHERE g.exam_id = t.exam_id ORDER BY g.id)) "
+        "FROM timeslots t LEFT JOIN classes c ON c.id = t.class_id LEFT JOIN exams e ON e.id = t.exam_id "
+        "WHERE t.id = ANY(:ids) ON CONFLICT DO NOTHING"
+    ), {"ids": ids})
+    deleted_query = await conn.execute(
+        text('DELETE FROM timeslots WHERE id = ANY(:ids) RETURNING class_id, exam_id, auditorium_id, start, "end"'), {"ids": ids}
+    )
+    deleted = deleted_query.all()
+    class_ids = [class_id for class_id, _, _, _, _ in deleted if class_id is not None]
+    exam_ids = [exam_id for _, exam_id, _, _, _ in deleted if exam_id is not None]
+    booked = Counter()
+    for _, _, auditorium_id, start, end in deleted:
+        booked[auditorium_id] -= counters.minutes(start, end)
+    await counters.adjust(conn, models.Auditorium, booked_minutes=booked)
+    unlinked = []
+    if exam_ids:
+        unlinked_query = await conn.execute(text("UPDATE grades SET exam_id = NULL, version = version + 1 WHERE exam_id = ANY(:ids) RETURNING id"), {"ids": exam_ids})
+        unlinked = unlinked_query.scalars().all()
+        await conn.execute(text("DELETE FROM exams WHERE id = ANY(:ids)"), {"ids": exam_ids})
+    if class_ids:
+        await conn.execute(text("DELETE FROM classes WHERE id = ANY(:ids)"), {"ids": class_ids})
+    await changes.record(conn, "grade", unlinked)
+
+class Policy:
+    def __init__(self, name: str, table: str, column: str, days: int, purge):
+        self.name = name
+        self.table = table
+        self.column = column
+        self.days = days
+        self.purge = purge
+        self.archived = 0
+        self.batches = 0
+
+    async def run_batch(self, cutoff: datetime) -> int:
+        async with engine.begin() as conn:
+            # waiting behind a long transaction would hold this batch's locks just as long, give up and retry next pass
+            await conn.execute(text(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}'"))
+            await conn.execute(text("INSERT INTO retention_progress (policy) VALUES (:policy) ON CONFLICT DO NOTHING"), {"policy": self.name})
+            progress_query = await conn.execute(
+                text("SELECT after_time, after_id FROM retention_progress WHERE policy = :policy FOR UPDATE"), {"policy": self.name}
+            )
+            after_time, after_id = progress_query.one()
+
+            params = {"cutoff": cutoff, "limit": RETENTION_BATCH_SIZE}
+            keyset = ""
+            if after_time is not None:
+                keyset = f' AND "{self.column}" >= :after_time AND ("{self.column}", id) > (:after_time, :after_id)'
+                params.update(after_time=after_time, after_id=after_id)
+            expired_query = await conn.execute(text(
+                f'SELECT id, "{self.column}" FROM {self.table} WHERE "{self.column}" < :cutoff{keyset} '
+                f'ORDER BY "{self.column}", id LIMIT :limit FOR UPDATE SKIP LOCKED'
+            ), params)
+            expired = expired_query.all()
+            if expired:
+                await self.purge(conn, [id for id, _ in expired])
+
+            # a short batch ends the pass, the next one starts over from the oldest row
+            last_id, last_time = expired[-1] if len(expired) == RETENTION_BATCH_SIZE else (None, None)
+            await conn.execute(text(
+                "UPDATE retention_progress SET after_time = :after_time, after_id = :after_id, archived = archived + :archived, updated_at = now() "
+                "WHERE policy = :policy"
+            ), {"after_time": last_time, "after_id": last_id, "archived": len(expired), "policy": self.name})
+        self.archived += len(expired)
+        self.batches += 1
+        return len(expired)
+
+    async def run(self):
+        cutoff = as_naive(datetime.now(timezone.utc)) - timedelta(days=self.days)
+        while await self.run_batch(cutoff) == RETENTION_BATCH_SIZE:
+            await asyncio.sleep(RETENTION_BATCH_PAUSE)
+
+POLICIES = [
+    Policy("tasks", "tasks", "created_at", TASK_RETENTION_DAYS, _purge_tasks),
+    Policy("timeslots", "timeslots", "end", TIMESLOT_RETENTION_DAYS, _purge_timeslots),
+]
+
+async def run_forever():
+    if not RETENTION_ENABLED or engine.dialect.name != "postgresql":
+        return
+    while True:
+        for policy in POLICIES:
+            if not policy.days:
+                continue
+            try:
+                await policy.run()
+            except Exception as ex:
+                # the last committed batch is in retention_progress, the next pass resumes from there
+                print(f"Retention policy {policy.name} failed: {ex!r}")
+        try:
+            await changes.compact()
+        except Exception as ex:
+            print(f"Change feed compaction failed: {ex!r}")
+        await asyncio.sleep(RETENTION_INTERVAL)
+
+def render() -> list[str]:
+    lines = ["# HELP retention_archived_rows_total Rows archived and deleted by the retention job.", "# TYPE retention_archived_rows_total counter"]
+    lines += [f'retention_archived_rows_total{{policy="{policy.name}"}} {policy.archived}' for policy in POLICIES]
+    lines += ["# HELP retention_batches_total Retention batches committed.", "# TYPE retention_batches_total counter"]
+    lines += [f'retention_batches_total{{policy="{policy.name}"}} {policy.batches}' for policy in POLICIES]
+    return lines
+
+metrics.register_collector(render)
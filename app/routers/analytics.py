@@ -0,0 +1,50 @@
+from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi import APIRouter, Depends
+from .. import counters, schemas, crud
+from ..admission import admit
+from ..analytics import summarize
+from ..db import get_session, get_read_session
+from ..metrics import TimedRoute
+from ..serialization import TrustedJSONResponse, row_dicts
+
+router = APIRouter(
+    prefix="/analytics",
+    tags=["Analytics"],
+    responses={404: {"description": "Not found"}, 503: {"description": "Overloaded, retry after Retry-After seconds"}},
+    dependencies=[admit("analytics")],
+    route_class=TimedRoute,
+)
+
+@router.get("/grades/{scope}")
+async def get_grade_stats(scope: schemas.GradeScope, session: AsyncSession = Depends(get_read_session)) -> list[schemas.GradeStats]:
+    """Grade statistics of every course, semester, group or department that has grades"""
+    histograms = await crud.get_grade_histograms(session, scope.value)
+    return [schemas.GradeStats(scope=scope, scope_id=scope_id, **summarize(histogram)) for scope_id, histogram in histograms.items()]
+
+@router.get("/grades/{scope}/{scope_id}")
+async def get_grade_stats_for(scope: schemas.GradeScope, scope_id: int, session: AsyncSession = Depends(get_read_session)) -> schemas.GradeStats:
+    histograms = await crud.get_grade_histograms(session, scope.value, scope_id)
+    return schemas.GradeStats(scope=scope, scope_id=scope_id, **summarize(histograms.get(scope_id, {})))
+
+@router.post("/grades/rebuild")
+async def rebuild_grade_stats(session: AsyncSession = Depends(get_session)):
+    """Recounts the grade histograms from the grades table, needed once for databases that had grades before analytics existed"""
+    await crud.rebuild_grade_histograms(session)
+    return True
+
+@router.get("/groups")
+async def get_group_counts(department_id: int | None = None, session: AsyncSession = Depends(get_read_session)) -> list[schemas.GroupOut]:
+    """Groups with their student counts"""
+    groups = await crud.get_group_counts(session, department_id)
+    return TrustedJSONResponse(row_dicts(groups))
+
+@router.get("/auditoriums")
+async def get_auditorium_bookings(building_id: int | None = None, session: AsyncSession = Depends(get_read_session)) -> list[schemas.AuditoriumBooking]:
+    """Auditoriums with the minutes booked in them"""
+    auditoriums = await crud.get_auditorium_bookings(session, building_id)
+    return TrustedJSONResponse(row_dicts(auditoriums))
+
+@router.post("/counters/reconcile")
+async def reconcile_counters() -> schemas.CounterRepairs:
+    """Recounts the course, group and auditorium counters from the base tables and repairs the ones that drifted"""
+    return schemas.CounterRepairs(repaired=await counters.reconcile())
@@ -0,0 +1,42 @@
+from datetime import datetime
+from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi import APIRouter, Depends, HTTPException, Query
+from .. import schemas, crud
+from ..admission import admit
+from ..availability import availability_index
+from ..db import get_session
+from ..metrics import TimedRoute
+from ..serialization import TrustedJSONResponse
+
+router = APIRouter(
+    prefix="/auditoriums",
+    tags=["Auditoriums"],
+    responses={404: {"description": "Not found"}, 503: {"description": "Overloaded, retry after Retry-After seconds"}},
+    dependencies=[admit("auditoriums")],
+    route_class=TimedRoute,
+)
+
+@router.get("/available")
+async def get_available_auditoriums(
+    start: datetime,
+    end: datetime,
+    has_projector: bool | None = None,
+    has_board: bool | None = None,
+    min_capacity: int | None = Query(None, ge=0),
+) -> list[schemas.AuditoriumOut]:
+    """Auditoriums with no timeslot overlapping [start, end), served from the in-memory availability index"""
+    if end <= start:
+        # an empty window overlaps nothing, every auditorium would come back as available
+        raise HTTPException(status_code=422, detail={"statement": "The window must end after it starts.", "params": {"start": start.isoformat(), "end": end.isoformat()}})
+    auditoriums = availability_index.available(start, end, has_projector, has_board, min_capacity)
+    return TrustedJSONResponse(auditoriums)
+
+@router.post("/{auditorium_id}/timeslots")
+async def add_timeslot(auditorium_id: int, timeslot: schemas.TimeslotCreate, session: AsyncSession = Depends(get_session)) -> schemas.TimeslotOut:
+    timeslot = await crud.add_timeslot(session, auditorium_id, timeslot)
+    return schemas.TimeslotOut.from_orm(timeslot)
+
+@router.delete("/{auditorium_id}/timeslots/{timeslot_id}")
+async def delete_timeslot(auditorium_id: int, timeslot_id: int, session: AsyncSession = Depends(get_session)) -> schemas.TimeslotOut:
+    timeslot = await crud.delete_timeslot(session, auditorium_id, timeslot_id)
+    return schemas.TimeslotOut.from_orm(timeslot)
\ No newline at end of file
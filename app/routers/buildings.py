@@ -0,0 +1,26 @@
+from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi import APIRouter, Depends
+from .. import schemas, crud
+from ..admission import admit
+from ..db import get_read_session
+from ..metrics import TimedRoute
+from ..pagination import PageParams, paginate, ndjson_response
+from ..serialization import TrustedJSONResponse, row_dicts
+
+router = APIRouter(
+    prefix="/buildings",
+    tags=["Buildings"],
+    responses={404: {"description": "Not found"}, 503: {"description": "Overloaded, retry after Retry-After seconds"}},
+    dependencies=[admit("buildings")],
+    route_class=TimedRoute,
+)
+
+@router.get("/{building_id}/professors", response_model=schemas.ProfessorPage)
+async def get_building_professors(building_id: int, page: PageParams = Depends(), session: AsyncSession = Depends(get_read_session)):
+    """Professors working in the building, i.e. in the department that owns it"""
+    if page.format == "ndjson":
+        rows = await crud.stream_building_professors(session, building_id, page.after)
+        return ndjson_response(rows)
+    professors = await crud.get_building_professors(session, building_id, page.limit, page.after)
+    professors, next_cursor = paginate(professors, page.limit)
+    return TrustedJSONResponse({"items": row_dicts(professors), "next_cursor": next_cursor})
@@ -0,0 +1,38 @@
+from fastapi import APIRouter, Header, Query, Request
+from fastapi.responses import StreamingResponse
+from .. import schemas
+from ..admission import admit
+from ..changes import change_feed
+from ..config import CHANGES_MAX_WAIT, PAGE_SIZE_DEFAULT, PAGE_SIZE_MAX
+from ..metrics import TimedRoute
+from ..serialization import TrustedJSONResponse
+
+router = APIRouter(
+    prefix="/changes",
+    tags=["Changes"],
+    responses={
+        410: {"description": "Changes after `since` have been compacted, resync"},
+        503: {"description": "Overloaded, retry after Retry-After seconds"},
+    },
+    dependencies=[admit("changes")],
+    route_class=TimedRoute,
+)
+
+@router.get("/", response_model=schemas.ChangePage)
+async def get_changes(
+    request: Request,
+    since: int = Query(0, ge=0, description="Last seq already seen, 0 for the whole feed"),
+    limit: int = Query(PAGE_SIZE_DEFAULT, ge=1, le=PAGE_SIZE_MAX),
+    entity: list[schemas.ChangeEntity] | None = Query(None),
+    wait: float = Query(0, ge=0, le=CHANGES_MAX_WAIT, description="Seconds to wait for changes when there are none yet"),
+    last_event_id: int | None = Header(None),
+):
+    """Student, course and grade writes in commit order. Long-polls with `wait`, streams server-sent events for `Accept: text/event-stream`"""
+    # a reconnecting event source resumes from its Last-Event-ID
+    since = last_event_id if last_event_id is not None else since
+    entities = [value.value for value in entity] if entity else None
+    await change_feed.check_since(since)
+    if "text/event-stream" in request.headers.get("accept", ""):
+        return StreamingResponse(change_feed.stream(request, since, entities), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+    changes = await change_feed.poll(since, limit, entities, wait)
+    return TrustedJSONResponse({"items": changes, "next_since": changes[-1]["seq"] if changes else since})
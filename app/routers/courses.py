@@ -1,13 +1,20 @@
-from pydantic import parse_obj_as
 from sqlalchemy.ext.asyncio import AsyncSession
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Request, Response
 from .. import schemas, crud
-from ..db import get_session
+from ..admission import admit
+from ..batching import id_list
+from ..conditional import etag, not_modified, revalidating
+from ..db import get_session, get_read_session
+from ..metrics import TimedRoute, parse_obj_as
+from ..pagination import PageParams, paginate, ndjson_response
+from ..serialization import TrustedJSONResponse, batch_content, row_dicts
 
 router = APIRouter(
     prefix="/courses",
     tags=["Courses"],
-    responses={404: {"description": "Not found"}},
+    responses={404: {"description": "Not found"}, 503: {"description": "Overloaded, retry after Retry-After seconds"}},
+    dependencies=[admit("courses")],
+    route_class=TimedRoute,
 )
 
 @router.post("/")
@@ -15,12 +22,43 @@ async def add_course(course: schemas.CourseCreate, session: AsyncSession = Depen
     course = await crud.add_course(session, course)
     return schemas.CourseOut.from_orm(course)
 
-@router.get("/{course_id}")
-async def get_course(course_id: int, session: AsyncSession = Depends(get_session)) -> schemas.CourseOut:
-    course = await crud.get_course(session, course_id)
-    return schemas.CourseOut.from_orm(course)
+@router.get("/", response_model=schemas.CourseBatch)
+async def get_courses(ids: list[int] = Depends(id_list)):
+    """Several courses by id in one query, in the order asked for; ids that don't exist are listed as missing"""
+    courses = await crud.get_courses(ids)
+    return TrustedJSONResponse(batch_content(schemas.CourseOut, ids, courses))
+
+@router.get("/{course_id}", responses={304: {"description": "Not modified since the version in If-None-Match"}})
+async def get_course(course_id: int, request: Request, response: Response) -> schemas.CourseOut:
+    course = await crud.get_course(course_id, fresh=revalidating(request))
+    if (cached := not_modified(request, course["version"])) is not None:
+        return cached
+    response.headers["ETag"] = etag(course["version"])
+    return schemas.CourseOut(**course)
+
+@router.get("/{course_id}/students", response_model=schemas.StudentPage)
+async def get_course_students(course_id: int, page: PageParams = Depends(), session: AsyncSession = Depends(get_read_session)):
+    if page.format == "ndjson":
+        rows = await crud.stream_course_students(session, course_id, page.after)
+        return ndjson_response(rows)
+    students = await crud.get_course_students(session, course_id, page.limit, page.after)
+    students, next_cursor = paginate(students, page.limit)
+    return TrustedJSONResponse({"items": row_dicts(students), "next_cursor": next_cursor})
+
+@router.post("/{course_id}/enroll")
+async def enroll_students(course_id: int, selection: schemas.EnrollmentSelection, session: AsyncSession = Depends(get_session)) -> schemas.EnrollmentOut:
+    """Enrolls every student of the given groups, department and ids in one statement; enrolling someone twice is a no-op"""
+    result = await crud.enroll_students(session, course_id, selection)
+    return schemas.EnrollmentOut(**result)
+
+@router.post("/{course_id}/unenroll")
+async def unenroll_students(course_id: int, selection: schemas.EnrollmentSelection, session: AsyncSession = Depends(get_session)) -> schemas.UnenrollmentOut:
+    """Removes every selected student from the course in one statement, their grades are kept"""
+    result = await crud.unenroll_students(session, course_id, selection)
+    return schemas.UnenrollmentOut(**result)
 
-@router.get("/{course_id}/students")
-async def get_course_students(course_id: int, session: AsyncSession = Depends(get_session)) -> list[schemas.StudentOut]:
-    students = await crud.get_course_students(session, course_id)
-    return parse_obj_as(list[schemas.StudentOut], students)
\ No newline at end of file
+@router.put("/{course_id}/grades")
+async def set_course_gradebook(course_id: int, gradebook: list[schemas.GradebookEntry], session: AsyncSession = Depends(get_session)) -> schemas.GradebookOut:
+    """Places or overwrites the grades of every listed student in one transaction, students not enrolled in the course are reported as errors"""
+    grades, errors = await crud.set_course_gradebook(session, course_id, gradebook)
+    return schemas.GradebookOut(grades=parse_obj_as(list[schemas.CourseGradeOut], grades), errors=errors)
\ No newline at end of file
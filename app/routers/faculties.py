@@ -0,0 +1,26 @@
+from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi import APIRouter, Depends
+from .. import schemas, crud
+from ..admission import admit
+from ..db import get_read_session
+from ..metrics import TimedRoute
+from ..pagination import PageParams, paginate, ndjson_response
+from ..serialization import TrustedJSONResponse, row_dicts
+
+router = APIRouter(
+    prefix="/faculties",
+    tags=["Faculties"],
+    responses={404: {"description": "Not found"}, 503: {"description": "Overloaded, retry after Retry-After seconds"}},
+    dependencies=[admit("faculties")],
+    route_class=TimedRoute,
+)
+
+@router.get("/{faculty_id}/students", response_model=schemas.StudentPage)
+async def get_faculty_students(faculty_id: int, page: PageParams = Depends(), session: AsyncSession = Depends(get_read_session)):
+    """Students of every group of every department of the faculty"""
+    if page.format == "ndjson":
+        rows = await crud.stream_faculty_students(session, faculty_id, page.after)
+        return ndjson_response(rows)
+    students = await crud.get_faculty_students(session, faculty_id, page.limit, page.after)
+    students, next_cursor = paginate(students, page.limit)
+    return TrustedJSONResponse({"items": row_dicts(students), "next_cursor": next_cursor})
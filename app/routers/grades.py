@@ -1,20 +1,30 @@
 from sqlalchemy.ext.asyncio import AsyncSession
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Request, Response
 from .. import schemas, crud
+from ..admission import admit
+from ..conditional import etag, expected_versions
 from ..db import get_session
+from ..group_commit import grade_writes
+from ..metrics import TimedRoute
 
 router = APIRouter(
     prefix="/grades",
     tags=["Grades"],
-    responses={404: {"description": "Not found"}},
+    responses={404: {"description": "Not found"}, 503: {"description": "Overloaded, retry after Retry-After seconds"}},
+    dependencies=[admit("grades")],
+    route_class=TimedRoute,
 )
 
 @router.post("/")
 async def add_grade(grade: schemas.CourseGradeCreate, session: AsyncSession = Depends(get_session)) -> schemas.CourseGradeOut:
-    grade = await crud.add_course_grade(session, grade)
+    if grade_writes.running:
+        grade = await grade_writes.submit(grade)
+    else:
+        grade = await crud.add_course_grade(session, grade)
     return schemas.CourseGradeOut.from_orm(grade)
 
-@router.put("/{grade_id}")
-async def update_grade(grade_id: int, grade: schemas.CourseGradeUpdate, session: AsyncSession = Depends(get_session)) -> schemas.CourseGradeOut:
-    grade = await crud.update_course_grade(session, grade_id, grade)
+@router.put("/{grade_id}", responses={412: {"description": "Modified since the version in If-Match"}})
+async def update_grade(grade_id: int, grade: schemas.CourseGradeUpdate, request: Request, response: Response, session: AsyncSession = Depends(get_session)) -> schemas.CourseGradeOut:
+    grade = await crud.update_course_grade(session, grade_id, grade, expected_versions(request))
+    response.headers["ETag"] = etag(grade.version)
     return schemas.CourseGradeOut.from_orm(grade)
\ No newline at end of file
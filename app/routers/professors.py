@@ -1,16 +1,31 @@
 from sqlalchemy.ext.asyncio import AsyncSession
-from pydantic import parse_obj_as
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query
 from .. import schemas, crud
-from ..db import get_session
+from ..admission import admit
+from ..db import get_read_session
+from ..metrics import TimedRoute
+from ..pagination import PageParams, paginate, ndjson_response
+from ..serialization import TrustedJSONResponse, row_dicts
 
 router = APIRouter(
     prefix="/professors",
     tags=["Professors"],
-    responses={404: {"description": "Not found"}},
+    responses={404: {"description": "Not found"}, 503: {"description": "Overloaded, retry after Retry-After seconds"}},
+    dependencies=[admit("professors")],
+    route_class=TimedRoute,
 )
 
-@router.get("/")
-async def get_professors(session: AsyncSession = Depends(get_session)) -> list[schemas.ProfessorOut]:
-    professors = await crud.get_professors(session)
-    return parse_obj_as(list[schemas.ProfessorOut], professors)
\ No newline at end of file
+@router.get("/", response_model=schemas.ProfessorPage)
+async def get_professors(page: PageParams = Depends(), session: AsyncSession = Depends(get_read_session)):
+    if page.format == "ndjson":
+        rows = await crud.stream_professors(session, page.after)
+        return ndjson_response(rows)
+    professors = await crud.get_professors(session, page.limit, page.after)
+    professors, next_cursor = paginate(professors, page.limit)
+    return TrustedJSONResponse({"items": row_dicts(professors), "next_cursor": next_cursor})
+
+@router.get("/search")
+async def search_professors(q: str = Query(..., min_length=1, max_length=100), limit: int = Query(20, ge=1, le=100), session: AsyncSession = Depends(get_read_session)) -> list[schemas.ProfessorOut]:
+    """Typo-tolerant name search, prefix matches first and the rest by trigram similarity"""
+    professors = await crud.search_professors(session, q, limit)
+    return TrustedJSONResponse(row_dicts(professors))
\ No newline at end of file
@@ -0,0 +1,43 @@
+from typing import Literal
+from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi import APIRouter, Depends, Query, Request
+from fastapi.responses import StreamingResponse
+from .. import schemas, crud, export
+from ..admission import admit
+from ..db import get_session, get_read_session
+from ..metrics import TimedRoute
+
+router = APIRouter(
+    prefix="/semesters",
+    tags=["Semesters"],
+    responses={404: {"description": "Not found"}, 503: {"description": "Overloaded, retry after Retry-After seconds"}},
+    dependencies=[admit("semesters")],
+    route_class=TimedRoute,
+)
+
+@router.post("/{semester_id}/schedule")
+async def schedule_semester(semester_id: int, schedule: schemas.ScheduleRequest, session: AsyncSession = Depends(get_session)) -> schemas.ScheduleOut:
+    """Builds a conflict-free weekly timetable for the semester's courses and books it into auditoriums in one transaction"""
+    result = await crud.schedule_semester(session, semester_id, schedule)
+    return schemas.ScheduleOut(**result)
+
+@router.get("/{semester_id}/grades/export", response_class=StreamingResponse)
+async def export_semester_grades(
+    semester_id: int,
+    request: Request,
+    format: Literal["csv", "ndjson", "parquet"] = Query("csv"),
+    session: AsyncSession = Depends(get_read_session),
+):
+    """Every grade of the semester with its student, group and course, streamed in chunks from a server-side cursor.
+    CSV and NDJSON are gzipped for clients sending Accept-Encoding: gzip"""
+    export.check_format(format)
+    result = await crud.stream_semester_grades(session, semester_id)
+    gzip = format != "parquet" and export.gzip_accepted(request.headers.get("accept-encoding"))
+    headers = {"Content-Disposition": f'attachment; filename="semester-{semester_id}-grades.{format}"', "Vary": "Accept-Encoding"}
+    if gzip:
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(
+        export.encode(format, crud.SEMESTER_GRADE_EXPORT_COLUMNS, result, gzip),
+        media_type=export.MEDIA_TYPES[format],
+        headers=headers,
+    )
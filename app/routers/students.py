@@ -1,12 +1,21 @@
+import time
 from sqlalchemy.ext.asyncio import AsyncSession
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query, Request, Response
 from .. import schemas, crud
-from ..db import get_session
+from ..admission import admit
+from ..batching import id_list
+from ..bulk import read_rows, validate_rows
+from ..conditional import etag, expected_versions, not_modified, revalidating
+from ..db import get_session, get_read_session
+from ..metrics import TimedRoute
+from ..serialization import TrustedJSONResponse, batch_content, row_dicts
 
 router = APIRouter(
     prefix="/students",
     tags=["Students"],
-    responses={404: {"description": "Not found"}},
+    responses={404: {"description": "Not found"}, 503: {"description": "Overloaded, retry after Retry-After seconds"}},
+    dependencies=[admit("students")],
+    route_class=TimedRoute,
 )
 
 @router.post("/")
@@ -14,14 +23,52 @@ async def add_student(student: schemas.StudentCreate, session: AsyncSession = De
     student = await crud.add_student(session, student)
     return schemas.StudentOut.from_orm(student)
 
-@router.get("/{student_id}")
-async def get_student(student_id: int, session: AsyncSession = Depends(get_session)) -> schemas.StudentOut:
-    student = await crud.get_student(session, student_id)
-    return schemas.StudentOut.from_orm(student)
+@router.post("/bulk")
+async def bulk_add_students(request: Request, session: AsyncSession = Depends(get_session)) -> schemas.StudentBulkResult:
+    """Accepts a JSON array, NDJSON or CSV of students, either as the body or as a multipart "file" upload"""
+    started = time.perf_counter()
+    rows = await read_rows(request)
+    valid, errors = validate_rows(rows, schemas.StudentCreate)
+    ids, group_errors = await crud.bulk_add_students(session, valid)
+    elapsed = time.perf_counter() - started
+    return schemas.StudentBulkResult(
+        inserted=len(ids),
+        ids=ids,
+        errors=sorted(errors + group_errors, key=lambda error: error["row"]),
+        elapsed_seconds=elapsed,
+        rows_per_second=len(ids) / elapsed if elapsed else 0.0,
+    )
+
+@router.get("/", response_model=schemas.StudentBatch)
+async def get_students(ids: list[int] = Depends(id_list)):
+    """Several students by id in one query, in the order asked for; ids that don't exist are listed as missing"""
+    students = await crud.get_students(ids)
+    return TrustedJSONResponse(batch_content(schemas.StudentOut, ids, students))
+
+@router.get("/search")
+async def search_students(q: str = Query(..., min_length=1, max_length=100), limit: int = Query(20, ge=1, le=100), session: AsyncSession = Depends(get_read_session)) -> list[schemas.StudentOut]:
+    """Typo-tolerant name search, prefix matches first and the rest by trigram similarity"""
+    students = await crud.search_students(session, q, limit)
+    return TrustedJSONResponse(row_dicts(students))
+
+@router.get("/{student_id}", responses={304: {"description": "Not modified since the version in If-None-Match"}})
+async def get_student(student_id: int, request: Request, response: Response) -> schemas.StudentOut:
+    student = await crud.get_student(student_id, fresh=revalidating(request))
+    if (cached := not_modified(request, student["version"])) is not None:
+        return cached
+    response.headers["ETag"] = etag(student["version"])
+    return schemas.StudentOut(**student)
+
+@router.get("/{student_id}/transcript")
+async def get_student_transcript(student_id: int, session: AsyncSession = Depends(get_read_session)) -> schemas.TranscriptOut:
+    """The student with their group, department and every enrolled course with its semester and grade, read in a single query"""
+    transcript = await crud.get_student_transcript(session, student_id)
+    return schemas.TranscriptOut(**transcript)
 
-@router.put("/{student_id}")
-async def update_student(student_id: int, student: schemas.StudentUpdate, session: AsyncSession = Depends(get_session)) -> schemas.StudentOut:
-    student = await crud.update_student(session, student_id, student)
+@router.put("/{student_id}", responses={412: {"description": "Modified since the version in If-Match"}})
+async def update_student(student_id: int, student: schemas.StudentUpdate, request: Request, response: Response, session: AsyncSession = Depends(get_session)) -> schemas.StudentOut:
+    student = await crud.update_student(session, student_id, student, expected_versions(request))
+    response.headers["ETag"] = etag(student.version)
     return schemas.StudentOut.from_orm(student)
 
 @router.delete("/{student_id}")
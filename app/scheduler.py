@@ -0,0 +1,176 @@
+import random
+import time
+from bisect import bisect_left, insort
+from typing import NamedTuple
+
+# timetable solver for one semester, kept free of any database access so it can be benchmarked on its own.
+# the week is cut into periods (days * slots_per_day), every course needs `sessions` periods,
+# and in each period a student, a professor and an auditorium can only be used once.
+# conflicts are checked against per-period indexes (who holds which student/professor/room), not a pairwise
+# course conflict graph, so a placement check costs O(course size) regardless of how many courses there are.
+# students and professors busy with bookings outside this timetable (e.g. an overlapping semester) are held in the
+# per-period indexes by None, nothing can eject them.
+# greedy placement (hardest courses first, best-fit room) is followed by a local search that ejects a single
+# blocking session into another period to make room for a course the greedy pass could not place.
+
+class CourseDemand(NamedTuple):
+    id: int
+    students: frozenset
+    professors: frozenset
+
+    @property
+    def size(self) -> int:
+        return len(self.students)
+
+class Room(NamedTuple):
+    id: int
+    capacity: int
+
+class Placement(NamedTuple):
+    course_id: int
+    period: int
+    room_id: int
+
+class Timetable:
+    def __init__(self, rooms: list[Room], periods: int, blocked: set[tuple[int, int]] = frozenset(),
+                 busy_students: dict[int, set[int]] | None = None, busy_professors: dict[int, set[int]] | None = None):
+        busy_students = busy_students or {}
+        busy_professors = busy_professors or {}
+        self.periods = periods
+        # (capacity, room id) still free in each period, kept sorted for best-fit lookups
+        self.free_rooms = [sorted((room.capacity, room.id) for room in rooms if (room.id, period) not in blocked) for period in range(periods)]
+        self.capacity = {room.id: room.capacity for room in rooms}
+        self.rooms_by_capacity = sorted((room.capacity, room.id) for room in rooms)
+        self.student_owner = [dict.fromkeys(busy_students.get(period, ())) for period in range(periods)]
+        self.professor_owner = [dict.fromkeys(busy_professors.get(period, ())) for period in range(periods)]
+        self.room_owner = [{} for _ in range(periods)]
+        self.sessions: dict[int, dict[int, int]] = {}  # course id -> {period: room id}
+
+    def _best_room(self, period: int, size: int) -> int | None:
+        rooms = self.free_rooms[period]
+        index = bisect_left(rooms, (size, -1))
+        return rooms[index][1] if index < len(rooms) else None
+
+    def fits(self, course: CourseDemand, period: int) -> bool:
+        return (
+            period not in self.sessions.get(course.id, ())
+            and self.professor_owner[period].keys().isdisjoint(course.professors)
+            and self.student_owner[period].keys().isdisjoint(course.students)
+            and self._best_room(period, course.size) is not None
+        )
+
+    def place(self, course: CourseDemand, period: int, room_id: int | None = None):
+        if room_id is None:
+            room_id = self._best_room(period, course.size)
+        self.free_rooms[period].remove((self.capacity[room_id], room_id))
+        self.room_owner[period][room_id] = course.id
+        for student in course.students:
+            self.student_owner[period][student] = course.id
+        for professor in course.professors:
+            self.professor_owner[period][professor] = course.id
+        self.sessions.setdefault(course.id, {})[period] = room_id
+
+    def unplace(self, course: CourseDemand, period: int) -> int:
+        room_id = self.sessions[course.id].pop(period)
+        insort(self.free_rooms[period], (self.capacity[room_id], room_id))
+        del self.room_owner[period][room_id]
+        for student in course.students:
+            del self.student_owner[period][student]
+        for professor in course.professors:
+            del self.professor_owner[period][professor]
+        return room_id
+
+    def blockers(self, course: CourseDemand, period: int) -> set[int]:
+        owners = {self.student_owner[period][s] for s in course.students if s in self.student_owner[period]}
+        owners.update(self.professor_owner[period][p] for p in course.professors if p in self.professor_owner[period])
+        if self._best_room(period, course.size) is None:
+            # no free room is large enough, the course in the smallest sufficient room is what is in the way
+            index = bisect_left(self.rooms_by_capacity, (course.size, -1))
+            if index < len(self.rooms_by_capacity):
+                owners.add(self.room_owner[period].get(self.rooms_by_capacity[index][1]))
+        owners.discard(None)
+        return owners
+
+class Solution(NamedTuple):
+    placements: list[Placement]
+    unscheduled: list[int]
+    solve_seconds: float
+
+def _candidate_periods(timetable: Timetable, course: CourseDemand, slots_per_day: int) -> list[int]:
+    # spread a course's sessions over different days first, then prefer the emptiest periods
+    used_days = {period // slots_per_day for period in timetable.sessions.get(course.id, ())}
+    return sorted(
+        range(timetable.periods),
+        key=lambda period: (period // slots_per_day in used_days, len(timetable.room_owner[period]), period),
+    )
+
+def _try_place(timetable: Timetable, course: CourseDemand, slots_per_day: int, exclude: int | None = None) -> bool:
+    for period in _candidate_periods(timetable, course, slots_per_day):
+        if period != exclude and timetable.fits(course, period):
+            timetable.place(course, period)
+            return True
+    return False
+
+def _eject_and_place(timetable: Timetable, courses: dict[int, CourseDemand], course: CourseDemand, slots_per_day: int) -> bool:
+    for period in _candidate_periods(timetable, course, slots_per_day):
+        if period in timetable.sessions.get(course.id, ()):
+            continue
+        blockers = timetable.blockers(course, period)
+        if len(blockers) != 1:
+            continue
+        blocker = courses[blockers.pop()]
+        room_id = timetable.unplace(blocker, period)
+        if timetable.fits(course, period):
+            timetable.place(course, period)
+            if _try_place(timetable, blocker, slots_per_day, exclude=period):
+                return True
+            timetable.unplace(course, period)
+        timetable.place(blocker, period, room_id)
+    return False
+
+def solve(courses: list[CourseDemand], rooms: list[Room], days: int, slots_per_day: int, sessions: int = 1,
+          blocked: set[tuple[int, int]] = frozenset(), time_budget: float = 5.0, seed: int = 0,
+          busy_students: dict[int, set[int]] | None = None, busy_professors: dict[int, set[int]] | None = None) -> Solution:
+    # blocked holds (room id, period) pairs, busy_* map a period to the people already taken in it
+    started = time.perf_counter()
+    timetable = Timetable(rooms, days * slots_per_day, blocked, busy_students, busy_professors)
+    by_id = {course.id: course for course in courses}
+
+    # courses sharing many professors are the hardest to place, big courses need the scarce big rooms
+    professor_load: dict[int, int] = {}
+    for course in courses:
+        for professor in course.professors:
+            professor_load[professor] = professor_load.get(professor, 0) + 1
+    order = sorted(courses, key=lambda course: (-course.size, -sum(professor_load[p] for p in course.professors), course.id))
+
+    pending = []
+    for course in order:
+        for _ in range(sessions):
+            if not _try_place(timetable, course, slots_per_day):
+                pending.append(course)
+
+    rng = random.Random(seed)
+    deadline = started + time_budget
+    while pending and time.perf_counter() < deadline:
+        progress = False
+        rng.shuffle(pending)
+        still_pending = []
+        for course in pending:
+            if time.perf_counter() < deadline and (
+                _try_place(timetable, course, slots_per_day) or _eject_and_place(timetable, by_id, course, slots_per_day)
+            ):
+                progress = True
+            else:
+                still_pending.append(course)
+        pending = still_pending
+        if not progress:
+            break
+
+    # a course is either scheduled with all of its sessions or not at all, half a course is useless to a timetable
+    unscheduled = sorted({course.id for course in pending})
+    placements = [
+        Placement(course_id, period, room_id)
+        for course_id, periods in timetable.sessions.items() if course_id not in unscheduled
+        for period, room_id in periods.items()
+    ]
+    return Solution(placements, unscheduled, time.perf_counter() - started)
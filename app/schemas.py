@@ -1,6 +1,7 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, root_validator, validator
+from enum import Enum
 from typing import Optional
-from datetime import datetime
+from datetime import datetime, time
 
 class BasePerson(BaseModel):
     phone: str | None = Field(None, example="+12345678901")
@@ -16,6 +17,26 @@ class StudentOut(StudentCreate):
     class Config:
         orm_mode = True
 
+class StudentPage(BaseModel):
+    items: list[StudentOut]
+    next_cursor: str | None = None
+
+class StudentBatch(BaseModel):
+    items: list[StudentOut]
+    missing: list[int]
+
+class BulkRowError(BaseModel):
+    row: int
+    errors: list[dict] | str
+    params: int | None = None
+
+class StudentBulkResult(BaseModel):
+    inserted: int
+    ids: list[int]
+    errors: list[BulkRowError]
+    elapsed_seconds: float
+    rows_per_second: float
+
 class StudentUpdate(BasePerson):
     group_id: int | None = Field(None, example=1)
     name: str | None = Field(None, example="Ivan")
@@ -30,6 +51,10 @@ class ProfessorOut(ProfessorCreate):
     class Config:
         orm_mode = True
 
+class ProfessorPage(BaseModel):
+    items: list[ProfessorOut]
+    next_cursor: str | None = None
+
 class BaseCourse(BaseModel):
     desc: str = Field(None, example="Applied mathematics for first years")
     semester_id: int | None = Field(None, example=1)
@@ -39,10 +64,17 @@ class CourseCreate(BaseCourse):
 
 class CourseOut(CourseCreate):
     id: int
+    # kept up to date by the writes, students without a grade yet are student_count - graded_count
+    student_count: int = Field(0, example=30)
+    graded_count: int = Field(0, example=12)
 
     class Config:
         orm_mode = True
 
+class CourseBatch(BaseModel):
+    items: list[CourseOut]
+    missing: list[int]
+
 class CourseUpdate(BaseCourse):
     semester_id: int | None = Field(None, example=2)
     name: str | None = Field(None, example="Mathematics 2")
@@ -63,25 +95,171 @@ class CourseGradeOut(CourseGradeCreate):
 class CourseGradeUpdate(BaseModel):
     grade: int = Field(..., example=2)
 
-# non-developed classes
+class GradebookEntry(BaseModel):
+    student_id: int = Field(..., example=1)
+    grade: int = Field(..., example=5)
 
-# class Group(BaseModel):
-#     id: int
-#     department_id: int
-#     enrolled_at: datetime
+class GradebookOut(BaseModel):
+    grades: list[CourseGradeOut]
+    errors: list[BulkRowError]
+
+class EnrollmentSelection(BaseModel):
+    # every student matched by any of these, together
+    group_ids: list[int] = Field([], example=[1, 2])
+    student_ids: list[int] = Field([], example=[])
+    department_id: int | None = Field(None, example=None)
+
+    @root_validator(skip_on_failure=True)
+    def something_selected(cls, values):
+        if not values["group_ids"] and not values["student_ids"] and values["department_id"] is None:
+            raise ValueError("select students by group_ids, student_ids or department_id")
+        return values
+
+class EnrollmentOut(BaseModel):
+    inserted: int
+    skipped: int = Field(..., description="Selected students that were already enrolled")
+    unknown_student_ids: list[int]
+    enrolled: int = Field(..., description="Students enrolled in the course afterwards")
+    capacity: int | None = Field(None, description="Smallest max_capacity among the auditoriums the course is scheduled in")
+
+class UnenrollmentOut(BaseModel):
+    deleted: int
+    skipped: int = Field(..., description="Selected students that were not enrolled")
+    unknown_student_ids: list[int]
+    enrolled: int
+
+class TimeslotCreate(BaseModel):
+    course_id: int | None = Field(None, example=1)
+    class_id: int | None = Field(None, example=None)
+    exam_id: int | None = Field(None, example=None)
+    start: datetime = Field(..., example="2023-09-01T09:00:00")
+    end: datetime = Field(..., example="2023-09-01T10:30:00")
+
+    @validator("end")
+    def end_after_start(cls, end, values):
+        if "start" in values and end <= values["start"]:
+            raise ValueError("end must be after start")
+        return end
+
+class TimeslotOut(TimeslotCreate):
+    id: int
+    auditorium_id: int
 
-#     class Config:
-#         orm_mode = True
+    class Config:
+        orm_mode = True
 
-# class Department(BaseModel):
-#     id: int
-#     faculty_id: int
-#     name: str
-#     desc: Optional[str]
-#     url: Optional[str]
+class AuditoriumOut(BaseModel):
+    id: int
+    building_id: int
+    room_number: int
+    floor: int | None
+    max_capacity: int | None
+    has_projector: bool
+    has_board: bool
 
-#     class Config:
-#         orm_mode = True
+    class Config:
+        orm_mode = True
+
+class ScheduleRequest(BaseModel):
+    week_start: datetime | None = Field(None, example="2023-09-04T00:00:00", description="First day of the timetable, defaults to the semester start")
+    weeks: int | None = Field(None, ge=1, example=16, description="Weeks to repeat the timetable for, defaults to the whole semester")
+    days: int = Field(5, ge=1, le=7, example=5)
+    slots_per_day: int = Field(6, ge=1, le=24, example=6)
+    day_start: time = Field(time(9, 0), example="09:00")
+    slot_minutes: int = Field(90, ge=1, example=90)
+    break_minutes: int = Field(10, ge=0, example=10)
+    sessions_per_week: int = Field(1, ge=1, example=2)
+    require_projector: bool = False
+    require_board: bool = False
+    replace: bool = Field(True, description="Drop the semester's previously scheduled course timeslots first")
+    time_budget: float = Field(5.0, gt=0, le=60, description="Seconds of local search after the greedy pass")
+
+class ScheduleOut(BaseModel):
+    scheduled_courses: int
+    unscheduled_course_ids: list[int]
+    timeslots: int
+    weeks: int
+    solve_seconds: float
+
+class GradeScope(str, Enum):
+    course = "course"
+    semester = "semester"
+    group = "group"
+    department = "department"
+
+class GradeStats(BaseModel):
+    scope: GradeScope
+    scope_id: int
+    count: int
+    mean: float | None
+    pass_rate: float | None
+    histogram: dict[int, int]
+    percentiles: dict[str, int]
+
+class GroupOut(BaseModel):
+    id: int
+    department_id: int
+    enrolled_at: datetime
+    student_count: int = 0
+
+    class Config:
+        orm_mode = True
+
+class AuditoriumBooking(BaseModel):
+    id: int
+    building_id: int
+    room_number: int
+    max_capacity: int | None
+    booked_minutes: int
+
+class CounterRepairs(BaseModel):
+    repaired: dict[str, int]
+
+class DepartmentOut(BaseModel):
+    id: int
+    faculty_id: int
+    name: str
+    desc: Optional[str]
+    url: Optional[str]
+
+    class Config:
+        orm_mode = True
+
+class TranscriptCourse(BaseModel):
+    course_id: int
+    name: str
+    semester_id: int | None
+    semester_start: datetime | None
+    semester_end: datetime | None
+    grade_id: int | None
+    grade: int | None
+
+class TranscriptOut(BaseModel):
+    student: StudentOut
+    group: GroupOut
+    department: DepartmentOut
+    courses: list[TranscriptCourse]
+
+class ChangeEntity(str, Enum):
+    student = "student"
+    course = "course"
+    grade = "grade"
+
+class ChangeOut(BaseModel):
+    seq: int
+    entity: ChangeEntity
+    entity_id: int
+    op: str = Field(..., example="upsert")
+    # the row as committed, null for deletes
+    data: dict | None
+    created_at: datetime
+
+class ChangePage(BaseModel):
+    items: list[ChangeOut]
+    # pass as `since` to get the next batch
+    next_since: int
+
+# non-developed classes
 
 # class Faculty(BaseModel):
 #     id: int
@@ -107,17 +285,6 @@ class CourseGradeUpdate(BaseModel):
 #     class Config:
 #         orm_mode = True
 
-# class Timeslot(BaseModel):
-#     id: int
-#     auditorium_id: Optional[int]
-#     class_id: Optional[int]
-#     exam_id: Optional[int]
-#     start: datetime
-#     end: datetime
-
-#     class Config:
-#         orm_mode = True
-
 # class Class(BaseModel):
 #     id: int
 #     name: str
@@ -143,18 +310,6 @@ class CourseGradeUpdate(BaseModel):
 #     class Config:
 #         orm_mode = True
 
-# class Auditorium(BaseModel):
-#     id: int
-#     building_id: int
-#     room_number: int
-#     floor: int
-#     max_capacity: int
-#     has_projector: bool
-#     has_board: bool
-
-#     class Config:
-#         orm_mode = True
-
 # class Building(BaseModel):
 #     id: int
 #     department_id: Optional[int]
@@ -0,0 +1,275 @@
+"""Seeded synthetic university for capacity planning and the load benchmark.
+
+    python -m benchmarks.dataset --students 100000 --seed 0 --reset
+
+Builds faculties -> departments -> groups -> students, one curriculum per department and intake year with a
+semester for every term since that intake, the courses of every semester, enrollments, professors,
+auditoriums, weekly timeslots and grades for every finished term. The same arguments always produce the
+same rows. Rows are streamed into the database (DATABASE_URL) with COPY, a 100k student university is
+about 3M enrollments, 2M grades and 1M timeslots.
+The API keeps in-process caches and indexes, restart it after loading.
+"""
+import argparse
+import asyncio
+import math
+import random
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import text
+from app import counters, crud, models
+from app.db import Base, async_session, engine
+from app.migrations import upgrade
+
+YEARS = 4  # intakes studying at the same time
+GROUPS_PER_INTAKE = 4  # per department, every group of an intake takes the same courses
+GROUP_SIZE = (20, 30)
+COURSES_PER_TERM = 6
+PROFESSORS_PER_DEPARTMENT = 12
+DEPARTMENTS_PER_FACULTY = 8
+LECTURE_HALLS_PER_DEPARTMENT = 3  # booked by the timetable, big enough for a whole intake
+ROOMS_PER_DEPARTMENT = 3  # small rooms, only there for the availability search
+SESSIONS_PER_WEEK = 2
+WEEKS = 16
+DAYS = 5
+SLOTS_PER_DAY = 6
+FIRST_SLOT = timedelta(hours=9)
+SLOT_LENGTH = timedelta(minutes=90)
+SLOT_STEP = timedelta(minutes=100)
+
+FIELDS = [
+    "Mathematics", "Physics", "Chemistry", "Biology", "Linguistics", "History", "Economics", "Law",
+    "Computer Science", "Philosophy", "Geology", "Psychology", "Sociology", "Journalism", "Medicine", "Architecture",
+]
+SUBJECTS = [
+    "Математика", "Линейная алгебра", "Математический анализ", "Физика", "Химия", "История", "Философия",
+    "Программирование", "Статистика", "Английский язык", "Экономика", "Теория вероятностей", "Дискретная математика",
+    "Базы данных", "Механика", "Социология", "Право", "Психология", "Логика", "Риторика",
+]
+MALE_NAMES = ["Александр", "Дмитрий", "Максим", "Сергей", "Андрей", "Алексей", "Артём", "Илья", "Кирилл", "Михаил", "Никита", "Матвей", "Фёдор", "Иван", "Егор", "Пётр"]
+FEMALE_NAMES = ["Анастасия", "Мария", "Дарья", "Анна", "Елизавета", "Полина", "Виктория", "Екатерина", "Софья", "Алёна", "Ксения", "Ольга", "Наталья", "Юлия", "Татьяна", "Ирина"]
+# male surnames, the female form adds an "а"
+SURNAMES = ["Иванов", "Смирнов", "Кузнецов", "Попов", "Васильев", "Петров", "Соколов", "Михайлов", "Новиков", "Фёдоров", "Морозов", "Волков", "Алексеев", "Лебедев", "Семёнов", "Егоров", "Павлов", "Козлов", "Степанов", "Николаев", "Орлов", "Андреев", "Макаров", "Никитин", "Захаров", "Зайцев", "Соловьёв", "Борисов", "Яковлев", "Григорьев", "Романов", "Воробьёв"]
+STREETS = ["Main", "Oak", "Pine", "Elm", "Lenina", "Pushkina", "Gagarina", "Mira", "Sadovaya", "Tverskaya"]
+
+class Term:
+    def __init__(self, index: int, year: int, autumn: bool):
+        self.index = index
+        self.start = datetime(year, 9, 1) if autumn else datetime(year, 2, 1)
+        self.end = self.start + timedelta(weeks=WEEKS + 2)  # two weeks of exams after the classes
+        self.first_monday = self.start + timedelta(days=(7 - self.start.weekday()) % 7)
+
+    def period_start(self, week: int, period: int) -> datetime:
+        day, slot = divmod(period, SLOTS_PER_DAY)
+        return self.first_monday + timedelta(weeks=week, days=day) + FIRST_SLOT + slot * SLOT_STEP
+
+class University:
+    """The plan of the whole dataset. Small tables are kept as row lists, the big ones are generated
+    while they are copied, from the plan and per-course random streams."""
+
+    def __init__(self, students: int, seed: int, year: int):
+        self.seed = seed
+        rng = random.Random(seed)
+        # terms from the autumn of the oldest intake up to the spring of `year`, which is the current one
+        self.terms = [Term(index, year - YEARS + (index + 1) // 2, index % 2 == 0) for index in range(2 * YEARS)]
+        department_count = max(1, math.ceil(students / (YEARS * GROUPS_PER_INTAKE * sum(GROUP_SIZE) / 2)))
+        faculty_count = math.ceil(department_count / DEPARTMENTS_PER_FACULTY)
+
+        self.faculties = [(id, f"{id:02d}.03.01", f"Faculty of {FIELDS[(id - 1) % len(FIELDS)]} {id}") for id in range(1, faculty_count + 1)]
+        self.departments = []
+        self.groups = []  # (id, department_id, enrolled_at)
+        self.group_students = {}  # group id -> (first student id, count)
+        self.professors = []
+        self.curricula = []
+        self.semesters = []
+        self.courses = []  # (id, semester_id, name, desc)
+        self.course_professors = []
+        self.course_plan = []  # (course id, term, group ids, difficulty)
+        self.buildings = []
+        self.auditoriums = []
+        self.lecture_halls = []
+        next_student = 1
+        for department_id in range(1, department_count + 1):
+            field = FIELDS[(department_id - 1) % len(FIELDS)]
+            self.departments.append((department_id, (department_id - 1) // DEPARTMENTS_PER_FACULTY + 1, f"{field} Department {department_id}", f"Department of {field}", f"https://university.example/departments/{department_id}"))
+            professor_ids = []
+            for _ in range(PROFESSORS_PER_DEPARTMENT):
+                professor_ids.append(len(self.professors) + 1)
+                self.professors.append((len(self.professors) + 1, department_id, self.person_name(rng), self.phone(rng), self.address(rng)))
+
+            for intake in range(YEARS):
+                first_term = 2 * (YEARS - 1 - intake)
+                group_ids = []
+                for _ in range(GROUPS_PER_INTAKE):
+                    group_id = len(self.groups) + 1
+                    self.groups.append((group_id, department_id, self.terms[first_term].start))
+                    size = rng.randint(*GROUP_SIZE)
+                    self.group_students[group_id] = (next_student, size)
+                    next_student += size
+                    group_ids.append(group_id)
+                curriculum_id = len(self.curricula) + 1
+                self.curricula.append((curriculum_id, department_id, f"{field}, {self.terms[first_term].start.year} intake"))
+                for term in self.terms[first_term:]:
+                    semester_id = len(self.semesters) + 1
+                    self.semesters.append((semester_id, curriculum_id, term.start, term.end))
+                    for subject in rng.sample(SUBJECTS, COURSES_PER_TERM):
+                        course_id = len(self.courses) + 1
+                        self.courses.append((course_id, semester_id, f"{subject} {term.index - first_term + 1}", f"{subject} for {field} students"))
+                        # one lecturer, every fourth course also has a second one
+                        for professor_id in rng.sample(professor_ids, 2 if rng.random() < 0.25 else 1):
+                            self.course_professors.append((course_id, professor_id))
+                        self.course_plan.append((course_id, term, group_ids, rng.gauss(0, 0.4)))
+
+            if department_id % 2 == 1:
+                building_id = len(self.buildings) + 1
+                self.buildings.append((building_id, department_id, self.address(rng), f"Building {building_id}", rng.randint(3, 8)))
+            for number in range(LECTURE_HALLS_PER_DEPARTMENT + ROOMS_PER_DEPARTMENT):
+                auditorium_id = len(self.auditoriums) + 1
+                lecture_hall = number < LECTURE_HALLS_PER_DEPARTMENT
+                capacity = rng.choice((150, 200, 300)) if lecture_hall else rng.choice((20, 30, 40))
+                floor = rng.randint(1, self.buildings[-1][4])
+                self.auditoriums.append((auditorium_id, building_id, floor * 100 + number + 1, floor, capacity, lecture_hall or rng.random() < 0.5, rng.random() < 0.8))
+                if lecture_hall:
+                    self.lecture_halls.append(auditorium_id)
+        self.student_count = next_student - 1
+        # ability per student, shifts all of their grades
+        self.abilities = [rng.gauss(0, 0.7) for _ in range(self.student_count)]
+
+    @staticmethod
+    def person_name(rng: random.Random) -> str:
+        surname = rng.choice(SURNAMES)
+        if rng.random() < 0.5:
+            return f"{rng.choice(MALE_NAMES)} {surname}"
+        return f"{rng.choice(FEMALE_NAMES)} {surname}а"
+
+    @staticmethod
+    def phone(rng: random.Random) -> str:
+        return f"9{rng.randrange(10 ** 9):09d}"
+
+    @staticmethod
+    def address(rng: random.Random) -> str:
+        return f"{rng.randint(1, 200)} {rng.choice(STREETS)} St"
+
+    def students(self):
+        rng = random.Random(f"{self.seed}:students")
+        for group_id, (first, count) in self.group_students.items():
+            for student_id in range(first, first + count):
+                yield (student_id, group_id, self.person_name(rng), self.phone(rng), self.address(rng))
+
+    def _course_students(self, group_ids):
+        for group_id in group_ids:
+            first, count = self.group_students[group_id]
+            yield from range(first, first + count)
+
+    def enrollments(self):
+        for course_id, _, group_ids, _ in self.course_plan:
+            for student_id in self._course_students(group_ids):
+                yield (course_id, student_id)
+
+    def grades(self):
+        # every finished term is graded, the current one (the last) is not yet
+        current = self.terms[-1]
+        grade_id = 0
+        for course_id, term, group_ids, difficulty in self.course_plan:
+            if term is current:
+                continue
+            rng = random.Random(f"{self.seed}:grades:{course_id}")
+            for student_id in self._course_students(group_ids):
+                grade_id += 1
+                grade = round(3.8 + self.abilities[student_id - 1] - difficulty + rng.gauss(0, 0.6))
+                yield (grade_id, student_id, min(5, max(2, grade)), course_id)
+
+    def timeslots(self):
+        # in every term the sessions are dealt round robin over (lecture hall, period) pairs, so a hall is never double booked
+        periods = DAYS * SLOTS_PER_DAY
+        timeslot_id = 0
+        by_term = {}
+        for course_id, term, _, _ in self.course_plan:
+            by_term.setdefault(term.index, (term, []))[1].append(course_id)
+        for term, course_ids in by_term.values():
+            sessions = [course_id for course_id in course_ids for _ in range(SESSIONS_PER_WEEK)]
+            if len(sessions) > len(self.lecture_halls) * periods:
+                raise ValueError("not enough lecture halls for a term's sessions")
+            for slot, course_id in enumerate(sessions):
+                hall, period = divmod(slot, periods)
+                for week in range(WEEKS):
+                    start = term.period_start(week, period)
+                    timeslot_id += 1
+                    yield (timeslot_id, self.lecture_halls[hall], course_id, None, None, start, start + SLOT_LENGTH)
+
+    def tables(self):
+        # in foreign key order, rows are tuples in the table's column order unless the columns are given
+        yield models.Faculty.__table__, None, self.faculties
+        yield models.Department.__table__, None, self.departments
+        yield models.Group.__table__, None, self.groups
+        yield models.Student.__table__, None, self.students()
+        yield models.Professor.__table__, None, self.professors
+        yield models.Curriculum.__table__, None, self.curricula
+        yield models.Semester.__table__, None, self.semesters
+        yield models.Course.__table__, None, self.courses
+        yield models.course_students, None, self.enrollments()
+        yield models.course_professors, None, self.course_professors
+        yield models.Building.__table__, None, self.buildings
+        yield models.Auditorium.__table__, None, self.auditoriums
+        yield models.Timeslot.__table__, None, self.timeslots()
+        yield models.Grade.__table__, ["id", "student_id", "grade", "course_id"], self.grades()
+
+class _Counted:
+    # counts the rows COPY pulls out of a generator
+    def __init__(self, rows):
+        self.rows = rows
+        self.count = 0
+
+    def __iter__(self):
+        for row in self.rows:
+            self.count += 1
+            yield row
+
+async def load(university: University, reset: bool) -> dict[str, int]:
+    counts = {}
+    async with engine.begin() as conn:
+        if reset:
+            tables = ", ".join(table.name for table in Base.metadata.sorted_tables)
+            await conn.execute(text(f"TRUNCATE {tables} RESTART IDENTITY CASCADE"))
+        elif (await conn.execute(text("SELECT EXISTS (SELECT 1 FROM faculties) OR EXISTS (SELECT 1 FROM students)"))).scalar():
+            raise SystemExit("The database already has data, pass --reset to replace them.")
+        # COPY goes through asyncpg directly, inside the transaction sqlalchemy has begun
+        raw = await conn.get_raw_connection()
+        for table, columns, rows in university.tables():
+            started = time.perf_counter()
+            if columns is None:
+                # server defaulted columns (row versions) are left to the database
+                columns = [column.name for column in table.columns if column.server_default is None]
+            counted = _Counted(rows)
+            await raw.driver_connection.copy_records_to_table(table.name, records=counted, columns=columns)
+            counts[table.name] = counted.count
+            print(f"{table.name:>16} {counted.count:>10} rows {time.perf_counter() - started:>8.2f}s")
+        # ids were given explicitly, move the sequences past them
+        for table in Base.metadata.sorted_tables:
+            if "id" in table.columns and table.columns["id"].autoincrement is not False and table.name in counts:
+                await conn.execute(text(f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), GREATEST((SELECT max(id) FROM {table.name}), 1))"))
+    async with async_session() as session:
+        await crud.rebuild_grade_histograms(session)
+    # counters aren't part of the COPY, they are counted once everything is in
+    await counters.reconcile()
+    async with engine.connect() as conn:
+        await conn.execute(text("ANALYZE"))
+    return counts
+
+async def run(args):
+    await upgrade()
+    started = time.perf_counter()
+    university = University(args.students, args.seed, args.year)
+    counts = await load(university, args.reset)
+    print(f"{sum(counts.values())} rows in {time.perf_counter() - started:.1f}s")
+    await engine.dispose()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--students", type=int, default=10000, help="approximate, students come in whole groups")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--year", type=int, default=2024, help="the spring term of this year is the current, ungraded one")
+    parser.add_argument("--reset", action="store_true", help="truncate every table first")
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+"""Latency and throughput of the API per endpoint, at a fixed concurrency.
+
+    python -m benchmarks.load --url http://localhost:8000 --concurrency 32 --duration 30 --output load.json
+    python -m benchmarks.load --baseline previous.json   # also print the change against an earlier run
+
+Meant for an API running against a local Postgres filled by benchmarks.dataset. Ids and names are sampled from
+that database (DATABASE_URL) up front. Every router runs for --duration seconds on its own, with the
+concurrency shared by its endpoints according to their weights.
+The grades router writes: it grades ungraded enrollments and re-grades existing grades, so reload the dataset
+before runs that are going to be compared.
+"""
+import argparse
+import asyncio
+import json
+import math
+import platform
+import random
+import subprocess
+import time
+from datetime import datetime, timezone
+import httpx
+from sqlalchemy import text
+from app.db import engine
+
+SAMPLE_SIZE = 2000
+ROUTERS = ["students", "courses", "grades", "professors"]
+
+class Sample:
+    """Ids and names to build requests from, drawn from the benchmarked database."""
+
+    async def load(self, client: httpx.AsyncClient):
+        async with engine.connect() as conn:
+            async def column(query: str) -> list:
+                return (await conn.execute(text(query), {"limit": SAMPLE_SIZE})).scalars().all()
+            self.student_ids = await column("SELECT id FROM students ORDER BY random() LIMIT :limit")
+            self.course_ids = await column("SELECT id FROM courses WHERE EXISTS (SELECT 1 FROM course_students WHERE course_id = courses.id) ORDER BY random() LIMIT :limit")
+            self.grade_ids = await column("SELECT id FROM grades ORDER BY random() LIMIT :limit")
+            self.student_names = await column("SELECT name FROM students ORDER BY random() LIMIT :limit")
+            self.professor_names = await column("SELECT name FROM professors ORDER BY random() LIMIT :limit")
+            # enough ungraded enrollments that no run of a sane duration runs out of them
+            ungraded_query = await conn.execute(text(
+                "SELECT cs.course_id, cs.student_id FROM course_students cs "
+                "LEFT JOIN grades g ON g.student_id = cs.student_id AND g.course_id = cs.course_id "
+                "WHERE g.id IS NULL ORDER BY random() LIMIT :limit"
+            ), {"limit": SAMPLE_SIZE * 50})
+            self.ungraded = [tuple(row) for row in ungraded_query]
+            self.counts = {
+                table: (await conn.execute(text(f"SELECT count(*) FROM {table}"))).scalar()
+                for table in ("students", "professors", "courses", "course_students", "timeslots", "grades")
+            }
+        if not self.student_ids or not self.course_ids:
+            raise SystemExit("The database is empty, fill it with benchmarks.dataset first.")
+        # cursors of later professor pages, the first page alone would only ever read the start of the index
+        self.professor_cursors = [None]
+        response = await client.get("/professors/", params={"limit": 100})
+        while response.status_code == 200 and response.json()["next_cursor"] and len(self.professor_cursors) < 50:
+            self.professor_cursors.append(response.json()["next_cursor"])
+            response = await client.get("/professors/", params={"limit": 100, "after": self.professor_cursors[-1]})
+
+def _typo(rng: random.Random, name: str) -> str:
+    # search by surname, every third query with a dropped letter
+    word = name.split()[-1]
+    if len(word) > 4 and rng.random() < 1 / 3:
+        index = rng.randrange(1, len(word))
+        word = word[:index] + word[index + 1:]
+    return word
+
+# endpoint -> (router, weight, request builder); a builder returns the arguments of client.request
+def _endpoints(sample: Sample, rng: random.Random) -> dict:
+    def add_grade():
+        if not sample.ungraded:
+            return None
+        course_id, student_id = sample.ungraded.pop()
+        return "POST", "/grades/", {"json": {"student_id": student_id, "course_id": course_id, "grade": rng.randint(2, 5)}}
+
+    return {
+        "GET /students/{id}": ("students", 5, lambda: ("GET", f"/students/{rng.choice(sample.student_ids)}", {})),
+        "GET /students/{id}/transcript": ("students", 2, lambda: ("GET", f"/students/{rng.choice(sample.student_ids)}/transcript", {})),
+        "GET /students/search": ("students", 1, lambda: ("GET", "/students/search", {"params": {"q": _typo(rng, rng.choice(sample.student_names))}})),
+        "GET /courses/{id}": ("courses", 4, lambda: ("GET", f"/courses/{rng.choice(sample.course_ids)}", {})),
+        "GET /courses/{id}/students": ("courses", 2, lambda: ("GET", f"/courses/{rng.choice(sample.course_ids)}/students", {"params": {"limit": 100}})),
+        "POST /grades/": ("grades", 1, add_grade),
+        "PUT /grades/{id}": ("grades", 2, lambda: ("PUT", f"/grades/{rng.choice(sample.grade_ids)}", {"json": {"grade": rng.randint(2, 5)}})),
+        "GET /professors/": ("professors", 3, lambda: ("GET", "/professors/", {"params": {
+            "limit": 100, **({"after": cursor} if (cursor := rng.choice(sample.professor_cursors)) else {})
+        }})),
+        "GET /professors/search": ("professors", 1, lambda: ("GET", "/professors/search", {"params": {"q": _typo(rng, rng.choice(sample.professor_names))}})),
+    }
+
+def _percentile(ordered: list[float], percent: float) -> float | None:
+    # nearest rank
+    if not ordered:
+        return None
+    return ordered[max(0, math.ceil(percent / 100 * len(ordered)) - 1)]
+
+async def run_router(client: httpx.AsyncClient, endpoints: dict, concurrency: int, duration: float, seed: int) -> dict:
+    rng = random.Random(seed)
+    names = list(endpoints)
+    weights = [endpoints[name][1] for name in names]
+    latencies = {name: [] for name in names}
+    errors = {name: 0 for name in names}
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        while time.perf_counter() < deadline:
+            name = rng.choices(names, weights)[0]
+            request = endpoints[name][2]()
+            if request is None:
+                continue
+            method, url, kwargs = request
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, url, **kwargs)
+                failed = response.status_code >= 400
+            except httpx.HTTPError:
+                failed = True
+            latencies[name].append(time.perf_counter() - started)
+            errors[name] += failed
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    results = {}
+    for name in names:
+        ordered = sorted(latencies[name])
+        results[name] = {
+            "requests": len(ordered),
+            "errors": errors[name],
+            "throughput": len(ordered) / elapsed,
+            **{f"p{percent}_ms": None if (value := _percentile(ordered, percent)) is None else value * 1000 for percent in (50, 95, 99)},
+        }
+    return results
+
+def _git_revision() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def _print_results(results: dict, baseline: dict | None):
+    print(f"{'endpoint':<32} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}" + ("  p95 / req/s vs baseline" if baseline else ""))
+    for name, result in results.items():
+        line = f"{name:<32} {result['throughput']:>8.1f} " + " ".join(
+            f"{result[key]:>8.1f}" if result[key] is not None else f"{'-':>8}" for key in ("p50_ms", "p95_ms", "p99_ms")
+        ) + f" {result['errors']:>7}"
+        previous = (baseline or {}).get(name)
+        if previous and previous["p95_ms"] and result["p95_ms"] and previous["throughput"]:
+            line += f"  {(result['p95_ms'] / previous['p95_ms'] - 1) * 100:+6.1f}% / {(result['throughput'] / previous['throughput'] - 1) * 100:+6.1f}%"
+        print(line)
+
+async def run(args):
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)["results"]
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=args.timeout) as client:
+        sample = Sample()
+        await sample.load(client)
+        await engine.dispose()
+        endpoints = _endpoints(sample, random.Random(args.seed))
+        results = {}
+        for router in args.routers:
+            router_endpoints = {name: endpoint for name, endpoint in endpoints.items() if endpoint[0] == router}
+            if args.warmup:
+                await run_router(client, router_endpoints, args.concurrency, args.warmup, args.seed)
+            results.update(await run_router(client, router_endpoints, args.concurrency, args.duration, args.seed))
+
+    _print_results(results, baseline)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({
+                "benchmark": "load",
+                "revision": _git_revision(),
+                "started_at": datetime.now(timezone.utc).isoformat(),
+                "python": platform.python_version(),
+                "args": vars(args),
+                "dataset": sample.counts,
+                "results": results,
+            }, file, indent=2)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--routers", nargs="+", choices=ROUTERS, default=ROUTERS)
+    parser.add_argument("--concurrency", type=int, default=32, help="requests in flight")
+    parser.add_argument("--duration", type=float, default=30.0, help="measured seconds per router")
+    parser.add_argument("--warmup", type=float, default=5.0, help="unmeasured seconds per router before that")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", help="JSON written by an earlier run to compare against")
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
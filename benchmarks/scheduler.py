@@ -0,0 +1,59 @@
+"""Solve time of the timetable solver against course count on synthetic semesters.
+
+    python -m benchmarks.scheduler --courses 100 500 1000 2000 5000
+"""
+import argparse
+import json
+import random
+from app.scheduler import CourseDemand, Room, solve
+
+GROUP_SIZE = 25
+
+def synthetic_semester(course_count: int, days: int, slots_per_day: int, sessions: int, seed: int):
+    rng = random.Random(seed)
+    # every course is taken by 1-3 groups, every group ends up with about 8 courses and every professor with 3
+    group_count = max(1, course_count * 2 // 8)
+    professor_count = max(1, course_count // 3)
+    courses = []
+    for course_id in range(course_count):
+        groups = rng.sample(range(group_count), k=min(group_count, rng.randint(1, 3)))
+        students = frozenset(group * GROUP_SIZE + seat for group in groups for seat in range(GROUP_SIZE))
+        professors = frozenset(rng.sample(range(professor_count), k=min(professor_count, rng.choice((1, 1, 2)))))
+        courses.append(CourseDemand(course_id, students, professors))
+    # a third more room-periods than sessions, with capacities that cover the largest courses
+    room_count = max(1, int(course_count * sessions * 4 / 3 / (days * slots_per_day)) + 1)
+    rooms = [Room(room_id, rng.choice((30, 30, 50, 80, 120, 200))) for room_id in range(room_count)]
+    return courses, rooms
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--courses", type=int, nargs="+", default=[100, 500, 1000, 2000, 5000])
+    parser.add_argument("--days", type=int, default=5)
+    parser.add_argument("--slots-per-day", type=int, default=6)
+    parser.add_argument("--sessions", type=int, default=1)
+    parser.add_argument("--time-budget", type=float, default=5.0, help="seconds of local search after the greedy pass")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="also write the results as JSON to this file")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'courses':>8} {'rooms':>6} {'scheduled':>10} {'unscheduled':>12} {'seconds':>8}")
+    for course_count in args.courses:
+        courses, rooms = synthetic_semester(course_count, args.days, args.slots_per_day, args.sessions, args.seed)
+        solution = solve(courses, rooms, args.days, args.slots_per_day, args.sessions, time_budget=args.time_budget, seed=args.seed)
+        scheduled = course_count - len(solution.unscheduled)
+        print(f"{course_count:>8} {len(rooms):>6} {scheduled:>10} {len(solution.unscheduled):>12} {solution.solve_seconds:>8.3f}")
+        results.append({
+            "courses": course_count,
+            "rooms": len(rooms),
+            "scheduled": scheduled,
+            "unscheduled": len(solution.unscheduled),
+            "solve_seconds": solution.solve_seconds,
+        })
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({"benchmark": "scheduler", "args": vars(args), "results": results}, file, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Cost of turning a page of students into response bytes, per serialization path.
+
+    python -m benchmarks.serialization --rows 1000 10000 100000
+
+orm      ORM instances -> parse_obj_as -> StudentPage -> fastapi's response_model validation and jsonable_encoder -> json
+rows     column rows (what crud selects) -> the same pydantic path
+fast     column rows -> dicts -> orjson, the path the list routes take (app/serialization.py)
+
+Runs in process without a database, so it measures only the CPU spent after the rows have been fetched.
+"""
+import argparse
+import asyncio
+import json
+import time
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+from pydantic import parse_obj_as
+from sqlalchemy.engine.result import result_tuple
+from app import models, schemas
+from app.serialization import TrustedJSONResponse, row_dicts
+
+FIELDS = list(schemas.StudentOut.__fields__)
+
+def synthetic_rows(count: int) -> list:
+    make_row = result_tuple(FIELDS)
+    values = {"id": 0, "group_id": 0, "name": "Алёна Соловьёва", "phone": "9123456789", "address": "12 Lenina St"}
+    return [make_row(tuple({**values, "id": id, "group_id": id // 25}[field] for field in FIELDS)) for id in range(1, count + 1)]
+
+async def pydantic_path(items: list) -> bytes:
+    # what a route with response_model=StudentPage did: validate into the schema, then let fastapi validate and encode it again
+    page = schemas.StudentPage(items=parse_obj_as(list[schemas.StudentOut], items), next_cursor=None)
+    content = await serialize_response(field=create_response_field(name="response", type_=schemas.StudentPage), response_content=page)
+    return JSONResponse(content).body
+
+async def orm_path(rows: list) -> bytes:
+    students = [models.Student(**row._asdict()) for row in rows]
+    return await pydantic_path(students)
+
+async def rows_path(rows: list) -> bytes:
+    return await pydantic_path(rows)
+
+async def fast_path(rows: list) -> bytes:
+    return TrustedJSONResponse({"items": row_dicts(rows), "next_cursor": None}).body
+
+PATHS = {"orm": orm_path, "rows": rows_path, "fast": fast_path}
+
+async def measure(path, rows: list, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        await path(rows)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+async def run(args):
+    results = []
+    print(f"{'rows':>8} " + " ".join(f"{name + ' ms':>10}" for name in PATHS) + f" {'speedup':>8}")
+    for count in args.rows:
+        rows = synthetic_rows(count)
+        # every path has to produce the same document
+        documents = {name: json.loads(await path(rows[:100])) for name, path in PATHS.items()}
+        assert all(document == documents["orm"] for document in documents.values())
+        seconds = {name: await measure(path, rows, args.repeat) for name, path in PATHS.items()}
+        speedup = seconds["orm"] / seconds["fast"]
+        print(f"{count:>8} " + " ".join(f"{seconds[name] * 1000:>10.1f}" for name in PATHS) + f" {speedup:>7.1f}x")
+        results.append({"rows": count, **{f"{name}_seconds": value for name, value in seconds.items()}, "speedup": speedup})
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({"benchmark": "serialization", "args": vars(args), "results": results}, file, indent=2)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--repeat", type=int, default=5, help="best of this many runs is reported")
+    parser.add_argument("--output", help="also write the results as JSON to this file")
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()